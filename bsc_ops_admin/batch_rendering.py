@@ -0,0 +1,131 @@
+"""Fills in the Google Docs PDF templates for a whole run with a few batch requests.
+
+Filling in one PDF takes a copy, an update and a delete request, so doing it per PDF costs a round trip for
+every step of every document. Here the copies of all documents go out in one batch request (per
+BATCH_MAX_SIZE documents), then all of the updates, and at the end all of the deletes. Exports return file
+contents, which can't be batched, so they are sent concurrently instead. The copies are deleted even if a step
+in between fails.
+"""
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bsc_ops_admin.scheduler import RETRYABLE_WRITE_STATUSES, acquire_quota, get_error_status
+from bsc_ops_admin.utils import PdfArtifact, unwrap_request
+
+# Drive allows at most 100 calls in one batch request
+BATCH_MAX_SIZE = 100
+# Sub-requests that are rejected with a 429 are sent again in a new batch this many times. All of the batches here
+# are writes, which aren't sent again after a 5xx since they may have been done anyway.
+MAX_BATCH_RETRIES = 3
+
+
+def get_replace_all_text_requests(form_data):
+    return [
+        {"replaceAllText": {"containsText": {"text": key, "matchCase": "true"}, "replaceText": value}}
+        for key, value in form_data.items()
+    ]
+
+
+def execute_in_batches(service, requests, sleep=time.sleep, results=None):
+    # Returns a (response, exception) pair for each request, in order. A failed sub-request only fails itself.
+    # They are filled into results as they come in, so the ones that are done are known even if a batch fails.
+    if results is None:
+        results = [(None, None)] * len(requests)
+    pending = list(range(len(requests)))
+    for attempt in range(MAX_BATCH_RETRIES + 1):
+        failed = []
+
+        def callback(request_id, response, exception):
+            i = int(request_id)
+            results[i] = (response, exception)
+            if exception is not None and get_error_status(exception) in RETRYABLE_WRITE_STATUSES:
+                failed.append(i)
+
+        for start in range(0, len(pending), BATCH_MAX_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for i in pending[start : start + BATCH_MAX_SIZE]:
+                acquire_quota(requests[i])
+                batch.add(unwrap_request(requests[i]), request_id=str(i))
+            batch.execute()
+
+        if not failed or attempt == MAX_BATCH_RETRIES:
+            break
+        pending = sorted(failed)
+        print(f"{len(pending)} requests in the batch failed, retrying them (attempt {attempt + 1})")
+        sleep(2**attempt + random.uniform(0, 1))
+    return results
+
+
+def delete_copies(drive_service, jobs, copies):
+    copy_ids = {i: response["id"] for i, (response, _) in enumerate(copies) if response is not None}
+    try:
+        deletes = execute_in_batches(
+            drive_service, [drive_service.files().delete(fileId=copy_ids[i]) for i in copy_ids]
+        )
+    except Exception as e:
+        print(f"An error occurred while deleting the copies {', '.join(copy_ids.values())}: {e}")
+        return
+    for i, (_, exception) in zip(copy_ids, deletes):
+        if exception is not None:
+            print(f"An error occurred while deleting the copy {copy_ids[i]} of {jobs[i][0]}: {exception}")
+    print(f"Deleted {sum(exception is None for _, exception in deletes)} copies of the PDF templates")
+
+
+def fill_pdfs_in_batches(services, jobs, max_workers=4):
+    # jobs are (name, form_data, document_id). Returns a PdfArtifact, or the exception it failed with, for each job.
+    drive_service = services["drive"]
+    copies = [(None, None)] * len(jobs)
+    try:
+        execute_in_batches(
+            drive_service,
+            [drive_service.files().copy(fileId=document_id, body={"name": "tmp"}) for _, _, document_id in jobs],
+            results=copies,
+        )
+        return fill_copies(services, jobs, copies, max_workers)
+    finally:
+        delete_copies(drive_service, jobs, copies)
+
+
+def fill_copies(services, jobs, copies, max_workers):
+    docs_service = services["docs"]
+    results = [None] * len(jobs)
+    copy_ids = {}
+    for i, (response, exception) in enumerate(copies):
+        if exception is not None:
+            results[i] = exception
+        else:
+            copy_ids[i] = response["id"]
+    print(f"Created {len(copy_ids)} copies of the PDF templates")
+
+    updates = execute_in_batches(
+        docs_service,
+        [
+            docs_service.documents().batchUpdate(
+                documentId=copy_ids[i], body={"requests": get_replace_all_text_requests(jobs[i][1])}
+            )
+            for i in copy_ids
+        ],
+    )
+    filled = []
+    for i, (_, exception) in zip(copy_ids, updates):
+        if exception is not None:
+            results[i] = exception
+        else:
+            filled.append(i)
+
+    def export(i):
+        # Exports are capped at 10MB, so a single request is enough
+        pdf = services["drive"].files().export_media(fileId=copy_ids[i], mimeType="application/pdf").execute()
+        return PdfArtifact(jobs[i][0], pdf)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {i: executor.submit(export, i) for i in filled}
+    for i, future in futures.items():
+        try:
+            results[i] = future.result()
+            print(f"PDF form {jobs[i][0]} filled")
+        except Exception as e:
+            results[i] = e
+    return results
@@ -0,0 +1,238 @@
+"""Runs process_new_down_hour_entries end to end against the offline fakes and reports time, calls and bytes.
+
+python -m bsc_ops_admin.benchmark --rows 10 100 1000 --latency 0.05
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+import bsc_ops_admin.process_new_down_hours as pdh
+from bsc_ops_admin.email_templates import EmailTemplate
+from bsc_ops_admin.fakes import (
+    DOWN_HOURS_HEADER,
+    EMAIL_TEMPLATE_BODY,
+    FakeMailer,
+    make_backend,
+    make_down_hours_values,
+)
+from bsc_ops_admin.scheduler import DEFAULT_QUOTAS, RequestScheduler
+
+
+@contextlib.contextmanager
+def benchmark_settings(work_dir, batch_requests=False):
+    # Non-interactive, no limit on pending rows, and caches kept out of the package folder
+    with contextlib.ExitStack() as stack:
+        stack.enter_context(mock.patch.object(pdh, "SAFE_MODE", False))
+        stack.enter_context(mock.patch.object(pdh, "BATCH_GOOGLE_REQUESTS", batch_requests))
+        stack.enter_context(mock.patch.object(pdh, "MAX_PENDING_ROWS", float("inf")))
+        stack.enter_context(mock.patch.object(pdh, "EMAIL_TEMPLATES_CACHE_PATH", Path(work_dir) / "templates.json"))
+        stack.enter_context(mock.patch.object(pdh, "DOWN_HOURS_CURSOR_PATH", Path(work_dir) / "cursor.json"))
+        stack.enter_context(mock.patch("bsc_ops_admin.ledger.LEDGER_PATH", Path(work_dir) / "ledger.sqlite3"))
+        stack.enter_context(mock.patch("bsc_ops_admin.job_queue.JOB_QUEUE_PATH", Path(work_dir) / "jobs.sqlite3"))
+        stack.enter_context(mock.patch("builtins.input", return_value=""))
+        cwd = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            yield
+        finally:
+            os.chdir(cwd)
+
+
+def run_benchmark(
+    n_pending, n_history=1000, latency=0.05, seed=0, verbose=False, quota_scale=None, batch_requests=False
+):
+    backend = make_backend(n_pending, n_history, latency, seed=seed)
+    mailer = FakeMailer(backend)
+    scheduler = None
+    if quota_scale is not None:
+        scheduler = RequestScheduler(quotas={name: rate * quota_scale for name, rate in DEFAULT_QUOTAS.items()})
+    with tempfile.TemporaryDirectory() as work_dir, benchmark_settings(work_dir, batch_requests):
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            start = time.perf_counter()
+            pdh.process_new_down_hour_entries(services=backend.services(), mailer=mailer, scheduler=scheduler)
+            wall_time = time.perf_counter() - start
+    return {"pending_rows": n_pending, "wall_time": wall_time, "endpoints": backend.stats.summary()}
+
+
+def print_report(report):
+    endpoints = report["endpoints"]
+    total_calls = sum(stats["calls"] for stats in endpoints.values())
+    total_bytes = sum(stats["bytes_sent"] + stats["bytes_received"] for stats in endpoints.values())
+    print(
+        f"\n{report['pending_rows']} pending rows: {report['wall_time']:.2f}s wall time, "
+        f"{total_calls} calls, {total_bytes / 1024:.1f} KiB transferred"
+    )
+    print(f"  {'endpoint':<40} {'calls':>8} {'sent KiB':>10} {'received KiB':>14}")
+    for endpoint, stats in endpoints.items():
+        print(
+            f"  {endpoint:<40} {stats['calls']:>8} {stats['bytes_sent'] / 1024:>10.1f} "
+            f"{stats['bytes_received'] / 1024:>14.1f}"
+        )
+
+
+IMPORT_TIME_CODE = """
+import time
+start = time.perf_counter()
+import bsc_ops_admin.process_new_down_hours
+print(time.perf_counter() - start)
+"""
+
+NOTHING_TO_DO_CODE = """
+import sys
+import time
+start = time.perf_counter()
+from bsc_ops_admin.benchmark import run_benchmark
+run_benchmark(0, n_history={n_history}, latency=0.0)
+print(time.perf_counter() - start, "pandas" in sys.modules, "googleapiclient.discovery" in sys.modules)
+"""
+
+
+def run_in_fresh_interpreter(code):
+    return subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout.split()
+
+
+def measure_startup(n_runs=5, n_history=1000):
+    # Every measurement runs in a new interpreter, as a cron job would
+    import_times = [float(run_in_fresh_interpreter(IMPORT_TIME_CODE)[0]) for _ in range(n_runs)]
+    print(f"Import of process_new_down_hours: median {statistics.median(import_times) * 1000:.0f}ms")
+
+    results = [run_in_fresh_interpreter(NOTHING_TO_DO_CODE.format(n_history=n_history)) for _ in range(n_runs)]
+    run_times = [float(result[0]) for result in results]
+    print(
+        f"Import and run with no new rows ({n_history} rows of history, no latency): "
+        f"median {statistics.median(run_times) * 1000:.0f}ms, "
+        f"imported pandas: {results[0][1]}, imported googleapiclient.discovery: {results[0][2]}"
+    )
+
+
+def render_by_rewriting(body, format_data):
+    # How bodies were rendered before the templates were compiled, rewriting the template for every member
+    return body.replace("<", "{<").replace(">", ">}").format_map(format_data)
+
+
+def measure_template_rendering(n_bodies=10000, seed=0):
+    values = make_down_hours_values(DOWN_HOURS_HEADER, n_bodies, 0, [pdh.COURTESY_NOTICE_ACTION], seed=seed)[1:]
+    with contextlib.redirect_stdout(io.StringIO()):
+        format_data_list = [
+            pdh.make_down_hour_entry(row, row[3], row[2], row[5], row[4], row[8], False, row[1])["format_data"]
+            for row in values
+        ]
+
+    start = time.perf_counter()
+    rewritten = [render_by_rewriting(EMAIL_TEMPLATE_BODY, format_data) for format_data in format_data_list]
+    rewriting_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    template = EmailTemplate(EMAIL_TEMPLATE_BODY, name="benchmark")
+    compiled = [template.render(format_data) for format_data in format_data_list]
+    compiled_time = time.perf_counter() - start
+
+    assert compiled == rewritten
+    print(
+        f"Rendering {len(format_data_list)} email bodies: {rewriting_time * 1000:.0f}ms rewriting the template, "
+        f"{compiled_time * 1000:.0f}ms with the compiled template"
+    )
+
+
+def read_down_hours_df_at_once(sheets_service):
+    # How the down hours spreadsheet was read before it was read in pages into a compact frame
+    import numpy as np
+    import pandas as pd
+
+    df = pd.DataFrame(pdh.fetch_down_hours_values(sheets_service))
+    df.columns = df.iloc[0]
+    df = df.drop(0)
+    df["Member's Down Hours"] = df["Member's Down Hours"].replace("", np.nan).astype(float)
+    return df
+
+
+def measure_reader_memory(n_rows, seed=0):
+    # Imported before measuring, so that it isn't counted
+    importlib.import_module("pandas")
+
+    # Responses are parsed from JSON like the real API's, so that every cell read is a new string
+    services = make_backend(0, n_rows, latency=0.0, seed=seed, parse_responses=True).services()
+    readers = {
+        "all at once": lambda: read_down_hours_df_at_once(services["sheets"]),
+        "paged": lambda: pdh.get_down_hours_df_from_sheet(pdh.read_down_hours_sheet(services["sheets"])),
+    }
+    dfs = {}
+    for name, reader in readers.items():
+        # Timed without tracemalloc, which slows down every allocation
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            reader()
+        elapsed = time.perf_counter() - start
+
+        tracemalloc.start()
+        with contextlib.redirect_stdout(io.StringIO()):
+            dfs[name] = reader()
+        retained, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print(
+            f"{n_rows} rows, {name}: {elapsed * 1000:.0f}ms, peak {peak / 2**20:.1f} MiB, "
+            f"{retained / 2**20:.1f} MiB kept for the DataFrame"
+        )
+    for column in ["Member's Email", "Action", "Member's Down Hours"]:
+        assert dfs["all at once"][column].astype(object).equals(dfs["paged"][column].astype(object)), column
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark processing new down hours entries against offline fakes")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10, 100, 1000], help="Numbers of pending rows")
+    parser.add_argument("--history-rows", type=int, default=1000, help="Number of already processed rows")
+    parser.add_argument("--latency", type=float, default=0.05, help="Artificial latency per request, in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--quota-scale",
+        type=float,
+        help="Send requests through the quota scheduler, with the Google API quotas multiplied by this factor",
+    )
+    parser.add_argument("--batch-requests", action="store_true", help="Fill in the PDF templates with batch requests")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the processing script")
+    parser.add_argument("--startup", action="store_true", help="Measure import and startup time instead")
+    parser.add_argument(
+        "--memory",
+        type=int,
+        nargs="+",
+        metavar="N",
+        help="Measure the peak memory of reading N rows of down hours history instead",
+    )
+    parser.add_argument("--templates", type=int, metavar="N", help="Measure rendering N email bodies instead")
+    args = parser.parse_args()
+
+    if args.startup:
+        measure_startup(n_history=args.history_rows)
+        sys.exit()
+    if args.memory:
+        for n_rows in args.memory:
+            measure_reader_memory(n_rows, args.seed)
+        sys.exit()
+    if args.templates is not None:
+        measure_template_rendering(args.templates, args.seed)
+        sys.exit()
+
+    for n_pending in args.rows:
+        print_report(
+            run_benchmark(
+                n_pending,
+                args.history_rows,
+                args.latency,
+                args.seed,
+                args.verbose,
+                args.quota_scale,
+                args.batch_requests,
+            )
+        )
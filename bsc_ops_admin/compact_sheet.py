@@ -0,0 +1,134 @@
+"""Reads a spreadsheet in pages of rows into a compact DataFrame.
+
+Reading a whole range at once keeps every cell as its own string in a list of lists, and building a DataFrame from
+it copies all of them again. Here each page is encoded as soon as it arrives and then dropped: every column is
+dictionary encoded into integer codes, since names, emails, houses and dates repeat a lot over many semesters.
+pandas is only needed at the end, to turn the codes into categoricals, float32s, dates or Python strings.
+"""
+
+from array import array
+from itertools import zip_longest
+
+from bsc_ops_admin.utils import column_to_index
+
+DEFAULT_PAGE_SIZE = 5000
+# How many rows are listed when a column has cells that can't be converted
+MAX_ROWS_IN_WARNING = 20
+
+
+def fetch_sheet_pages(sheets_service, spreadsheet_id, range_name, page_size=DEFAULT_PAGE_SIZE):
+    # range_name is like "sheet1!A:O". Yields lists of rows, the first one starting with the header.
+    sheet_name, columns = range_name.split("!")
+    start_col, end_col = columns.split(":")
+    start_row = 1
+    # The API leaves out empty rows at the end of a range, they are added back if more rows come after them
+    trimmed_rows = 0
+    while True:
+        page_range = f"{sheet_name}!{start_col}{start_row}:{end_col}{start_row + page_size - 1}"
+        page = (
+            sheets_service.spreadsheets()
+            .values()
+            .get(spreadsheetId=spreadsheet_id, range=page_range)
+            .execute()
+            .get("values", [])
+        )
+        if not page:
+            return
+        if trimmed_rows:
+            yield [[] for _ in range(trimmed_rows)]
+        yield page
+        trimmed_rows = page_size - len(page)
+        start_row += page_size
+
+
+class ValueCodes(dict):
+    """Maps each distinct value of a column to its code, giving new values the next code as they are looked up."""
+
+    def __init__(self):
+        super().__init__({None: -1})
+
+    def __missing__(self, value):
+        code = self[value] = len(self) - 1
+        return code
+
+
+class CompactSheet:
+    """Rows of a sheet, with each column stored as codes into the column's distinct values."""
+
+    def __init__(self, pages=()):
+        self.header = None
+        self.n_rows = 0
+        # One (codes, ValueCodes) pair per column. Missing cells, past the end of their row, are None with code -1.
+        self.columns = []
+        for page in pages:
+            self.add_page(page)
+
+    def add_page(self, rows):
+        if self.header is None:
+            if not rows:
+                return
+            self.header, rows = rows[0], rows[1:]
+            self.columns = [(array("i"), ValueCodes()) for _ in self.header]
+        if not rows:
+            return
+        # Transposed into columns, so that each column is encoded with a few calls instead of one per cell.
+        # zip_longest fills in the cells past the end of short rows with None, without copying the rows to pad them.
+        n_columns = 0
+        for (codes, value_codes), cells in zip(self.columns, zip_longest(*rows)):
+            codes.extend(map(value_codes.__getitem__, cells))
+            n_columns += 1
+        # Columns past the end of every row of the page are all missing
+        for codes, _ in self.columns[n_columns:]:
+            codes.extend(array("i", [-1]) * len(rows))
+        self.n_rows += len(rows)
+
+    def count_missing(self, letter):
+        codes, _ = self.columns[column_to_index(letter)]
+        return codes.count(-1)
+
+    def to_df(self, category_columns=(), float32_columns=(), date_formats=None):
+        # Columns are given by letter, all others are strings. Only the distinct values of a column are converted.
+        # Each column's codes are released once it is converted, so the sheet can't be used again afterwards.
+        import numpy as np
+        import pandas as pd
+
+        category_columns = {column_to_index(letter) for letter in category_columns}
+        float32_columns = {column_to_index(letter) for letter in float32_columns}
+        date_formats = {column_to_index(letter): date_format for letter, date_format in (date_formats or {}).items()}
+        index = pd.RangeIndex(1, self.n_rows + 1)
+        data = {}
+        for i, name in enumerate(self.header):
+            codes, value_codes = self.columns[i]
+            self.columns[i] = None
+            codes = np.array(codes, dtype=np.int32)
+            # Without the None for missing cells, the values are in the order of their codes
+            values = np.array(list(value_codes)[1:], dtype=object)
+            if i in category_columns:
+                data[name] = pd.Categorical.from_codes(codes, categories=values)
+                continue
+            # The missing value is appended after the distinct values, so that code -1 picks it
+            if i in float32_columns:
+                values = pd.to_numeric(pd.Series(values, dtype=object).replace("", np.nan)).to_numpy(np.float32)
+                data[name] = np.append(values, np.float32(np.nan))[codes]
+            elif i in date_formats:
+                dates = pd.to_datetime(values, format=date_formats[i], errors="coerce").to_numpy()
+                warn_unparsed_cells(name, date_formats[i], codes, np.flatnonzero(np.isnat(dates) & (values != "")))
+                data[name] = np.append(dates, np.datetime64("NaT"))[codes]
+            else:
+                # Explicitly object, since "str" is a numpy unicode dtype before pandas 3, with "nan" for missing cells
+                data[name] = pd.Series(np.append(values, None)[codes], index=index, dtype=object)
+        return pd.DataFrame(data, index=index)
+
+
+def warn_unparsed_cells(name, date_format, codes, unparsed_codes):
+    # The cells are left empty in the DataFrame, so they would otherwise look like cells that were never filled in
+    import numpy as np
+
+    if not len(unparsed_codes):
+        return
+    # Sheet rows, the header is row 1
+    rows = np.flatnonzero(np.isin(codes, unparsed_codes)) + 2
+    listed = ", ".join(map(str, rows[:MAX_ROWS_IN_WARNING]))
+    if len(rows) > MAX_ROWS_IN_WARNING:
+        listed += f" and {len(rows) - MAX_ROWS_IN_WARNING} more"
+    print(f"Warning: {len(rows)} cells of column '{name}' are not dates like {date_format}, left empty: rows {listed}")
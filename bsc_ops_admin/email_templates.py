@@ -0,0 +1,77 @@
+"""Email templates from the instruction doc, compiled once per run into literal text and placeholder slots.
+
+Placeholders are written like <FIRST NAME> or <DATE (+1 week)>: angle brackets around text that starts with an
+uppercase letter. Anything else, including a lone < or > and braces, is kept as it is.
+"""
+
+import re
+import threading
+
+PLACEHOLDER_PATTERN = re.compile(r"<[A-Z][^<>\n]*>")
+# Text in angle brackets that isn't a placeholder, but might be one with a typo, e.g. <first name>
+LOOKS_LIKE_PLACEHOLDER_PATTERN = re.compile(r"<[^<>\s][^<>\n]*>")
+
+
+class EmailTemplate:
+    """A template split into literal text and placeholder slots, so rendering it is a single join."""
+
+    def __init__(self, text, name=None):
+        self.text = text
+        self.name = name
+        self.parts = []
+        # Positions in parts that are filled in with format_data values, and the placeholder for each
+        self.slots = []
+        last_end = 0
+        for match in PLACEHOLDER_PATTERN.finditer(text):
+            self.parts.append(text[last_end : match.start()])
+            self.slots.append((len(self.parts), match.group(0)))
+            self.parts.append(None)
+            last_end = match.end()
+        self.parts.append(text[last_end:])
+
+    @property
+    def placeholders(self):
+        return {placeholder for _, placeholder in self.slots}
+
+    def check_placeholders(self, known_keys, required=True):
+        # Unknown placeholders are an error in templates that are used, and only a warning in the others
+        unknown = sorted(self.placeholders - set(known_keys))
+        if unknown and required:
+            raise ValueError(f"Email template '{self.name}' has unknown placeholders: {', '.join(unknown)}")
+        if unknown:
+            print(f"Warning: email template '{self.name}' has unknown placeholders: {', '.join(unknown)}")
+        for match in LOOKS_LIKE_PLACEHOLDER_PATTERN.finditer(self.text):
+            if not PLACEHOLDER_PATTERN.fullmatch(match.group(0)):
+                print(f"Warning: {match.group(0)} in email template '{self.name}' is not a placeholder, kept as is")
+
+    def render(self, format_data):
+        parts = self.parts.copy()
+        try:
+            for position, placeholder in self.slots:
+                parts[position] = str(format_data[placeholder])
+        except KeyError as e:
+            raise KeyError(f"No value for {e.args[0]} in email template '{self.name}'") from None
+        return "".join(parts)
+
+
+def compile_email_templates(templates, known_keys, required_subjects=None):
+    # Only the templates of required_subjects (all of them by default) have to use known placeholders
+    compiled = {subject: EmailTemplate(text, name=subject) for subject, text in templates.items()}
+    for subject, template in compiled.items():
+        template.check_placeholders(known_keys, required=required_subjects is None or subject in required_subjects)
+    return compiled
+
+
+class TemplateCache:
+    """Compiled templates by instruction doc, shared by the sheet sets that are processed together."""
+
+    def __init__(self):
+        self.templates = {}
+        # Also keeps the sheet sets from reading and writing the templates cache file at the same time
+        self.lock = threading.Lock()
+
+    def get(self, document_id, load):
+        with self.lock:
+            if document_id not in self.templates:
+                self.templates[document_id] = load()
+            return self.templates[document_id]
@@ -0,0 +1,552 @@
+"""In-process stand-ins for the Google Sheets, Docs and Drive services and for the SMTP mailer.
+
+They mimic the small part of the googleapiclient interface that this package uses, keep their state in a
+shared FakeGoogleBackend, can add artificial latency to every request, and count the calls and bytes per endpoint.
+"""
+
+import hashlib
+import io
+import json
+import random
+import re
+import threading
+import time
+import zipfile
+from collections import Counter
+from datetime import datetime, timezone
+from xml.sax.saxutils import escape
+
+import bsc_ops_admin.process_new_down_hours as pdh
+from bsc_ops_admin.profiling import payload_size
+from bsc_ops_admin.utils import column_to_index
+
+DOWN_HOURS_HEADER = [
+    "Timestamp",
+    "Email Address",
+    "Member's Last Name",
+    "Member's First Name",
+    "Member's Email",
+    "House",
+    "Member's Down Hours",
+    "Existing CC",
+    "Action",
+    "Date Issued",
+]
+
+FIFTEEN_DAY_NOTICE_HEADER = [["15 Day Notices"], ["", "Last Name", "First Name", "Email", "House", "Date", "Deadline"]]
+
+EMAIL_TEMPLATE_BODY = (
+    "Hi <FIRST NAME>,\n\n"
+    "As of <DATE> you are down hours in <HOUSE> for <SEMESTER, YEAR>.\n"
+    "Please respond by <DATE (+1 week)>, otherwise we will follow up on <DATE (+15 days)>.\n\n"
+    "<OPS_SUPERVISOR>"
+)
+
+PDF_TEMPLATE_TEXT = (
+    "<FULL NAME> (<EMAIL>), <HOUSE>\n"
+    "Notice issued <DATE> for <SEMESTER, YEAR>, existing conditional contract: <EXISTING CC>.\n"
+    "This must be resolved by <DATE (+15 days)>.\n" + "Terms and conditions of membership.\n" * 50
+)
+
+A1_PATTERN = re.compile(r"^([A-Z]*)(\d*)$")
+PARENT_QUERY_PATTERN = re.compile(r"'([^']+)' in parents")
+APP_PROPERTY_QUERY_PATTERN = re.compile(
+    r"appProperties has \{ key='((?:[^'\\]|\\.)*)' and value='((?:[^'\\]|\\.)*)' \}"
+)
+QUERY_ESCAPE_PATTERN = re.compile(r"\\(.)")
+
+
+def parse_a1_range(range_name):
+    # Returns the sheet name and 0-indexed (start row, start col, end row, end col), with None for open ends
+    sheet_name, _, cells = range_name.partition("!")
+    start, _, end = cells.partition(":")
+    end = end or start
+    start_col, start_row = A1_PATTERN.match(start).groups()
+    end_col, end_row = A1_PATTERN.match(end).groups()
+    return (
+        sheet_name,
+        int(start_row) - 1 if start_row else 0,
+        column_to_index(start_col) if start_col else 0,
+        int(end_row) - 1 if end_row else None,
+        column_to_index(end_col) if end_col else None,
+    )
+
+
+class FakeApiStats:
+    def __init__(self):
+        self.calls = Counter()
+        self.bytes_sent = Counter()
+        self.bytes_received = Counter()
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, bytes_sent, bytes_received):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.bytes_sent[endpoint] += bytes_sent
+            self.bytes_received[endpoint] += bytes_received
+
+    def summary(self):
+        return {
+            endpoint: {
+                "calls": self.calls[endpoint],
+                "bytes_sent": self.bytes_sent[endpoint],
+                "bytes_received": self.bytes_received[endpoint],
+            }
+            for endpoint in sorted(self.calls)
+        }
+
+
+class FakeRequest:
+    def __init__(self, backend, endpoint, handler, body=None):
+        self.backend = backend
+        self.endpoint = endpoint
+        self.handler = handler
+        self.body = body
+
+    def execute(self, num_retries=0):
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        with self.backend.lock:
+            response = self.handler()
+        self.backend.stats.record(self.endpoint, payload_size(self.body), payload_size(response))
+        if self.backend.parse_responses and isinstance(response, dict):
+            response = json.loads(json.dumps(response))
+        return response
+
+
+class FakeBatchHttpRequest:
+    """Like googleapiclient's BatchHttpRequest: sub-requests go out in one round trip and each gets its callback."""
+
+    def __init__(self, backend, endpoint, callback=None):
+        self.backend = backend
+        self.endpoint = endpoint
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id if request_id is not None else str(len(self.requests) + 1)
+        self.requests.append((request_id, request, callback or self.callback))
+
+    def execute(self, num_retries=0):
+        if self.backend.latency:
+            time.sleep(self.backend.latency)
+        bytes_sent = bytes_received = 0
+        for request_id, request, callback in self.requests:
+            response, exception = None, None
+            try:
+                with self.backend.lock:
+                    response = request.handler()
+            except Exception as e:
+                exception = e
+            bytes_sent += payload_size(request.body)
+            bytes_received += payload_size(response)
+            if callback is not None:
+                callback(request_id, response, exception)
+        self.backend.stats.record(self.endpoint, bytes_sent, bytes_received)
+
+
+class FakeGoogleBackend:
+    """Shared state behind the fake services: spreadsheets as grids of strings, docs as plain text and Drive files."""
+
+    def __init__(self, latency=0.0, parse_responses=False):
+        self.latency = latency
+        # Return a freshly parsed copy of every JSON response, like the real API, instead of the backend's own objects
+        self.parse_responses = parse_responses
+        self.stats = FakeApiStats()
+        self.lock = threading.RLock()
+        self.spreadsheets = {}
+        self.files = {}
+        self.revision = 0
+
+    def now(self):
+        return datetime.now(timezone.utc).isoformat()
+
+    def new_id(self):
+        self.revision += 1
+        return f"fake-{self.revision}"
+
+    def add_spreadsheet(self, spreadsheet_id, values):
+        self.spreadsheets[spreadsheet_id] = [list(row) for row in values]
+        self.files[spreadsheet_id] = {
+            "id": spreadsheet_id,
+            "name": spreadsheet_id,
+            "parents": [],
+            "mimeType": "application/vnd.google-apps.spreadsheet",
+            "modifiedTime": self.now(),
+            "version": "1",
+        }
+
+    def add_document(self, document_id, text=None, document=None, name=None, parents=None):
+        self.files[document_id] = {
+            "id": document_id,
+            "name": name or document_id,
+            "parents": parents or [],
+            "mimeType": "application/vnd.google-apps.document",
+            "text": text,
+            "document": document,
+            "modifiedTime": self.now(),
+            "revisionId": self.new_id(),
+            "version": "1",
+        }
+
+    def touch(self, file_id):
+        # Like Drive, every change bumps the file's version
+        file = self.files[file_id]
+        file["modifiedTime"] = self.now()
+        file["version"] = str(int(file.get("version", "0")) + 1)
+        if "revisionId" in file:
+            file["revisionId"] = self.new_id()
+
+    def services(self):
+        return {"sheets": FakeSheetsService(self), "docs": FakeDocsService(self), "drive": FakeDriveService(self)}
+
+
+class FakeSheetsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return FakeSheetsValues(self.backend)
+
+    def batchUpdate(self, spreadsheetId, body):  # noqa: N802, N803
+        def handler():
+            grid = self.backend.spreadsheets[spreadsheetId]
+            for request in body["requests"]:
+                if "insertDimension" in request:
+                    dimension_range = request["insertDimension"]["range"]
+                    start, end = dimension_range["startIndex"], dimension_range["endIndex"]
+                    while len(grid) < start:
+                        grid.append([])
+                    grid[start:start] = [[] for _ in range(end - start)]
+                elif "updateCells" in request:
+                    update = request["updateCells"]
+                    update_range = update["range"]
+                    for row_offset, row in enumerate(update["rows"]):
+                        for col_offset, cell in enumerate(row.get("values", [])):
+                            value = cell.get("userEnteredValue", {}).get("stringValue", "")
+                            set_cell(
+                                grid,
+                                update_range["startRowIndex"] + row_offset,
+                                update_range["startColumnIndex"] + col_offset,
+                                value,
+                            )
+                else:
+                    raise ValueError(f"Unsupported request {request}")
+            self.backend.touch(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId, "replies": [{} for _ in body["requests"]]}
+
+        return FakeRequest(self.backend, "sheets.spreadsheets.batchUpdate", handler, body)
+
+
+def set_cell(grid, row_idx, col_idx, value):
+    while len(grid) <= row_idx:
+        grid.append([])
+    row = grid[row_idx]
+    while len(row) <= col_idx:
+        row.append("")
+    row[col_idx] = str(value)
+
+
+def write_values(grid, range_name, values):
+    _, start_row, start_col, _, _ = parse_a1_range(range_name)
+    for row_offset, row in enumerate(values):
+        for col_offset, value in enumerate(row):
+            set_cell(grid, start_row + row_offset, start_col + col_offset, value)
+
+
+class FakeSheetsValues:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, spreadsheetId, range):  # noqa: N803
+        def handler():
+            grid = self.backend.spreadsheets[spreadsheetId]
+            _, start_row, start_col, end_row, end_col = parse_a1_range(range)
+            values = []
+            for row in grid[start_row : None if end_row is None else end_row + 1]:
+                row = row[start_col : None if end_col is None else end_col + 1]
+                # Like the real API, trailing empty cells are left out
+                while row and row[-1] == "":
+                    row = row[:-1]
+                values.append(row)
+            while values and not values[-1]:
+                values.pop()
+            return {"range": range, "majorDimension": "ROWS", "values": values}
+
+        return FakeRequest(self.backend, "sheets.spreadsheets.values.get", handler)
+
+    def update(self, spreadsheetId, range, valueInputOption, body):  # noqa: N803
+        def handler():
+            values = body["values"]
+            if body.get("majorDimension") == "COLUMNS":
+                values = [list(row) for row in zip(*values)]
+            write_values(self.backend.spreadsheets[spreadsheetId], range, values)
+            self.backend.touch(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId, "updatedRange": range}
+
+        return FakeRequest(self.backend, "sheets.spreadsheets.values.update", handler, body)
+
+    def batchUpdate(self, spreadsheetId, body):  # noqa: N802, N803
+        def handler():
+            for data in body["data"]:
+                write_values(self.backend.spreadsheets[spreadsheetId], data["range"], data["values"])
+            self.backend.touch(spreadsheetId)
+            return {"spreadsheetId": spreadsheetId, "totalUpdatedRanges": len(body["data"])}
+
+        return FakeRequest(self.backend, "sheets.spreadsheets.values.batchUpdate", handler, body)
+
+
+def text_to_document(text, revision_id):
+    content = [
+        {"paragraph": {"elements": [{"textRun": {"content": line + "\n"}}]}} for line in (text or "").split("\n")
+    ]
+    return {"revisionId": revision_id, "body": {"content": content}}
+
+
+class FakeDocsService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def documents(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self.backend, "docs.batch", callback)
+
+    def get(self, documentId, fields=None):  # noqa: N803
+        def handler():
+            file = self.backend.files[documentId]
+            if fields == "revisionId":
+                return {"revisionId": file["revisionId"]}
+            if file["document"] is not None:
+                return dict(file["document"], revisionId=file["revisionId"])
+            return text_to_document(file["text"], file["revisionId"])
+
+        return FakeRequest(self.backend, "docs.documents.get", handler)
+
+    def batchUpdate(self, documentId, body):  # noqa: N802, N803
+        def handler():
+            file = self.backend.files[documentId]
+            for request in body["requests"]:
+                replace = request["replaceAllText"]
+                file["text"] = file["text"].replace(replace["containsText"]["text"], str(replace["replaceText"]))
+            self.backend.touch(documentId)
+            return {"documentId": documentId, "replies": [{} for _ in body["requests"]]}
+
+        return FakeRequest(self.backend, "docs.documents.batchUpdate", handler, body)
+
+
+def text_to_docx(text):
+    paragraphs = "".join(f"<w:p><w:r><w:t>{escape(line)}</w:t></w:r></w:p>" for line in (text or "").split("\n"))
+    document_xml = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+        f"<w:body>{paragraphs}</w:body></w:document>"
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as docx:
+        docx.writestr("word/document.xml", document_xml)
+    return output.getvalue()
+
+
+def text_to_pdf(text):
+    # Not a renderable PDF, but enough to carry the filled in text around like a real export
+    return b"%PDF-1.4\n" + (text or "").encode("utf-8") + b"\n%%EOF\n"
+
+
+def read_media_body(media_body):
+    return media_body.getbytes(0, media_body.size())
+
+
+class FakeDriveService:
+    def __init__(self, backend):
+        self.backend = backend
+
+    def files(self):
+        return self
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatchHttpRequest(self.backend, "drive.batch", callback)
+
+    def get(self, fileId, fields=None, supportsAllDrives=False):  # noqa: N803
+        def handler():
+            file = self.backend.files[fileId]
+            keys = [key.strip() for key in fields.split(",")] if fields else ["id", "name", "mimeType"]
+            return {key: file[key] for key in keys if key in file}
+
+        return FakeRequest(self.backend, "drive.files.get", handler)
+
+    def list(self, q=None, fields=None, pageSize=100, pageToken=None, **kwargs):  # noqa: N803
+        def handler():
+            # Only "'<folder id>' in parents", optionally with "appProperties has { ... }", is supported. Everything
+            # fits in one page.
+            parent = PARENT_QUERY_PATTERN.search(q).group(1)
+            app_properties = {
+                QUERY_ESCAPE_PATTERN.sub(r"\1", key): QUERY_ESCAPE_PATTERN.sub(r"\1", value)
+                for key, value in APP_PROPERTY_QUERY_PATTERN.findall(q)
+            }
+            files = [
+                {"id": file["id"], "name": file["name"], "md5Checksum": file.get("md5Checksum")}
+                for file in self.backend.files.values()
+                if parent in file["parents"] and app_properties.items() <= file.get("appProperties", {}).items()
+            ]
+            return {"files": files}
+
+        return FakeRequest(self.backend, "drive.files.list", handler)
+
+    def copy(self, fileId, body, supportsAllDrives=False):  # noqa: N803
+        def handler():
+            copy_id = self.backend.new_id()
+            original = self.backend.files[fileId]
+            self.backend.files[copy_id] = dict(original, id=copy_id, name=body.get("name", original["name"]))
+            return {"id": copy_id}
+
+        return FakeRequest(self.backend, "drive.files.copy", handler, body)
+
+    def delete(self, fileId, supportsAllDrives=False):  # noqa: N803
+        def handler():
+            del self.backend.files[fileId]
+            return ""
+
+        return FakeRequest(self.backend, "drive.files.delete", handler)
+
+    def export_media(self, fileId, mimeType):  # noqa: N803
+        def handler():
+            text = self.backend.files[fileId]["text"]
+            return text_to_pdf(text) if mimeType == "application/pdf" else text_to_docx(text)
+
+        return FakeRequest(self.backend, "drive.files.export_media", handler)
+
+    def create(self, body, fields=None, supportsAllDrives=False, media_body=None):  # noqa: N803
+        content = read_media_body(media_body) if media_body is not None else None
+
+        def handler():
+            file_id = self.backend.new_id()
+            self.backend.files[file_id] = {
+                "id": file_id,
+                "name": body.get("name"),
+                "parents": body.get("parents", []),
+                "mimeType": body.get("mimeType", "application/octet-stream"),
+                "appProperties": dict(body.get("appProperties", {})),
+                "content": content,
+                "md5Checksum": hashlib.md5(content).hexdigest() if content is not None else None,
+                "modifiedTime": self.backend.now(),
+            }
+            return {"id": file_id}
+
+        return FakeRequest(self.backend, "drive.files.create", handler, content if content is not None else body)
+
+    def update(self, fileId, media_body=None, supportsAllDrives=False):  # noqa: N803
+        content = read_media_body(media_body) if media_body is not None else None
+
+        def handler():
+            self.backend.files[fileId]["content"] = content
+            self.backend.files[fileId]["md5Checksum"] = hashlib.md5(content).hexdigest()
+            self.backend.files[fileId]["modifiedTime"] = self.backend.now()
+            return {"id": fileId}
+
+        return FakeRequest(self.backend, "drive.files.update", handler, content)
+
+
+class FakeMailer:
+    """Stand-in for mailer.Mailer that keeps the sent messages instead of talking to an SMTP server."""
+
+    def __init__(self, backend, latency=None):
+        self.backend = backend
+        self.latency = backend.latency if latency is None else latency
+        self.sent = []
+
+    def send(self, message):
+        if self.latency:
+            time.sleep(self.latency)
+        data = message.as_bytes()
+        self.backend.stats.record("smtp.send_message", len(data), 0)
+        with self.backend.lock:
+            self.sent.append(message)
+        return {
+            "to": message["To"],
+            "cc": message["Cc"],
+            "subject": message["Subject"],
+            "sent": True,
+            "status": "sent",
+            "error": None,
+        }
+
+    def send_many(self, messages):
+        return [self.send(message) for message in messages]
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def roboto_mono_paragraph(text):
+    text_style = {"weightedFontFamily": {"fontFamily": "Roboto Mono"}}
+    return {"paragraph": {"elements": [{"textRun": {"content": text, "textStyle": text_style}}]}}
+
+
+def make_instruction_document(templates):
+    # Laid out like the instruction doc: a "Subject: ..." line and the body in Roboto Mono, then regular text
+    content = []
+    for subject, body in templates.items():
+        content.append(roboto_mono_paragraph(f"Subject: {subject}\n"))
+        content += [roboto_mono_paragraph(line + "\n") for line in body.split("\n")]
+        content.append({"paragraph": {"elements": [{"textRun": {"content": "Notes for the ops admin\n"}}]}})
+    return {"body": {"content": content}}
+
+
+def make_down_hours_values(header, n_history, n_pending, actions, seed=0):
+    rng = random.Random(seed)
+    houses = ["CLO", "STB", "KNG", "DAV", "EUC", "LOT"]
+    n_members = max(1, (n_history + n_pending) // 3)
+
+    def make_row(action):
+        house = rng.choice(houses)
+        member = rng.randrange(n_members)
+        down_hours = rng.choice([10, 12, 15, 18, 25])
+        row = {
+            "Timestamp": "01/15/2024 10:00:00",
+            "Email Address": f"{house.lower()}wm@bsc.coop",
+            "Member's Last Name": f"last{member}",
+            "Member's First Name": f"first{member}",
+            "Member's Email": f"member{member}@berkeley.edu",
+            "Member's Down Hours": str(down_hours),
+        }
+        if action is not None:
+            row.update({"House": house, "Existing CC": "No", "Action": action, "Date Issued": "01/16/2024"})
+        return [row.get(column, "") for column in header]
+
+    values = [list(header)]
+    values += [make_row(rng.choice(actions)) for _ in range(n_history)]
+    values += [make_row(None) for _ in range(n_pending)]
+    return values
+
+
+def make_backend(n_pending, n_history, latency, seed=0, parse_responses=False):
+    # Every spreadsheet and document a run reads, with n_history handled rows and n_pending new ones
+    backend = FakeGoogleBackend(latency=latency, parse_responses=parse_responses)
+    backend.add_spreadsheet(
+        pdh.DOCUMENT_IDS["down_hours_spreadsheet"],
+        make_down_hours_values(
+            DOWN_HOURS_HEADER,
+            n_history,
+            n_pending,
+            [pdh.COURTESY_NOTICE_ACTION, pdh.POTENTIAL_TERMINATION_ACTION, pdh.PENDING_TERMINATION_ACTION],
+            seed=seed,
+        ),
+    )
+    backend.add_spreadsheet(pdh.DOCUMENT_IDS["15_day_notice_spreadsheet"], FIFTEEN_DAY_NOTICE_HEADER)
+    templates = {subject: EMAIL_TEMPLATE_BODY for subject in pdh.EMAIL_TEMPLATES_SUBJECT_LINES.values()}
+    backend.add_document(pdh.DOCUMENT_IDS["instruction_docs"], document=make_instruction_document(templates))
+    for name, document_id in pdh.DOCUMENT_IDS.items():
+        if document_id not in backend.spreadsheets and name != "instruction_docs":
+            backend.add_document(document_id, text=PDF_TEMPLATE_TEXT, name=name)
+    return backend
@@ -0,0 +1,78 @@
+"""Sends the follow up emails that process_new_down_hours queued, once they are due.
+
+python -m bsc_ops_admin.follow_ups           sends everything that is due
+python -m bsc_ops_admin.follow_ups --list    shows what is queued
+
+Due follow ups are found with an index lookup in the job queue, and sent in batches over one SMTP connection. The
+watcher also sends them at every poll.
+"""
+
+import argparse
+from datetime import datetime
+
+from bsc_ops_admin.job_queue import JobQueue
+from bsc_ops_admin.mailer import SENDER_EMAIL, Mailer, build_email_message
+
+FOLLOW_UP_BATCH_SIZE = 20
+
+
+def send_due_follow_ups(job_queue, mailer, batch_size=FOLLOW_UP_BATCH_SIZE):
+    # Returns the numbers of follow ups sent and not sent. Ones that failed are retried later by the job queue.
+    sent, failed = 0, 0
+    while True:
+        jobs = job_queue.get_due(limit=batch_size)
+        if not jobs:
+            return sent, failed
+        messages = [
+            build_email_message(
+                SENDER_EMAIL,
+                job["payload"]["to"],
+                job["payload"]["cc"],
+                job["payload"]["subject"],
+                job["payload"]["body"],
+                [],
+            )
+            for job in jobs
+        ]
+        done = []
+        for job, result in zip(jobs, mailer.send_many(messages)):
+            if result["sent"]:
+                print(f"Sent {job['kind']} to {job['payload']['to']}")
+                done.append(job)
+            elif result["status"] == "unknown":
+                # It may have been delivered, so it isn't retried
+                job_queue.mark_failed(job, result["error"], retry=False)
+                print(
+                    f"Not sure whether {job['kind']} was sent to {job['payload']['to']}, not retrying: {result['error']}"
+                )
+            else:
+                retrying = job_queue.mark_failed(job, result["error"])
+                print(
+                    f"Error sending {job['kind']} to {job['payload']['to']}: {result['error']}"
+                    f"{', will retry' if retrying else ', giving up'}"
+                )
+        job_queue.mark_done(done)
+        sent += len(done)
+        failed += len(jobs) - len(done)
+
+
+def print_pending_follow_ups(job_queue):
+    jobs = job_queue.get_pending()
+    for job in jobs:
+        due = datetime.fromtimestamp(job["due_at"])
+        print(f"{due:%Y-%m-%d %H:%M}  {job['kind']:<30} {job['payload']['to']:<35} {job['payload']['subject']}")
+    print(f"{len(jobs)} follow ups queued")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Send the follow up emails that are due")
+    parser.add_argument("--list", action="store_true", help="List the queued follow ups instead of sending them")
+    args = parser.parse_args()
+
+    with JobQueue() as job_queue:
+        if args.list:
+            print_pending_follow_ups(job_queue)
+        else:
+            with Mailer() as mailer:
+                sent, failed = send_due_follow_ups(job_queue, mailer)
+            print(f"Sent {sent} follow ups, {failed} failed")
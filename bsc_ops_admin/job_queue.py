@@ -0,0 +1,122 @@
+"""Local queue of jobs to do later, like the follow up emails that are due days after a down hours notice.
+
+Jobs are kept in SQLite, so they survive between runs, with an index on the due time of the pending ones, so that
+checking for due work is a single index lookup however many jobs were ever queued. Each job has a key, and adding
+a job with a key that is already queued does nothing, so an interrupted run can safely queue its jobs again.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from bsc_ops_admin.utils import CACHE_FOLDER
+
+JOB_QUEUE_PATH = CACHE_FOLDER / "jobs.sqlite3"
+# A job that fails this many times is given up on, until then it is retried after RETRY_DELAY * 2**(attempts - 1)
+MAX_JOB_ATTEMPTS = 5
+RETRY_DELAY = 15 * 60
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL UNIQUE,
+    kind TEXT NOT NULL,
+    due_at REAL NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS pending_jobs_by_due_time ON jobs (due_at, id) WHERE status = 'pending';
+"""
+
+
+def get_job(record):
+    job = dict(record)
+    job["payload"] = json.loads(job["payload"])
+    return job
+
+
+class JobQueue:
+    """SQLite queue of jobs with a due time. One queue can be shared between threads.
+
+    clock returns the current time in seconds since the epoch, and can be replaced in tests.
+    """
+
+    def __init__(self, path=None, clock=time.time):
+        self.path = Path(path if path is not None else JOB_QUEUE_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.clock = clock
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def enqueue(self, key, kind, due_at, payload):
+        # Returns whether the job was added, i.e. whether there wasn't a job with this key already
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO jobs (key, kind, due_at, payload, created_at) VALUES (?, ?, ?, ?, ?)",
+                (key, kind, due_at, json.dumps(payload), self.clock()),
+            )
+        return cursor.rowcount == 1
+
+    def get_due(self, limit=None):
+        # Pending jobs that are due, earliest first. They stay queued until they are marked done or failed.
+        with self.lock:
+            records = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' AND due_at <= ? ORDER BY due_at, id LIMIT ?",
+                (self.clock(), -1 if limit is None else limit),
+            ).fetchall()
+        return [get_job(record) for record in records]
+
+    def get_pending(self):
+        with self.lock:
+            records = self.connection.execute(
+                "SELECT * FROM jobs WHERE status = 'pending' ORDER BY due_at, id"
+            ).fetchall()
+        return [get_job(record) for record in records]
+
+    def next_due_at(self):
+        with self.lock:
+            record = self.connection.execute("SELECT MIN(due_at) FROM jobs WHERE status = 'pending'").fetchone()
+        return record[0]
+
+    def mark_done(self, jobs):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE jobs SET status = 'done', finished_at = ? WHERE id = ?",
+                [(self.clock(), job["id"]) for job in jobs],
+            )
+
+    def mark_failed(self, job, error, retry=True):
+        # Retried later with an exponential backoff, or given up on after MAX_JOB_ATTEMPTS attempts (or right away
+        # if retry is False)
+        attempts = job["attempts"] + 1
+        now = self.clock()
+        with self.lock, self.connection:
+            if attempts >= MAX_JOB_ATTEMPTS or not retry:
+                self.connection.execute(
+                    "UPDATE jobs SET status = 'failed', attempts = ?, last_error = ?, finished_at = ? WHERE id = ?",
+                    (attempts, error, now, job["id"]),
+                )
+            else:
+                self.connection.execute(
+                    "UPDATE jobs SET attempts = ?, last_error = ?, due_at = ? WHERE id = ?",
+                    (attempts, error, now + RETRY_DELAY * 2 ** (attempts - 1), job["id"]),
+                )
+        return attempts < MAX_JOB_ATTEMPTS and retry
@@ -0,0 +1,186 @@
+"""Local record of what has been done for each down hours entry, so that an interrupted run can pick up where it left
+off instead of rendering, uploading and emailing everything again.
+
+Entries are keyed by their row in the down hours spreadsheet and the member's email. For each one the ledger keeps
+the drafted email, the rendered PDFs and when each of these steps was completed.
+"""
+
+import json
+import sqlite3
+import threading
+from datetime import datetime
+
+from bsc_ops_admin.utils import CACHE_FOLDER, PdfArtifact, get_named_path
+
+LEDGER_PATH = CACHE_FOLDER / "ledger.sqlite3"
+# In the order they are done in
+STEPS = ("rendered", "uploaded", "emailed", "fifteen_day_written", "down_hours_written")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    sheet_row INTEGER NOT NULL,
+    member_email TEXT NOT NULL,
+    semester TEXT NOT NULL,
+    action TEXT NOT NULL,
+    format_data TEXT NOT NULL,
+    eligibility_suffix TEXT,
+    workshift_manager_email TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    body TEXT NOT NULL,
+    rendered_at TEXT,
+    uploaded_at TEXT,
+    emailed_at TEXT,
+    fifteen_day_written_at TEXT,
+    down_hours_written_at TEXT,
+    PRIMARY KEY (sheet_row, member_email)
+);
+CREATE INDEX IF NOT EXISTS entries_by_semester ON entries (semester, emailed_at);
+CREATE TABLE IF NOT EXISTS pdfs (
+    sheet_row INTEGER NOT NULL,
+    member_email TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    data BLOB NOT NULL,
+    drive_file_id TEXT,
+    PRIMARY KEY (sheet_row, member_email, position)
+);
+"""
+
+
+def get_entry_key(entry):
+    # Row labels of the down hours DataFrame are 0-indexed with the header as row 0, sheet rows start at 1
+    return int(entry["row"].name) + 1, entry["format_data"]["<EMAIL>"].strip().lower()
+
+
+class RunLedger:
+    """SQLite ledger of completed steps. One ledger can be shared between threads."""
+
+    def __init__(self, path=None, name=None):
+        # Each named sheet set has its own ledger, since row numbers are only unique within a sheet
+        self.path = get_named_path(path if path is not None else LEDGER_PATH, name)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def restore(self, entry):
+        # Fills in the entry with what earlier runs did for it. Returns the steps that are already done.
+        key = get_entry_key(entry)
+        with self.lock:
+            record = self.connection.execute(
+                "SELECT * FROM entries WHERE sheet_row = ? AND member_email = ?", key
+            ).fetchone()
+            pdfs = self.connection.execute(
+                "SELECT name, data, drive_file_id FROM pdfs WHERE sheet_row = ? AND member_email = ? ORDER BY position",
+                key,
+            ).fetchall()
+
+        entry["completed_steps"] = {}
+        if record is None:
+            return entry["completed_steps"]
+        if record["down_hours_written_at"] is not None:
+            # The row was finished before, so it being pending again means someone cleared it to have it redone
+            print(f"Row {key[0]} for {key[1]} was already done once, starting it over")
+            self.forget(entry)
+            return entry["completed_steps"]
+        # PDFs already in Drive are replaced by the ones uploaded this time, instead of being uploaded a second time
+        entry["previous_drive_file_ids"] = {pdf["name"]: pdf["drive_file_id"] for pdf in pdfs if pdf["drive_file_id"]}
+        if record["emailed_at"] is None:
+            # Nothing was sent yet, e.g. it was skipped in review, so it is drafted again with today's dates
+            print(f"Row {key[0]} for {key[1]} was drafted but never emailed, drafting it again")
+            self.forget(entry)
+            return entry["completed_steps"]
+
+        entry["completed_steps"] = {step: record[f"{step}_at"] for step in STEPS if record[f"{step}_at"] is not None}
+        # The email has to match what was sent before, including its dates
+        entry["format_data"] = json.loads(record["format_data"])
+        entry["eligibility_suffix"] = record["eligibility_suffix"]
+        entry["subject"], entry["body"] = record["subject"], record["body"]
+        entry["pdf_attachments"] = [PdfArtifact(pdf["name"], pdf["data"]) for pdf in pdfs]
+        entry["drive_file_ids"] = [pdf["drive_file_id"] for pdf in pdfs]
+        print(f"Resuming row {key[0]} for {key[1]} after: {', '.join(entry['completed_steps'])}")
+        return entry["completed_steps"]
+
+    def forget(self, entry):
+        key = get_entry_key(entry)
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM entries WHERE sheet_row = ? AND member_email = ?", key)
+            self.connection.execute("DELETE FROM pdfs WHERE sheet_row = ? AND member_email = ?", key)
+
+    def record_rendered(self, entry):
+        key = get_entry_key(entry)
+        format_data = entry["format_data"]
+        now = datetime.now().isoformat()
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO entries (sheet_row, member_email, semester, action, format_data, "
+                "eligibility_suffix, workshift_manager_email, subject, body, rendered_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                key
+                + (
+                    format_data["<SEMESTER, YEAR>"],
+                    format_data["<ACTION>"],
+                    json.dumps(format_data),
+                    entry.get("eligibility_suffix"),
+                    entry["workshift_manager_email"],
+                    entry["subject"],
+                    entry["body"],
+                    now,
+                ),
+            )
+            self.connection.execute("DELETE FROM pdfs WHERE sheet_row = ? AND member_email = ?", key)
+            # The IDs of the PDFs in Drive from an earlier draft are kept until they are replaced
+            previous_drive_file_ids = entry.get("previous_drive_file_ids", {})
+            self.connection.executemany(
+                "INSERT INTO pdfs (sheet_row, member_email, position, name, data, drive_file_id) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    key + (position, pdf.name, pdf.data, previous_drive_file_ids.get(pdf.name))
+                    for position, pdf in enumerate(entry["pdf_attachments"])
+                ],
+            )
+        entry.setdefault("completed_steps", {})["rendered"] = now
+
+    def record_uploaded(self, entry):
+        key = get_entry_key(entry)
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "UPDATE pdfs SET drive_file_id = ? WHERE sheet_row = ? AND member_email = ? AND position = ?",
+                [
+                    (drive_file_id,) + key + (position,)
+                    for position, drive_file_id in enumerate(entry["drive_file_ids"])
+                ],
+            )
+        self.record_step(entry, "uploaded")
+
+    def record_step(self, entry, step):
+        assert step in STEPS, f"Unknown step {step}"
+        now = datetime.now().isoformat()
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"UPDATE entries SET {step}_at = ? WHERE sheet_row = ? AND member_email = ?",
+                (now,) + get_entry_key(entry),
+            )
+        entry.setdefault("completed_steps", {})[step] = now
+
+    def sent_in_semester(self, semester):
+        with self.lock:
+            return [
+                dict(record)
+                for record in self.connection.execute(
+                    "SELECT sheet_row, member_email, action, subject, emailed_at FROM entries "
+                    "WHERE semester = ? AND emailed_at IS NOT NULL ORDER BY emailed_at",
+                    (semester,),
+                )
+            ]
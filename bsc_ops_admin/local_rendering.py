@@ -0,0 +1,188 @@
+import io
+import json
+import os
+import re
+import subprocess
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from xml.sax.saxutils import escape, unescape
+
+from bsc_ops_admin.utils import TEMPLATE_FOLDER, PdfArtifact
+
+DOCX_MIME_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+# LibreOffice is used to turn the filled in .docx into a PDF on this machine
+SOFFICE_PATH = os.getenv("SOFFICE_PATH", "soffice")
+
+PARAGRAPH_PATTERN = re.compile(r"<w:p(?:\s[^>]*)?(?<!/)>.*?</w:p>", re.DOTALL)
+TEXT_RUN_PATTERN = re.compile(r"(<w:t(?:\s[^>]*)?>)(.*?)(</w:t>)", re.DOTALL)
+# Parts of the .docx that can contain placeholders
+DOCX_TEXT_PARTS_PATTERN = re.compile(r"word/(document|header\d*|footer\d*)\.xml")
+
+# Templates already checked against Drive during this run, by document id. Cleared at the start of every run by
+# forget_loaded_templates, so that a long running process like the watcher picks up edited templates.
+_loaded_templates = {}
+# Each template has its own lock, so threads that need the same template wait for a single download while other
+# templates are loaded at the same time. _loaded_templates_lock guards both dicts.
+_template_locks = {}
+_loaded_templates_lock = threading.Lock()
+
+
+def forget_loaded_templates():
+    with _loaded_templates_lock:
+        _loaded_templates.clear()
+
+
+def get_template_lock(document_id):
+    with _loaded_templates_lock:
+        return _template_locks.setdefault(document_id, threading.Lock())
+
+
+def write_bytes_atomically(path, data):
+    # Written next to path and then moved over it, so that a reader never sees a half written file
+    with tempfile.NamedTemporaryFile(dir=path.parent, prefix=f"{path.name}.", suffix=".tmp", delete=False) as f:
+        f.write(data)
+    os.replace(f.name, path)
+
+
+def get_template_modified_time(drive_service, document_id):
+    metadata = drive_service.files().get(fileId=document_id, fields="modifiedTime", supportsAllDrives=True).execute()
+    return metadata["modifiedTime"]
+
+
+def download_template(drive_service, document_id):
+    return drive_service.files().export_media(fileId=document_id, mimeType=DOCX_MIME_TYPE).execute()
+
+
+def get_cached_template(drive_service, document_id):
+    with get_template_lock(document_id):
+        with _loaded_templates_lock:
+            template = _loaded_templates.get(document_id)
+        if template is None:
+            template = load_template(drive_service, document_id)
+            with _loaded_templates_lock:
+                _loaded_templates[document_id] = template
+        return template
+
+
+def load_template(drive_service, document_id):
+    template_path = TEMPLATE_FOLDER / f"{document_id}.docx"
+    metadata_path = TEMPLATE_FOLDER / f"{document_id}.json"
+    modified_time = get_template_modified_time(drive_service, document_id)
+
+    cached_modified_time = None
+    if template_path.exists() and metadata_path.exists():
+        with open(metadata_path) as f:
+            cached_modified_time = json.load(f).get("modifiedTime")
+
+    if cached_modified_time == modified_time:
+        print(f"Using cached template {document_id} (modified {modified_time})")
+        template = template_path.read_bytes()
+    else:
+        print(f"Downloading template {document_id} (modified {modified_time})")
+        template = download_template(drive_service, document_id)
+        TEMPLATE_FOLDER.mkdir(parents=True, exist_ok=True)
+        # The template before its metadata, so the metadata never claims a newer template than the one on disk
+        write_bytes_atomically(template_path, template)
+        write_bytes_atomically(metadata_path, json.dumps({"modifiedTime": modified_time}).encode("utf-8"))
+    return template
+
+
+def replace_text_across_runs(texts, key, value):
+    # Word splits text into runs arbitrarily, so a placeholder can span several <w:t> elements.
+    # Like the Docs replaceAllText request, this replaces every (case sensitive) occurrence.
+    search_start = 0
+    while True:
+        joined = "".join(texts)
+        start = joined.find(key, search_start)
+        if start == -1:
+            return texts
+        end = start + len(key)
+
+        offset = 0
+        first = last = None
+        for i, text in enumerate(texts):
+            if first is None and start < offset + len(text):
+                first, first_offset = i, offset
+            if first is not None and end <= offset + len(text):
+                last, last_offset = i, offset
+                break
+            offset += len(text)
+
+        if first == last:
+            text = texts[first]
+            texts[first] = text[: start - first_offset] + value + text[end - first_offset :]
+        else:
+            texts[first] = texts[first][: start - first_offset] + value
+            for i in range(first + 1, last):
+                texts[i] = ""
+            texts[last] = texts[last][end - last_offset :]
+        search_start = start + len(value)
+
+
+def fill_paragraph(paragraph_xml, form_data):
+    text_runs = list(TEXT_RUN_PATTERN.finditer(paragraph_xml))
+    if not text_runs:
+        return paragraph_xml
+
+    texts = [unescape(run.group(2)) for run in text_runs]
+    if not any(key in "".join(texts) for key in form_data):
+        return paragraph_xml
+
+    for key, value in form_data.items():
+        texts = replace_text_across_runs(texts, key, str(value))
+
+    pieces = []
+    last_end = 0
+    for run, text in zip(text_runs, texts):
+        start_tag = run.group(1)
+        if "xml:space" not in start_tag:
+            start_tag = start_tag[:-1] + ' xml:space="preserve">'
+        pieces += [paragraph_xml[last_end : run.start()], start_tag, escape(text), run.group(3)]
+        last_end = run.end()
+    pieces.append(paragraph_xml[last_end:])
+    return "".join(pieces)
+
+
+def fill_docx(template, form_data):
+    output = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(template)) as template_zip, zipfile.ZipFile(output, "w") as output_zip:
+        for item in template_zip.infolist():
+            data = template_zip.read(item.filename)
+            if DOCX_TEXT_PARTS_PATTERN.fullmatch(item.filename):
+                xml = data.decode("utf-8")
+                xml = PARAGRAPH_PATTERN.sub(lambda match: fill_paragraph(match.group(0), form_data), xml)
+                data = xml.encode("utf-8")
+            output_zip.writestr(item, data, compress_type=zipfile.ZIP_DEFLATED)
+    return output.getvalue()
+
+
+def convert_docx_to_pdf(docx, name):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        docx_path = Path(tmp_dir) / (Path(name).stem + ".docx")
+        docx_path.write_bytes(docx)
+        # Each conversion gets its own LibreOffice profile so that conversions can run side by side
+        profile_dir = Path(tmp_dir) / "profile"
+        subprocess.run(
+            [
+                SOFFICE_PATH,
+                f"-env:UserInstallation={profile_dir.as_uri()}",
+                "--headless",
+                "--convert-to",
+                "pdf",
+                "--outdir",
+                tmp_dir,
+                str(docx_path),
+            ],
+            check=True,
+            capture_output=True,
+        )
+        return (Path(tmp_dir) / (Path(name).stem + ".pdf")).read_bytes()
+
+
+def fill_pdf_locally(services, name, form_data, document_id):
+    template = get_cached_template(services["drive"], document_id)
+    artifact = PdfArtifact(name, convert_docx_to_pdf(fill_docx(template, form_data), name))
+    print(f"PDF form {name} filled locally")
+    return artifact
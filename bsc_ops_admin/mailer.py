@@ -0,0 +1,125 @@
+import os
+import smtplib
+import threading
+from email import encoders
+from email.mime.base import MIMEBase
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+SENDER_EMAIL = "opsadmin@bsc.coop"
+SMTP_HOST = "smtp.gmail.com"
+SMTP_PORT = 587
+
+
+def build_email_message(sender_email, recipient_email, cc_emails, subject, body, attachments):
+    # Create the email message
+    message = MIMEMultipart()
+    message["From"] = sender_email
+    message["To"] = recipient_email
+    message["Subject"] = subject
+    message["Cc"] = ", ".join(cc_emails)
+
+    # Add body to email
+    message.attach(MIMEText(body, "plain"))
+
+    # Attach multiple files, straight from the in-memory PdfArtifacts
+    for attachment in attachments:
+        part = MIMEBase("application", "octet-stream")
+        part.set_payload(attachment.data)
+
+        encoders.encode_base64(part)
+        part.add_header("Content-Disposition", f"attachment; filename= {attachment.name}")
+        message.attach(part)
+
+    return message
+
+
+class SMTP(smtplib.SMTP):
+    # Remembers whether the message being sent got to the DATA command. From then on the server may have accepted it,
+    # even if the connection drops before its reply.
+    data_started = False
+
+    def data(self, msg):
+        self.data_started = True
+        return super().data(msg)
+
+
+class Mailer:
+    """Sends emails over a single authenticated SMTP session that is reused for the whole run.
+
+    If the server drops the connection before a message got to the DATA command, the send reconnects, logs in again
+    and tries once more. After that the message may have been delivered, so it isn't sent again and its status is
+    "unknown" instead of "sent" or "failed". Sends are serialized, so one Mailer can be shared between threads.
+    """
+
+    def __init__(self, sender_email=SENDER_EMAIL, password=None, host=SMTP_HOST, port=SMTP_PORT, use_tls=True):
+        self.sender_email = sender_email
+        # Get from environment variable
+        self.password = password if password is not None else os.getenv("EMAIL_PASSWORD")
+        if not self.password:
+            raise ValueError(f"No password for {sender_email}, set the EMAIL_PASSWORD environment variable")
+        self.host = host
+        self.port = port
+        self.use_tls = use_tls
+        self.server = None
+        self.lock = threading.Lock()
+
+    def connect(self):
+        server = SMTP(self.host, self.port)
+        try:
+            if self.use_tls:
+                server.starttls()
+            server.login(self.sender_email, self.password)
+        except Exception:
+            server.close()
+            raise
+        self.server = server
+
+    def close(self):
+        with self.lock:
+            if self.server is not None:
+                try:
+                    self.server.quit()
+                except smtplib.SMTPException:
+                    self.server.close()
+                self.server = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send(self, message):
+        result = {
+            "to": message["To"],
+            "cc": message["Cc"],
+            "subject": message["Subject"],
+            "sent": False,
+            "status": "failed",
+            "error": None,
+        }
+        with self.lock:
+            # A second attempt is only made if the connection was dropped, e.g. after being idle for too long
+            for attempt in range(2):
+                try:
+                    if self.server is None:
+                        self.connect()
+                    self.server.data_started = False
+                    self.server.send_message(message)
+                    result.update(sent=True, status="sent", error=None)
+                    return result
+                except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+                    data_started = self.server is not None and self.server.data_started
+                    self.server = None
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    if data_started:
+                        result["status"] = "unknown"
+                        return result
+                except (smtplib.SMTPException, OSError) as e:
+                    result["error"] = f"{type(e).__name__}: {e}"
+                    return result
+        return result
+
+    def send_many(self, messages):
+        return [self.send(message) for message in messages]
@@ -0,0 +1,123 @@
+"""Looks up members' emails by name in the PersonListExport from the member database.
+
+The export is parsed once into an index of normalized last name -> first name -> email, which is cached in
+bsc_ops_admin/.cache and only rebuilt when the export file changes.
+"""
+
+import csv
+import difflib
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from pathlib import Path
+
+from bsc_ops_admin.utils import CACHE_FOLDER, load_json_cache, save_json_cache
+
+PERSON_LIST_EXPORT_PATH = os.getenv("PERSON_LIST_EXPORT_PATH", str(Path.home() / "Downloads" / "PersonListExport.csv"))
+MEMBER_DIRECTORY_CACHE_PATH = CACHE_FOLDER / "member_directory.json"
+# How similar a name has to be (0 to 1, see difflib.SequenceMatcher.ratio) to count as a fuzzy match. The first
+# names have to be similar on their own too, so that sharing a last name isn't enough.
+FUZZY_MATCH_CUTOFF = 0.8
+FIRST_NAME_MATCH_CUTOFF = 0.75
+
+# Directories already loaded during this run, by export path
+_loaded_directories = {}
+
+
+def normalize_name(name):
+    # Ignore case, accents, punctuation and extra whitespace: "  José-Luis " -> "jose luis"
+    # Missing names, None in the export or NaN in the sheet, are empty rather than "none" or "nan"
+    if not isinstance(name, str):
+        return ""
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii")
+    return " ".join(re.sub(r"[^a-z0-9]+", " ", name.casefold()).split())
+
+
+def build_member_index(path):
+    index = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for person in csv.DictReader(f):
+            email = (person.get("Permanent Email") or "").strip()
+            first_name, last_name = normalize_name(person.get("First Name")), normalize_name(person.get("Last Name"))
+            if not email or not first_name or not last_name:
+                continue
+            # Like the old DataFrame lookup, the first person in the export wins if two share a name
+            index.setdefault(last_name, {}).setdefault(first_name, email)
+    return index
+
+
+def get_bigrams(name):
+    return {name[i : i + 2] for i in range(len(name) - 1)} or {name}
+
+
+class MemberDirectory:
+    def __init__(self, index):
+        self.index = index
+        # Last names by the pairs of letters in them, so fuzzy lookups only compare against plausible names.
+        # Built on the first fuzzy lookup, since most runs only need exact matches.
+        self.last_names_by_bigram = None
+
+    def get_similar_last_names(self, last_name):
+        if self.last_names_by_bigram is None:
+            self.last_names_by_bigram = defaultdict(list)
+            for name in self.index:
+                for bigram in get_bigrams(name):
+                    self.last_names_by_bigram[bigram].append(name)
+
+        bigrams = get_bigrams(last_name)
+        shared = Counter(name for bigram in bigrams for name in self.last_names_by_bigram.get(bigram, ()))
+        # Names with a ratio above the cutoff have to share a good part of their letter pairs
+        min_shared = max(1, int(len(bigrams) * FUZZY_MATCH_CUTOFF) - 2)
+        candidates = [name for name, count in shared.items() if count >= min_shared]
+        return difflib.get_close_matches(last_name, candidates, n=3, cutoff=FUZZY_MATCH_CUTOFF)
+
+    @classmethod
+    def load(cls, path=PERSON_LIST_EXPORT_PATH):
+        path = str(Path(path).expanduser().resolve())
+        stat = os.stat(path)
+        key = {"path": path, "mtime": stat.st_mtime, "size": stat.st_size}
+
+        if _loaded_directories.get(path, (None,))[0] == key:
+            return _loaded_directories[path][1]
+
+        cache = load_json_cache(MEMBER_DIRECTORY_CACHE_PATH)
+        if cache is not None and cache.get("key") == key:
+            print(f"Using cached member directory for {path}")
+            index = cache["index"]
+        else:
+            print(f"Indexing member directory {path}")
+            index = build_member_index(path)
+            save_json_cache(MEMBER_DIRECTORY_CACHE_PATH, {"key": key, "index": index})
+
+        directory = cls(index)
+        _loaded_directories[path] = (key, directory)
+        return directory
+
+    def __len__(self):
+        return sum(len(first_names) for first_names in self.index.values())
+
+    def lookup(self, first_name, last_name):
+        # Returns the email, the normalized name it was found under and whether that is the exact name asked for, or
+        # (None, None, False) if there is no close match. Fuzzy matches are only suggestions, for someone to check.
+        first_name, last_name = normalize_name(first_name), normalize_name(last_name)
+        if not first_name or not last_name:
+            return None, None, False
+        email = self.index.get(last_name, {}).get(first_name)
+        if email is not None:
+            return email, f"{first_name} {last_name}", True
+
+        # Fall back to the closest first name among people with a similar last name, e.g. for typos or nicknames
+        best_ratio, best = 0.0, (None, None, False)
+        for candidate_last_name in self.get_similar_last_names(last_name):
+            first_names = self.index[candidate_last_name]
+            for candidate_first_name in difflib.get_close_matches(
+                first_name, first_names, n=1, cutoff=FIRST_NAME_MATCH_CUTOFF
+            ):
+                ratio = difflib.SequenceMatcher(
+                    None, f"{first_name} {last_name}", f"{candidate_first_name} {candidate_last_name}"
+                ).ratio()
+                if ratio > best_ratio:
+                    best_ratio = ratio
+                    best = (first_names[candidate_first_name], f"{candidate_first_name} {candidate_last_name}", False)
+        return best if best_ratio >= FUZZY_MATCH_CUTOFF else (None, None, False)
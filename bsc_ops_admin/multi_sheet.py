@@ -0,0 +1,180 @@
+"""Processes several down hours spreadsheets in one run, e.g. one per semester or group of houses.
+
+The sheet sets are read from a JSON file with a list of sheet configs (see get_sheet_config), like:
+
+    [
+        {"name": "Fall 2024", "semester_year": "Fall 2024", "document_ids": {"down_hours_spreadsheet": "..."}},
+        {"name": "Spring 2025", "document_ids": {"down_hours_spreadsheet": "...", "instruction_docs": "..."}}
+    ]
+
+Anything a sheet set leaves out is taken from the constants in process_new_down_hours. All sheet sets are processed
+at the same time with one set of credentials, Google services, quota scheduler and SMTP connection, and the
+instruction docs they have in common are only read once. Each one keeps its own ledger and incremental cursor. At
+the end, a single report covers all of them.
+"""
+
+import argparse
+import csv
+import json
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from bsc_ops_admin.email_templates import TemplateCache
+from bsc_ops_admin.ledger import get_entry_key
+from bsc_ops_admin.mailer import Mailer
+from bsc_ops_admin.process_new_down_hours import get_run_services, get_sheet_config, process_new_down_hour_entries
+from bsc_ops_admin.review import load_eligibility_answers
+from bsc_ops_admin.scheduler import schedule_services
+
+MAX_CONCURRENT_SHEET_SETS = 4
+MERGED_REPORT_COLUMNS = ["Sheet set", "Row", "Name", "Email", "House", "Action", "Sent", "Error"]
+
+
+def load_sheet_configs(path):
+    with open(path) as f:
+        sheet_sets = json.load(f)
+    if not isinstance(sheet_sets, list):
+        raise ValueError(f"{path} should contain a list of sheet sets")
+    configs = [get_sheet_config(sheet_set) for sheet_set in sheet_sets]
+    names = [config["name"] for config in configs]
+    # The name picks the ledger, cursor and review folder of a sheet set, so they can't be shared
+    if None in names or len(set(names)) != len(names):
+        raise ValueError(f"Every sheet set needs a name of its own, they are {names}")
+    return configs
+
+
+def process_sheet_set(config, template_cache, **kwargs):
+    # A sheet set that fails returns its exception instead, so that the others still finish
+    try:
+        return process_new_down_hour_entries(config=config, template_cache=template_cache, **kwargs)
+    except Exception as e:
+        print(f"Processing {config['name']} failed:")
+        traceback.print_exc()
+        return e
+
+
+def process_sheet_sets(
+    configs,
+    refresh_templates=False,
+    incremental=False,
+    services=None,
+    mailer=None,
+    scheduler=None,
+    review=False,
+    eligibility_answers=None,
+    max_workers=MAX_CONCURRENT_SHEET_SETS,
+):
+    # Returns a (config, entries or exception) pair for each sheet set, in the order they were given
+    if services is None:
+        services = get_run_services(scheduler)
+    elif scheduler is not None:
+        services = schedule_services(services, scheduler)
+    template_cache = TemplateCache()
+
+    with Mailer() if mailer is None else nullcontext(mailer) as mailer:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    process_sheet_set,
+                    config,
+                    template_cache,
+                    refresh_templates=refresh_templates,
+                    incremental=incremental,
+                    services=services,
+                    mailer=mailer,
+                    review=review,
+                    eligibility_answers=eligibility_answers,
+                )
+                for config in configs
+            ]
+            return [(config, future.result()) for config, future in zip(configs, futures)]
+
+
+def get_merged_report_rows(results):
+    rows = []
+    for config, result in results:
+        if isinstance(result, Exception):
+            rows.append({"Sheet set": config["name"], "Sent": False, "Error": f"{type(result).__name__}: {result}"})
+            continue
+        for entry in result:
+            format_data = entry["format_data"]
+            rows.append(
+                {
+                    "Sheet set": config["name"],
+                    "Row": get_entry_key(entry)[0],
+                    "Name": format_data["<FULL NAME>"],
+                    "Email": format_data["<EMAIL>"],
+                    "House": format_data["<HOUSE>"],
+                    "Action": format_data["<ACTION>"],
+                    "Sent": entry["email_result"]["sent"],
+                    "Error": entry["email_result"]["error"],
+                }
+            )
+    return rows
+
+
+def print_merged_report(results):
+    print(f"\nProcessed {len(results)} sheet sets:")
+    for config, result in results:
+        if isinstance(result, Exception):
+            print(f"  {config['name']}: failed, {type(result).__name__}: {result}")
+            continue
+        sent = sum(entry["email_result"]["sent"] for entry in result)
+        print(f"  {config['name']}: {len(result)} members, {sent} emailed, {len(result) - sent} not emailed")
+    for row in get_merged_report_rows(results):
+        if not row["Sent"] and "Row" in row:
+            print(f"Failed to email {row['Name']} ({row['Sheet set']}, row {row['Row']}): {row['Error']}")
+
+
+def write_merged_report(results, path):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=MERGED_REPORT_COLUMNS)
+        writer.writeheader()
+        writer.writerows(get_merged_report_rows(results))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Process new entries in several down hours spreadsheets at once")
+    parser.add_argument("config", help="JSON file with the list of sheet sets to process")
+    parser.add_argument(
+        "--refresh-templates",
+        action="store_true",
+        help="Re-download the email templates from the instruction docs even if they haven't changed",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only read the rows added since the last run, reusing the cached history of processed rows. "
+        "The whole spreadsheet is still read once a day, to catch edits to older rows",
+    )
+    parser.add_argument(
+        "--review",
+        action="store_true",
+        help="Generate all drafts and PDFs of each sheet set first, then review them at once before sending",
+    )
+    parser.add_argument(
+        "--eligibility",
+        help="CSV with First Name, Last Name, Eligible (y/n) and Prior Termination Reason, instead of asking",
+    )
+    parser.add_argument("--report", help="Also save the merged report of all sheet sets to this CSV file")
+    parser.add_argument(
+        "--max-workers",
+        type=int,
+        default=MAX_CONCURRENT_SHEET_SETS,
+        help="Number of sheet sets processed at the same time",
+    )
+    args = parser.parse_args()
+
+    results = process_sheet_sets(
+        load_sheet_configs(args.config),
+        refresh_templates=args.refresh_templates,
+        incremental=args.incremental,
+        review=args.review,
+        eligibility_answers=load_eligibility_answers(args.eligibility) if args.eligibility else None,
+        max_workers=args.max_workers,
+    )
+    print_merged_report(results)
+    if args.report:
+        write_merged_report(results, args.report)
+        print(f"Saved the merged report to {args.report}")
@@ -1,19 +1,48 @@
 from __future__ import print_function
 
-import io
-import os.path
-import smtplib
+import argparse
+import hashlib
+import json
 import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime, timedelta
-from email import encoders
-from email.mime.base import MIMEBase
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
 
-import numpy as np
-import pandas as pd
-from bsc_ops_admin.utils import get_credentials, get_current_semester_year, get_google_services, upload_to_drive
-from googleapiclient.http import MediaIoBaseDownload
+from bsc_ops_admin import profiling
+from bsc_ops_admin.batch_rendering import fill_pdfs_in_batches, get_replace_all_text_requests
+from bsc_ops_admin.compact_sheet import CompactSheet, fetch_sheet_pages
+from bsc_ops_admin.email_templates import EmailTemplate, compile_email_templates
+from bsc_ops_admin.job_queue import JobQueue
+from bsc_ops_admin.ledger import RunLedger, get_entry_key
+from bsc_ops_admin.local_rendering import fill_pdf_locally, forget_loaded_templates
+from bsc_ops_admin.mailer import SENDER_EMAIL, Mailer, build_email_message
+from bsc_ops_admin.member_directory import PERSON_LIST_EXPORT_PATH, MemberDirectory
+from bsc_ops_admin.review import (
+    REVIEW_FOLDER,
+    ask_for_approval,
+    get_eligibility_key,
+    get_review_pdf_name,
+    load_eligibility_answers,
+    write_review_report,
+)
+from bsc_ops_admin.scheduler import RequestScheduler, schedule_services
+from bsc_ops_admin.utils import (
+    CACHE_FOLDER,
+    PdfArtifact,
+    SheetWriteBuffer,
+    ThreadLocalGoogleServices,
+    find_uploaded_files,
+    get_credentials,
+    get_current_semester_year,
+    get_google_service,
+    get_named_path,
+    load_json_cache,
+    open_file,
+    save_json_cache,
+    upload_many,
+)
 
 # https://docs.google.com/document/d/1jcCLkLd58psZyZLxnFHAfEpOCuROOslcfz0qMJrAxDI/edit
 DOCUMENT_IDS = {
@@ -27,6 +56,12 @@ DOCUMENT_IDS = {
     "instruction_docs": "1jcCLkLd58psZyZLxnFHAfEpOCuROOslcfz0qMJrAxDI",
 }
 
+EMAIL_TEMPLATES_CACHE_PATH = CACHE_FOLDER / "email_templates.json"
+DOWN_HOURS_CURSOR_PATH = CACHE_FOLDER / "down_hours_cursor.json"
+# Incremental reads only check the last cached row, so edits further up the history would go unnoticed. The whole
+# spreadsheet is read again once the cached history was last checked against it this many seconds ago.
+DOWN_HOURS_HISTORY_MAX_AGE = 24 * 60 * 60
+
 PDFS_FOLDER_ID = "1At4TzVjKsN2Zv5LKCFpbeu2DiRQ6FXSg"
 
 COURTESY_NOTICE_ACTION = "Courtesy Notice"
@@ -41,115 +76,267 @@ EMAIL_TEMPLATES_SUBJECT_LINES = {
 
 OPS_SUPERVISOR = "Alex"
 
+# Follow up emails, as (subject, body) templates. They are queued when a notice is sent, and sent once they are due
+# by python -m bsc_ops_admin.follow_ups or the watcher, at FOLLOW_UP_HOUR (local time) of their day.
+SCHEDULE_FOLLOW_UPS = True
+FOLLOW_UP_HOUR = 9
+# To the member, on the day the conditional contract sent with a potential termination notice is due
+CONDITIONAL_CONTRACT_REMINDER = (
+    "Reminder: your conditional contract is due <DATE (+1 week)>",
+    "Hi <FIRST NAME>,\n\n"
+    "This is a reminder that the conditional contract we sent you on <DATE> is due today, <DATE (+1 week)>. "
+    "If you have already returned it, please disregard this email.\n\n"
+    "<OPS_SUPERVISOR>",
+)
+# To ops admin, the day after the deadline of a potential or pending termination notice
+FIFTEEN_DAY_FOLLOW_UP = (
+    "15 day deadline passed for <FULL NAME> (<HOUSE>)",
+    "The <ACTION> sent to <FULL NAME> (<EMAIL>, <HOUSE>) on <DATE> had a deadline of <DATE (+15 days)>. "
+    "Please check whether they made up their down hours, and follow up on their membership.",
+)
+
+# Placeholders that can be used in the email templates, see make_down_hour_entry
+FORMAT_DATA_KEYS = [
+    "<FIRST NAME>",
+    "<LAST NAME>",
+    "<FULL NAME>",
+    "<HOUSE>",
+    "<DATE>",
+    "<DATE (+1 week)>",
+    "<DATE (+15 days)>",
+    "<SEMESTER, YEAR>",
+    "<OPS_SUPERVISOR>",
+    "<EMAIL>",
+    "<ACTION>",
+    "<EXISTING CC>",
+    # Only there for members who aren't eligible for reinstatement
+    "<PRIOR TERMINATION REASON>",
+]
+
 
 SEMESTER_YEAR = get_current_semester_year()
 SAMPLE_RANGE_NAME = "sheet1!A:O"
+# Keys of a sheet config that can be set per sheet set, see get_sheet_config
+SHEET_CONFIG_KEYS = ["name", "document_ids", "range_name", "semester_year", "ops_supervisor", "pdfs_folder_id"]
 SAFE_MODE = True
-
+# Write each member's spreadsheet updates as soon as they are done, so that a crash partway through a run
+# doesn't lose completed work. If False, all updates to each spreadsheet go out in one request at the end.
+FLUSH_WRITES_PER_MEMBER = True
+# Download each PDF template once (cached by its Drive modified time) and fill it in on this machine,
+# instead of copying, editing, exporting and deleting a Google Doc for every PDF. Requires LibreOffice.
+RENDER_PDFS_LOCALLY = False
+# More rows than this without an action usually means something went wrong with the spreadsheet
+MAX_PENDING_ROWS = 5
+# Also write every generated PDF to the working directory, e.g. to keep a local archive. PDFs are otherwise
+# kept in memory, and only written to disk to preview them in SAFE_MODE.
+SAVE_PDFS_TO_DISK = False
+# Fill in the Google Docs PDF templates of all members with a few batch requests (one for all copies, one for all
+# updates, one for all deletes) instead of a copy, update and delete request per PDF. Not used when rendering locally.
+BATCH_GOOGLE_REQUESTS = False
+# Number of members whose PDFs, uploads, emails and sheet updates are worked on at the same time
+MAX_WORKERS = 4
+
+# Questions to the operator from different sheet sets that are processed at the same time aren't interleaved
+OPERATOR_LOCK = threading.Lock()
+
+COL_TIMESTAMP = "A"
 COL_LAST_NAME = "C"
 COL_FIRST_NAME = "D"
 COL_EMAIL = "E"
 COL_HOUSE = "F"
+COL_DOWN_HOURS = "G"
 COL_EXISTING_CC = "H"
 COL_ACTION = "I"
 COL_DATE_ISSUED = "J"
 
-
-def get_down_hours_df(sheets_service, only_action_null=True):
-    down_hours_spreadsheet_id = DOCUMENT_IDS["down_hours_spreadsheet"]
+# How the down hours spreadsheet is read: in pages of this many rows, with these columns stored compactly and all
+# others as strings
+DOWN_HOURS_PAGE_SIZE = 10000
+DOWN_HOURS_CATEGORY_COLUMNS = [COL_HOUSE, COL_EXISTING_CC, COL_ACTION]
+DOWN_HOURS_FLOAT32_COLUMNS = [COL_DOWN_HOURS]
+DOWN_HOURS_DATE_FORMATS = {COL_TIMESTAMP: "%m/%d/%Y %H:%M:%S", COL_DATE_ISSUED: "%m/%d/%Y"}
+# A single bare address. Anything else, like the "CHECK: ..." suggestions of --find-missing-emails, stops the run.
+MEMBER_EMAIL_PATTERN = r"[^@\s]+@[^@\s]+"
+
+
+def get_sheet_config(overrides=None):
+    # Where a run reads from and writes to. By default the constants above, a sheet set can override any of them.
+    config = {
+        "name": None,
+        "document_ids": DOCUMENT_IDS,
+        "range_name": SAMPLE_RANGE_NAME,
+        "semester_year": SEMESTER_YEAR,
+        "ops_supervisor": OPS_SUPERVISOR,
+        "pdfs_folder_id": PDFS_FOLDER_ID,
+    }
+    overrides = overrides or {}
+    unknown = set(overrides) - set(SHEET_CONFIG_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown sheet config keys {sorted(unknown)}, expected some of {SHEET_CONFIG_KEYS}")
+    unknown_documents = set(overrides.get("document_ids", {})) - set(DOCUMENT_IDS)
+    if unknown_documents:
+        raise ValueError(f"Unknown document names {sorted(unknown_documents)}, expected some of {list(DOCUMENT_IDS)}")
+    config.update(overrides)
+    config["document_ids"] = {**DOCUMENT_IDS, **overrides.get("document_ids", {})}
+    return config
+
+
+def fetch_down_hours_values(sheets_service, range_name=None, config=None):
+    config = config or get_sheet_config()
+    down_hours_spreadsheet_id = config["document_ids"]["down_hours_spreadsheet"]
     result = (
         sheets_service.spreadsheets()
         .values()
-        .get(spreadsheetId=down_hours_spreadsheet_id, range=SAMPLE_RANGE_NAME)
+        .get(spreadsheetId=down_hours_spreadsheet_id, range=range_name or config["range_name"])
         .execute()
     )
-    values = result.get("values", [])
+    return result.get("values", [])
+
+
+def hash_values(values):
+    return hashlib.sha256(json.dumps(values).encode("utf-8")).hexdigest()
+
+
+def get_processed_prefix_length(values):
+    # Number of rows (including the header) before the first row that doesn't have an action yet
+    action_idx = values[0].index("Action")
+    length = 1
+    for row in values[1:]:
+        if len(row) <= action_idx or not row[action_idx]:
+            break
+        length += 1
+    return length
+
+
+def fetch_down_hours_values_incrementally(sheets_service, config=None, clock=time.time):
+    config = config or get_sheet_config()
+    down_hours_spreadsheet_id = config["document_ids"]["down_hours_spreadsheet"]
+    range_name = config["range_name"]
+    cursor_path = get_named_path(DOWN_HOURS_CURSOR_PATH, config["name"])
+    cursor = load_json_cache(cursor_path)
+    now = clock()
+    values = None
+    if (
+        cursor is None
+        or cursor.get("spreadsheet_id") != down_hours_spreadsheet_id
+        or cursor.get("range") != range_name
+        or cursor.get("hash") != hash_values(cursor.get("values"))
+    ):
+        print("No valid cached down hours history, reading the whole spreadsheet")
+    elif cursor.get("verified_at") is None or now - cursor["verified_at"] >= DOWN_HOURS_HISTORY_MAX_AGE:
+        print("Cached down hours history is due to be checked again, reading the whole spreadsheet")
+    else:
+        history = cursor["values"]
+        # Re-read the last cached row along with the new ones, to check that the history didn't get shifted
+        sheet_name, columns = range_name.split("!")
+        start_col, end_col = columns.split(":")
+        tail = fetch_down_hours_values(sheets_service, f"{sheet_name}!{start_col}{len(history)}:{end_col}", config)
+        if tail and tail[0] == history[-1]:
+            print(f"Read {len(tail) - 1} new rows after the {len(history)} cached rows of the down hours spreadsheet")
+            values = history + tail[1:]
+            verified_at = cursor["verified_at"]
+        else:
+            print("Cached down hours history doesn't match the spreadsheet anymore, reading the whole spreadsheet")
+    if values is None:
+        values = fetch_down_hours_values(sheets_service, config=config)
+        verified_at = now
+
+    # Only rows that have been fully processed are cached, everything after them is re-read next time
+    history = values[: get_processed_prefix_length(values)]
+    save_json_cache(
+        cursor_path,
+        {
+            "spreadsheet_id": down_hours_spreadsheet_id,
+            "range": range_name,
+            "processed_rows": len(history),
+            "hash": hash_values(history),
+            # When the history was last read in full, rather than only its last row
+            "verified_at": verified_at,
+            "values": history,
+        },
+    )
+    return values
 
-    df = pd.DataFrame(values)
-    df.columns = df.iloc[0]
-    df = df.drop(0)
 
-    if only_action_null:
-        df = df[df["Action"].isnull()]
-        assert len(df) < 5, "Something is fishy, there are more than 5 rows with no action?"
+def count_pending_rows(sheet):
+    # Rows that don't reach the action column yet, i.e. what get_pending_down_hours_df would select
+    return sheet.count_missing(COL_ACTION)
 
-    df["Member's Down Hours"] = df["Member's Down Hours"].replace("", np.nan).astype(float)
-    return df
 
+def read_down_hours_sheet(sheets_service, incremental=False, config=None):
+    config = config or get_sheet_config()
+    # The incremental read reuses the cached history, so it already has all rows as a list
+    if incremental:
+        return CompactSheet([fetch_down_hours_values_incrementally(sheets_service, config)])
+    pages = fetch_sheet_pages(
+        sheets_service,
+        config["document_ids"]["down_hours_spreadsheet"],
+        config["range_name"],
+        page_size=DOWN_HOURS_PAGE_SIZE,
+    )
+    return CompactSheet(pages)
 
-def update_down_hours_spreadsheet_cell(sheets_service, col, idx, value):
-    down_hours_spreadsheet_id = DOCUMENT_IDS["down_hours_spreadsheet"]
-    return (
-        sheets_service.spreadsheets()
-        .values()
-        .update(
-            spreadsheetId=down_hours_spreadsheet_id,
-            range=f"sheet1!{col}{idx+1}",
-            valueInputOption="USER_ENTERED",
-            body={"values": [[value]], "majorDimension": "COLUMNS"},
-        )
-        .execute()
+
+def get_down_hours_df_from_sheet(sheet):
+    # pandas is slow to import, so it is only imported once we know there is something to process
+    return sheet.to_df(
+        category_columns=DOWN_HOURS_CATEGORY_COLUMNS,
+        float32_columns=DOWN_HOURS_FLOAT32_COLUMNS,
+        date_formats=DOWN_HOURS_DATE_FORMATS,
     )
 
 
-def get_house_code(row):
-    house_code = row["Email Address"][0:3].upper().strip()
-    return house_code
+def get_pending_down_hours_df(full_df):
+    df = full_df[full_df["Action"].isnull()]
+    assert len(df) < MAX_PENDING_ROWS, f"Something is fishy, there are {len(df)} rows with no action?"
+    return df
 
 
-def get_email(ppl, first_name, last_name):
-    return ppl.loc[(ppl["Last Name"] == last_name) & (ppl["First Name"] == first_name)]["Permanent Email"].values[0]
+def get_down_hours_df(sheets_service, only_action_null=True, config=None):
+    df = get_down_hours_df_from_sheet(read_down_hours_sheet(sheets_service, config=config))
+    if only_action_null:
+        df = get_pending_down_hours_df(df)
+    return df
 
 
-def get_capitalized_names(row):
-    first_name = row["Member's First Name"]
-    last_name = row["Member's Last Name"]
-    return first_name.title(), last_name.title()
+def get_down_hours_dfs(sheet):
+    # Both the full history and the rows still to process come from a single read of the spreadsheet
+    full_df = get_down_hours_df_from_sheet(sheet)
+    return full_df, get_pending_down_hours_df(full_df)
 
 
-def had_prior_conditional_contract(row, full_df):
-    member_email = row["Member's Email"].strip()
-    assert "@" in member_email, f"Member email {member_email} is not valid"
-    to_check = full_df.iloc[0 : row.name]
-    # Checking whether the person ever had a potential termination action (i.e. got a conditional contract)
-    prior_CC = to_check[
-        (to_check["Member's Email"] == member_email) & (to_check["Action"] == POTENTIAL_TERMINATION_ACTION)
-    ]
-    existing_contract = "Yes" if len(prior_CC) > 0 else "No"
-    return existing_contract, member_email
+def get_down_hours_write_buffer(sheets_service, config=None):
+    config = config or get_sheet_config()
+    return SheetWriteBuffer(sheets_service, config["document_ids"]["down_hours_spreadsheet"])
 
 
-def get_action(row, had_prior_CC):
-    down_hours = row["Member's Down Hours"]
-    if down_hours >= 15:
-        if had_prior_CC == "Yes":
-            action = PENDING_TERMINATION_ACTION
-        elif had_prior_CC == "No":
-            action = POTENTIAL_TERMINATION_ACTION
-        else:
-            raise ValueError(f"Existing CC should only be 'Yes' or 'No', it is {had_prior_CC}")
-    elif down_hours >= 10:
-        action = COURTESY_NOTICE_ACTION
-    else:
-        raise ValueError(f"Down hours should be >= 10 to be on the form, it is {down_hours}")
-    return action
+def update_down_hours_spreadsheet_cell(write_buffer, col, idx, value):
+    write_buffer.add(col, idx, value)
 
 
-def find_email_if_not_found(sheet):
+def find_email_if_not_found(sheet, person_list_path=PERSON_LIST_EXPORT_PATH):
     df = get_down_hours_df(sheet)
-    ppl = pd.read_csv("/Users/admin/Downloads/PersonListExport.csv")
+    write_buffer = get_down_hours_write_buffer(sheet)
+    directory = MemberDirectory.load(person_list_path)
+
+    for idx, row in df.iterrows():
+        # Missing cells are None or NaN
+        if not isinstance(row["Member's Email"], str) or row["Member's Email"] == "":
+            first_name = row["Member's First Name"]
+            last_name = row["Member's Last Name"]
+            email, matched_name, exact = directory.lookup(first_name, last_name)
+            if email is None:
+                print(f"{first_name} {last_name}: NOT FOUND")
+                email = "NOT FOUND"
+            elif not exact:
+                # Left for someone to check and fix by hand, the pipeline won't accept it as an email
+                email = f"CHECK: {email} (matched {matched_name})"
+                print(f"{first_name} {last_name}: {email}")
+            else:
+                print(f"{first_name} {last_name}: {email}")
+            update_down_hours_spreadsheet_cell(write_buffer, COL_EMAIL, idx, email)
 
-    for i in range(0, len(df)):
-        if df.iloc[i]["Member's Email"] is None or df.iloc[i]["Member's Email"] == "":
-            try:
-                first_name = df.iloc[i]["Member's First Name"]
-                last_name = df.iloc[i]["Member's Last Name"]
-                email = get_email(ppl, first_name, last_name)
-                print(email)
-                update_down_hours_spreadsheet_cell(sheet, COL_EMAIL, df.iloc[i].name, email)
-            except Exception as e:
-                print(first_name, last_name, e)
-                update_down_hours_spreadsheet_cell(sheet, COL_EMAIL, df.iloc[i].name, "NOT FOUND")
+    write_buffer.flush()
 
 
 def delete_file(service, file_id):
@@ -160,7 +347,7 @@ def delete_file(service, file_id):
         print(f"An error occurred while deleting the file: {e}")
 
 
-def fill_pdf(services, output_pdf_path, form_data, document_id):
+def fill_pdf(services, name, form_data, document_id):
     drive_service, docs_service = services["drive"], services["docs"]
 
     # Create a copy of the document
@@ -174,86 +361,101 @@ def fill_pdf(services, output_pdf_path, form_data, document_id):
     docs_service.documents().get(documentId=copy_document_id).execute()
 
     # Update the document content
-    requests = []
-    for key, value in form_data.items():
-        requests.append({"replaceAllText": {"containsText": {"text": key, "matchCase": "true"}, "replaceText": value}})
+    requests = get_replace_all_text_requests(form_data)
 
     # Execute the update
     docs_service.documents().batchUpdate(documentId=copy_document_id, body={"requests": requests}).execute()
 
-    # Export the document as PDF
-    request = drive_service.files().export_media(fileId=copy_document_id, mimeType="application/pdf")
-    fh = io.BytesIO()
-    downloader = MediaIoBaseDownload(fh, request)
-    done = False
-    while done is False:
-        status, done = downloader.next_chunk()
-        print(f"Download {int(status.progress() * 100)}%.")
+    # Export the document as PDF. Exports are capped at 10MB, so a single request is enough
+    pdf = drive_service.files().export_media(fileId=copy_document_id, mimeType="application/pdf").execute()
+    print(f"Downloaded {len(pdf)} bytes.")
 
     delete_file(drive_service, copy_document_id)
 
-    # Save the PDF
-    fh.seek(0)
-    with open(output_pdf_path, "wb") as f:
-        f.write(fh.getvalue())
-
-    print(f"PDF form filled and saved as {output_pdf_path}")
-
-
-def send_email(recipient_email, cc_emails, subject, body, attachment_paths):
-    # Email configuration
-    sender_email = "opsadmin@bsc.coop"
-    # Get from environment variable
-    sender_password = os.getenv("EMAIL_PASSWORD")
+    print(f"PDF form {name} filled")
+    return PdfArtifact(name, pdf)
 
-    # Create the email message
-    message = MIMEMultipart()
-    message["From"] = sender_email
-    message["To"] = recipient_email
-    message["Subject"] = subject
-    message["Cc"] = ", ".join(cc_emails)
 
-    # Add body to email
-    message.attach(MIMEText(body, "plain"))
-
-    # Attach multiple files
-    for attachment_path in attachment_paths:
-        with open(attachment_path, "rb") as attachment:
-            part = MIMEBase("application", "octet-stream")
-            part.set_payload(attachment.read())
+def render_pdf(services, name, form_data, document_id):
+    with profiling.span("fill_pdf"):
+        if RENDER_PDFS_LOCALLY:
+            artifact = fill_pdf_locally(services, name, form_data, document_id)
+        else:
+            artifact = fill_pdf(services, name, form_data, document_id)
+    if SAVE_PDFS_TO_DISK:
+        artifact.save()
+    return artifact
 
-        encoders.encode_base64(part)
-        part.add_header("Content-Disposition", f"attachment; filename= {os.path.basename(attachment_path)}")
-        message.attach(part)
 
-    # Connect to the SMTP server and send the email
-    try:
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(sender_email, sender_password)  # type: ignore
-            server.send_message(message)
+def send_email(mailer, recipient_email, cc_emails, subject, body, attachments):
+    message = build_email_message(SENDER_EMAIL, recipient_email, cc_emails, subject, body, attachments)
+    result = mailer.send(message)
+    if result["sent"]:
         print(f"Email sent successfully to {recipient_email} with CC to {', '.join(cc_emails)}")
-        print(f"Attachments: {', '.join(os.path.basename(path) for path in attachment_paths)}")
-    except Exception as e:
-        print(f"Error sending email: {e}")
+        print(f"Attachments: {', '.join(attachment.name for attachment in attachments)}")
+    elif result["status"] == "unknown":
+        print(
+            f"The connection dropped while sending to {recipient_email}, it may have been delivered: {result['error']}"
+        )
+    else:
+        print(f"Error sending email to {recipient_email}: {result['error']}")
+    return result
 
 
 def open_pdf_in_preview(pdf_path):
     try:
-        # Use the 'open' command to open the PDF in Preview
-        subprocess.run(["open", "-a", "Preview", pdf_path], check=True)
-        print(f"Opened {pdf_path} in Preview")
+        # Preview on macOS, the default PDF viewer (xdg-open) on Linux
+        open_file(pdf_path, mac_app="Preview")
+        print(f"Opened {pdf_path}")
     except subprocess.CalledProcessError as e:
         print(f"Error opening PDF: {e}")
-    except FileNotFoundError:
-        print(f"File not found: {pdf_path}")
+    except FileNotFoundError as e:
+        print(f"Could not open {pdf_path}: {e}")
+
+
+def get_doc_revision_id(docs_service, document_id):
+    document = docs_service.documents().get(documentId=document_id, fields="revisionId").execute()
+    return document["revisionId"]
+
 
+def extract_email_templates(docs_service, force_refresh=False, document_id=None):
+    template_doc = document_id or DOCUMENT_IDS["instruction_docs"]
 
-def extract_email_templates(docs_service):
-    template_doc = DOCUMENT_IDS["instruction_docs"]
+    # Only the revision id is requested here, the full document is downloaded only if it changed
+    revision_id = get_doc_revision_id(docs_service, template_doc)
+    # One cache file for every instruction doc, so sheet sets with their own doc don't evict each other
+    cached_documents = (load_json_cache(EMAIL_TEMPLATES_CACHE_PATH) or {}).get("documents", {})
+    cache = cached_documents.get(template_doc)
+    if not force_refresh and cache is not None and cache.get("revision_id") == revision_id:
+        print(f"Email templates cache hit (revision {revision_id})")
+        return cache["templates"]
+
+    reason = "refresh forced" if force_refresh else "no cached templates" if cache is None else "doc changed"
+    print(f"Email templates cache miss ({reason}), downloading instruction doc")
 
     # Retrieve the document content
     document = docs_service.documents().get(documentId=template_doc).execute()
+    templates = parse_email_templates(document)
+
+    cached_documents[template_doc] = {"revision_id": document.get("revisionId", revision_id), "templates": templates}
+    save_json_cache(EMAIL_TEMPLATES_CACHE_PATH, {"documents": cached_documents})
+    return templates
+
+
+def get_compiled_email_templates(docs_service, document_id, force_refresh=False, template_cache=None):
+    def load():
+        return compile_email_templates(
+            extract_email_templates(docs_service, force_refresh=force_refresh, document_id=document_id),
+            FORMAT_DATA_KEYS,
+            # The instruction doc has other templates too, they aren't sent by this script
+            set(EMAIL_TEMPLATES_SUBJECT_LINES.values()),
+        )
+
+    # Sheet sets processed together share their compiled templates, so each instruction doc is read once
+    return load() if template_cache is None else template_cache.get(document_id, load)
+
+
+def parse_email_templates(document):
     content = document.get("body").get("content", [])
 
     templates = {}
@@ -312,38 +514,21 @@ def get_reinstatement_eligibility_suffix(member_first_name, member_last_name):
     return eligibility_suffix, prior_termination_reason
 
 
-def update_15_day_notice_spreadsheet(sheets_service, format_data):
-    spreadsheet_id = DOCUMENT_IDS["15_day_notice_spreadsheet"]
+FIFTEEN_DAY_NOTICE_COLUMNS_BY_DATA = {
+    "<LAST NAME>": "B",
+    "<FIRST NAME>": "C",
+    "<EMAIL>": "D",
+    "<HOUSE>": "E",
+    "<DATE>": "F",
+    "<DATE (+15 days)>": "G",
+    "<CURRENT REASON>": "H",
+    "<ACTION>": "I",
+}
 
-    # First, insert a new row after the header row
-    request = {
-        "insertDimension": {
-            "range": {
-                "sheetId": 0,  # Assuming it's the first sheet
-                "dimension": "ROWS",
-                "startIndex": 2,  # Insert after the header row
-                "endIndex": 3,
-            },
-            "inheritFromBefore": False,
-        }
-    }
-    sheets_service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": [request]}).execute()
-
-    # Now, update the newly inserted row with member data
-    COLUMNS_BY_DATA = {
-        "<LAST NAME>": "B",
-        "<FIRST NAME>": "C",
-        "<EMAIL>": "D",
-        "<HOUSE>": "E",
-        "<DATE>": "F",
-        "<DATE (+15 days)>": "G",
-        "<CURRENT REASON>": "H",
-        "<ACTION>": "I",
-    }
 
-    # Prepare the update requests
-    requests = []
-    for data_key, column in COLUMNS_BY_DATA.items():
+def get_15_day_notice_row(format_data):
+    values = []
+    for data_key in FIFTEEN_DAY_NOTICE_COLUMNS_BY_DATA:
         if data_key == "<CURRENT REASON>":
             value = "Workshift"
         elif data_key == "<ACTION>":
@@ -357,32 +542,58 @@ def update_15_day_notice_spreadsheet(sheets_service, format_data):
             value = action
         else:
             value = format_data[data_key]
+        values.append({"userEnteredValue": {"stringValue": str(value)}} if value else {})
+    return {"values": values}
+
+
+def update_15_day_notice_spreadsheet(sheets_service, format_data_list, spreadsheet_id=None):
+    if not format_data_list:
+        return
+    spreadsheet_id = spreadsheet_id or DOCUMENT_IDS["15_day_notice_spreadsheet"]
+    columns = [ord(column) - ord("A") for column in FIFTEEN_DAY_NOTICE_COLUMNS_BY_DATA.values()]
+    assert columns == list(range(columns[0], columns[-1] + 1)), "15 day notice columns must be contiguous"
+
+    # Each member used to be inserted at the top on their own, so the last one ends up first
+    rows = [get_15_day_notice_row(format_data) for format_data in reversed(format_data_list)]
+    requests = [
+        # First, insert new rows after the header row
+        {
+            "insertDimension": {
+                "range": {
+                    "sheetId": 0,  # Assuming it's the first sheet
+                    "dimension": "ROWS",
+                    "startIndex": 2,  # Insert after the header row
+                    "endIndex": 2 + len(rows),
+                },
+                "inheritFromBefore": False,
+            }
+        },
+        # Then fill in all of the new rows with member data at once
+        {
+            "updateCells": {
+                "range": {
+                    "sheetId": 0,
+                    "startRowIndex": 2,
+                    "endRowIndex": 2 + len(rows),
+                    "startColumnIndex": columns[0],
+                    "endColumnIndex": columns[-1] + 1,
+                },
+                "rows": rows,
+                "fields": "userEnteredValue",
+            }
+        },
+    ]
 
-        if value:
-            requests.append(
-                {
-                    "updateCells": {
-                        "range": {
-                            "sheetId": 0,
-                            "startRowIndex": 2,
-                            "endRowIndex": 3,
-                            "startColumnIndex": ord(column) - ord("A"),
-                            "endColumnIndex": ord(column) - ord("A") + 1,
-                        },
-                        "rows": [{"values": [{"userEnteredValue": {"stringValue": str(value)}}]}],
-                        "fields": "userEnteredValue",
-                    }
-                }
-            )
-
-    # Execute all updates in a single batch request
-    if requests:
-        sheets_service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}).execute()
+    # Both happen in a single batch request, which the Sheets API applies atomically
+    sheets_service.spreadsheets().batchUpdate(spreadsheetId=spreadsheet_id, body={"requests": requests}).execute()
 
-    print(f"Updated 15-day notice spreadsheet for {format_data['<FULL NAME>']}")
+    print(
+        "Updated 15-day notice spreadsheet for "
+        + ", ".join(format_data["<FULL NAME>"] for format_data in format_data_list)
+    )
 
 
-def update_down_hours_spreadsheet(sheets_service, row, format_data):
+def update_down_hours_spreadsheet(write_buffer, row, format_data, flush=FLUSH_WRITES_PER_MEMBER):
     house_code = format_data["<HOUSE>"]
     member_first_name = format_data["<FIRST NAME>"]
     member_last_name = format_data["<LAST NAME>"]
@@ -402,134 +613,705 @@ def update_down_hours_spreadsheet(sheets_service, row, format_data):
 
     for col, value in spreadsheet_items_to_update.items():
         print(f"Updating {member_first_name} {member_last_name} col {col} to {value}")
-        update_down_hours_spreadsheet_cell(sheets_service, col, row.name, value)
+        update_down_hours_spreadsheet_cell(write_buffer, col, row.name, value)
 
+    if flush:
+        write_buffer.flush()
 
-def get_email_by_action(action, templates, format_data, services):
-    member_first_name = format_data["<FIRST NAME>"]
-    member_last_name = format_data["<LAST NAME>"]
-    if action == POTENTIAL_TERMINATION_ACTION:
-        # Get from input whether member is eligible for reinstatement, default to eligible
-        eligibility_suffix, prior_termination_reason = get_reinstatement_eligibility_suffix(
-            member_first_name, member_last_name
-        )
-        if prior_termination_reason is not None:
-            format_data["<PRIOR TERMINATION REASON>"] = prior_termination_reason
 
-        document_id = DOCUMENT_IDS["conditional_contract"]
-        cc_pdf = f"cc_{member_first_name}_{member_last_name}.pdf"
-        fill_pdf(services, cc_pdf, format_data, document_id)
+def get_follow_up_due_time(date, days_after=0):
+    # date is a MM/DD/YYYY date from the format data
+    return (datetime.strptime(date, "%m/%d/%Y") + timedelta(days=days_after, hours=FOLLOW_UP_HOUR)).timestamp()
 
-        document_id = DOCUMENT_IDS[f"potential_termination_reinstatement_{eligibility_suffix}"]
-        potential_termination_pdf = f"potential_termination_{member_first_name}_{member_last_name}.pdf"
-        fill_pdf(services, potential_termination_pdf, format_data, document_id)
 
-        pdf_attachments = [cc_pdf, potential_termination_pdf]
+def check_follow_up_templates():
+    for template in [CONDITIONAL_CONTRACT_REMINDER, FIFTEEN_DAY_FOLLOW_UP]:
+        for text in template:
+            EmailTemplate(text, name=template[0]).check_placeholders(FORMAT_DATA_KEYS)
 
-        subject, body = get_email_template(templates, action)
 
-    elif action == PENDING_TERMINATION_ACTION:
-        eligibility_suffix, prior_termination_reason = get_reinstatement_eligibility_suffix(
-            member_first_name, member_last_name
-        )
-        if prior_termination_reason is not None:
-            format_data["<PRIOR TERMINATION REASON>"] = prior_termination_reason
+def render_follow_up(template, format_data):
+    subject, body = template
+    return EmailTemplate(subject).render(format_data), EmailTemplate(body).render(format_data)
 
-        document_id = DOCUMENT_IDS[f"pending_termination_notice_reinstatement_{eligibility_suffix}"]
-        pending_termination_pdf = f"pending_termination_{member_first_name}_{member_last_name}.pdf"
-        fill_pdf(services, pending_termination_pdf, format_data, document_id)
 
-        pdf_attachments = [pending_termination_pdf]
+def schedule_follow_ups(job_queue, entry, config):
+    format_data = entry["format_data"]
+    action = format_data["<ACTION>"]
+    sheet_row, member_email = get_entry_key(entry)
+    # Keyed by the sheet row, so that queuing them again after an interrupted run does nothing
+    key = f"{config['document_ids']['down_hours_spreadsheet']}:{sheet_row}:{member_email}"
+    if action == POTENTIAL_TERMINATION_ACTION:
+        subject, body = render_follow_up(CONDITIONAL_CONTRACT_REMINDER, format_data)
+        job_queue.enqueue(
+            f"conditional_contract_reminder:{key}",
+            "conditional_contract_reminder",
+            get_follow_up_due_time(format_data["<DATE (+1 week)>"]),
+            {"to": format_data["<EMAIL>"], "cc": [entry["workshift_manager_email"]], "subject": subject, "body": body},
+        )
+    if action in [POTENTIAL_TERMINATION_ACTION, PENDING_TERMINATION_ACTION]:
+        subject, body = render_follow_up(FIFTEEN_DAY_FOLLOW_UP, format_data)
+        job_queue.enqueue(
+            f"fifteen_day_follow_up:{key}",
+            "fifteen_day_follow_up",
+            get_follow_up_due_time(format_data["<DATE (+15 days)>"], days_after=1),
+            {"to": SENDER_EMAIL, "cc": [], "subject": subject, "body": body},
+        )
 
-        subject, body = get_email_template(templates, action)
 
+def get_pdf_jobs(action, format_data, eligibility_suffix=None, document_ids=None):
+    # The PDFs to attach for an action, as (file name, template document id)
+    document_ids = document_ids or DOCUMENT_IDS
+    member_first_name = format_data["<FIRST NAME>"]
+    member_last_name = format_data["<LAST NAME>"]
+    if action == POTENTIAL_TERMINATION_ACTION:
+        return [
+            (f"cc_{member_first_name}_{member_last_name}.pdf", document_ids["conditional_contract"]),
+            (
+                f"potential_termination_{member_first_name}_{member_last_name}.pdf",
+                document_ids[f"potential_termination_reinstatement_{eligibility_suffix}"],
+            ),
+        ]
+    elif action == PENDING_TERMINATION_ACTION:
+        return [
+            (
+                f"pending_termination_{member_first_name}_{member_last_name}.pdf",
+                document_ids[f"pending_termination_notice_reinstatement_{eligibility_suffix}"],
+            )
+        ]
     elif action == COURTESY_NOTICE_ACTION:
-        pdf_attachments = []
-
-        subject, body = get_email_template(templates, action)
+        return []
     else:
         raise ValueError(f"Invalid action {action}")
 
-    # Format the body. Wrap all < > with {} in body and then use formatting
-    body = body.replace("<", "{<").replace(">", ">}").format_map(format_data)
 
-    assert "{" not in body and "}" not in body, "Body has { or } in it, probably formatting failed"
-    assert "<" not in body and ">" not in body, "Body has < or > in it, which are not formatted properly"
-    return subject, body, pdf_attachments
+def get_email_draft(action, templates, format_data):
+    # The templates are compiled once per run, see compile_email_templates
+    subject, template = get_email_template(templates, action)
+    return subject, template.render(format_data)
+
 
+def get_email_by_action(action, templates, format_data, services, eligibility_suffix=None, document_ids=None):
+    pdf_attachments = [
+        render_pdf(services, name, format_data, document_id)
+        for name, document_id in get_pdf_jobs(action, format_data, eligibility_suffix, document_ids)
+    ]
+    subject, body = get_email_draft(action, templates, format_data)
+    return subject, body, pdf_attachments
 
-def process_new_down_hour_entry(services, row, templates, full_df):
-    house_code = get_house_code(row)
-    member_first_name, member_last_name = get_capitalized_names(row)
-    had_prior_CC, member_email = had_prior_conditional_contract(row, full_df)
-    action = get_action(row, had_prior_CC)
-    workshift_manager_email = row["Email Address"].strip()
 
-    print(f"Action for {member_first_name} {member_last_name} is {action}")
+def make_down_hour_entry(
+    row, first_name, last_name, house_code, member_email, action, had_prior_CC, manager_email, config=None
+):
+    config = config or get_sheet_config()
+    print(f"Action for {first_name} {last_name} is {action}")
     date_today = datetime.now().strftime("%m/%d/%Y")
     date_7days = (datetime.now() + timedelta(days=7)).strftime("%m/%d/%Y")
     date_15days = (datetime.now() + timedelta(days=15)).strftime("%m/%d/%Y")
     format_data = {
-        "<FIRST NAME>": member_first_name,
-        "<LAST NAME>": member_last_name,
-        "<FULL NAME>": f"{member_first_name} {member_last_name}",
+        "<FIRST NAME>": first_name,
+        "<LAST NAME>": last_name,
+        "<FULL NAME>": f"{first_name} {last_name}",
         "<HOUSE>": house_code,
         "<DATE>": date_today,
         "<DATE (+1 week)>": date_7days,
         "<DATE (+15 days)>": date_15days,
-        "<SEMESTER, YEAR>": SEMESTER_YEAR,
-        "<OPS_SUPERVISOR>": OPS_SUPERVISOR,
+        "<SEMESTER, YEAR>": config["semester_year"],
+        "<OPS_SUPERVISOR>": config["ops_supervisor"],
         "<EMAIL>": member_email,
         "<ACTION>": action,
         "<EXISTING CC>": had_prior_CC,
     }
+    return {"row": row, "format_data": format_data, "workshift_manager_email": manager_email}
+
+
+def plan_down_hours(df, full_df, strict=True):
+    """Computes what to do for every row of df at once, as column operations.
+
+    Members down 15 or more hours get a potential termination notice, or a pending termination notice if they already
+    got a conditional contract with an earlier one. Members down 10 or more hours get a courtesy notice.
+
+    Returns a table with the same index as df. Prior conditional contracts are looked up in full_df, counting only
+    rows above each row. With strict=False, rows that can't be classified get a missing action instead of an error.
+    """
+    import numpy as np
+    import pandas as pd
+
+    member_emails = df["Member's Email"].fillna("").str.strip()
+    manager_emails = df["Email Address"].fillna("").str.strip()
+    down_hours = df["Member's Down Hours"].to_numpy(dtype=float)
+
+    # Row label of each member's first potential termination notice, i.e. their first conditional contract
+    potential = full_df[full_df["Action"] == POTENTIAL_TERMINATION_ACTION]
+    first_cc_idx = (
+        pd.Series(potential.index, index=potential["Member's Email"].fillna("").str.strip().str.lower())
+        .groupby(level=0)
+        .min()
+    )
+    # Members without one get NaN, which is never smaller than a row label
+    had_prior_cc = member_emails.str.lower().map(first_cc_idx).to_numpy(dtype=float) < df.index.to_numpy()
+
+    actions = np.select(
+        [(down_hours >= 15) & had_prior_cc, down_hours >= 15, down_hours >= 10],
+        [PENDING_TERMINATION_ACTION, POTENTIAL_TERMINATION_ACTION, COURTESY_NOTICE_ACTION],
+        default="",
+    )
+    plan = pd.DataFrame(
+        {
+            "first_name": df["Member's First Name"].fillna("").str.title(),
+            "last_name": df["Member's Last Name"].fillna("").str.title(),
+            "house": pd.Categorical(manager_emails.str[0:3].str.upper().str.strip()),
+            "member_email": member_emails,
+            "workshift_manager_email": manager_emails,
+            "down_hours": down_hours,
+            "had_prior_cc": had_prior_cc,
+            "existing_cc": pd.Categorical(np.where(had_prior_cc, "Yes", "No"), categories=["No", "Yes"]),
+            "action": pd.Categorical(
+                actions, categories=[COURTESY_NOTICE_ACTION, POTENTIAL_TERMINATION_ACTION, PENDING_TERMINATION_ACTION]
+            ),
+        },
+        index=df.index,
+    )
+
+    if strict:
+        invalid_emails = plan.index[~member_emails.str.fullmatch(MEMBER_EMAIL_PATTERN)]
+        assert len(invalid_emails) == 0, f"Member emails in rows {list(invalid_emails)} are not valid"
+        unclassified = plan.index[plan["action"].isnull()]
+        if len(unclassified):
+            raise ValueError(f"Down hours should be >= 10 to be on the form, they aren't in rows {list(unclassified)}")
+    return plan
+
+
+def get_down_hour_entries(df, plan, config=None):
+    return [
+        make_down_hour_entry(
+            row,
+            planned.first_name,
+            planned.last_name,
+            planned.house,
+            planned.member_email,
+            planned.action,
+            planned.existing_cc,
+            planned.workshift_manager_email,
+            config,
+        )
+        for (_, row), planned in zip(df.iterrows(), plan.itertuples())
+    ]
 
-    subject, body, pdf_attachments = get_email_by_action(action, templates, format_data, services)
 
-    if SAFE_MODE:
-        [open_pdf_in_preview(pdf) for pdf in pdf_attachments]
-        input(
-            f"About to send email to {member_email} and {workshift_manager_email}.\n\nSubject: {subject}\n\nBody:\n{body}\n\nAttachments: {', '.join(os.path.basename(path) for path in pdf_attachments)}\n\nPress Enter to continue"
+def audit_down_hours(full_df):
+    # Re-classifies every row that already has an action, and returns the rows where the sheet disagrees
+    processed = full_df[full_df["Action"].astype(object).fillna("") != ""]
+    start = time.perf_counter()
+    plan = plan_down_hours(processed, full_df, strict=False)
+    print(f"Re-classified {len(plan)} rows in {(time.perf_counter() - start) * 1000:.1f}ms")
+
+    recorded_action = processed["Action"].astype(object)
+    recorded_cc = processed["Existing CC"].astype(object).fillna("")
+    differs = (plan["action"].astype(object) != recorded_action) | (plan["existing_cc"].astype(object) != recorded_cc)
+    mismatches = plan.loc[differs, ["first_name", "last_name", "member_email", "down_hours", "existing_cc", "action"]]
+    return mismatches.assign(recorded_existing_cc=recorded_cc[differs], recorded_action=recorded_action[differs])
+
+
+def is_step_done(entry, step):
+    # Steps completed by an earlier, interrupted run, according to the ledger
+    return step in entry.get("completed_steps", {})
+
+
+def ask_reinstatement_eligibility(entry, eligibility_answers=None, interactive=True):
+    # Returns None if the member needs an answer that isn't in eligibility_answers and nobody can be asked
+    format_data = entry["format_data"]
+    if is_step_done(entry, "rendered"):
+        return entry
+    if format_data["<ACTION>"] in [POTENTIAL_TERMINATION_ACTION, PENDING_TERMINATION_ACTION]:
+        eligibility_key = get_eligibility_key(format_data["<FIRST NAME>"], format_data["<LAST NAME>"])
+        if eligibility_answers and eligibility_key in eligibility_answers:
+            eligibility_suffix, prior_termination_reason = eligibility_answers[eligibility_key]
+        elif not interactive:
+            print(f"No reinstatement eligibility for {format_data['<FULL NAME>']}, leaving them for the next run")
+            return None
+        else:
+            # Get from input whether member is eligible for reinstatement, default to eligible
+            eligibility_suffix, prior_termination_reason = get_reinstatement_eligibility_suffix(
+                format_data["<FIRST NAME>"], format_data["<LAST NAME>"]
+            )
+        if prior_termination_reason is not None:
+            format_data["<PRIOR TERMINATION REASON>"] = prior_termination_reason
+        entry["eligibility_suffix"] = eligibility_suffix
+    return entry
+
+
+def prepare_down_hour_entry(context, entry):
+    if is_step_done(entry, "rendered"):
+        return entry
+    format_data = entry["format_data"]
+    with profiling.member(format_data["<FULL NAME>"]):
+        subject, body, pdf_attachments = get_email_by_action(
+            format_data["<ACTION>"],
+            context["templates"],
+            format_data,
+            context["services"],
+            entry.get("eligibility_suffix"),
+            context["config"]["document_ids"],
+        )
+    entry.update({"subject": subject, "body": body, "pdf_attachments": pdf_attachments})
+    context["ledger"].record_rendered(entry)
+    return entry
+
+
+def prepare_down_hour_entries_in_batches(context, entries):
+    to_render = [entry for entry in entries if not is_step_done(entry, "rendered")]
+    jobs, job_entries = [], []
+    for entry in to_render:
+        format_data = entry["format_data"]
+        pdf_jobs = get_pdf_jobs(
+            format_data["<ACTION>"], format_data, entry.get("eligibility_suffix"), context["config"]["document_ids"]
         )
+        for name, document_id in pdf_jobs:
+            jobs.append((name, format_data, document_id))
+            job_entries.append(entry)
+
+    with profiling.span("fill_pdfs_in_batches"):
+        pdfs = fill_pdfs_in_batches(context["services"], jobs, max_workers=MAX_WORKERS)
+
+    for entry in to_render:
+        entry["pdf_attachments"] = []
+    for (name, _, _), entry, pdf in zip(jobs, job_entries, pdfs):
+        if isinstance(pdf, Exception):
+            # Nothing is sent to a member unless all of their PDFs could be filled in
+            entry["render_error"] = f"Could not fill in {name}: {type(pdf).__name__}: {pdf}"
+            continue
+        if SAVE_PDFS_TO_DISK:
+            pdf.save()
+        entry["pdf_attachments"].append(pdf)
+
+    for entry in to_render:
+        subject, body = get_email_draft(entry["format_data"]["<ACTION>"], context["templates"], entry["format_data"])
+        entry.update({"subject": subject, "body": body})
+        if "render_error" not in entry:
+            context["ledger"].record_rendered(entry)
+    return entries
+
+
+def prepare_down_hour_entries(context, entries, executor):
+    # Returns the prepared entries in order, as they become ready
+    if BATCH_GOOGLE_REQUESTS and not RENDER_PDFS_LOCALLY:
+        return iter(prepare_down_hour_entries_in_batches(context, entries))
+    return executor.map(lambda entry: prepare_down_hour_entry(context, entry), entries)
+
+
+def confirm_down_hour_entry(entry):
+    if SAFE_MODE and "render_error" not in entry and not is_step_done(entry, "emailed"):
+        pdf_attachments = entry["pdf_attachments"]
+        with OPERATOR_LOCK:
+            # PDFs only live in memory, so they are written to disk to preview them
+            [open_pdf_in_preview(pdf.save(get_review_pdf_name(entry, pdf))) for pdf in pdf_attachments]
+            input(
+                f"About to send email to {entry['format_data']['<EMAIL>']} and {entry['workshift_manager_email']}.\n\nSubject: {entry['subject']}\n\nBody:\n{entry['body']}\n\nAttachments: {', '.join(pdf.name for pdf in pdf_attachments)}\n\nPress Enter to continue"
+            )
+
+
+def get_upload_app_properties(context, entry):
+    # Every uploaded PDF is tagged with the entry it belongs to, so that an interrupted run can find it again
+    sheet_row, member_email = get_entry_key(entry)
+    app_properties = {
+        "downHoursRow": str(sheet_row),
+        "memberEmail": member_email,
+        "semester": entry["format_data"]["<SEMESTER, YEAR>"],
+    }
+    if context["config"]["name"] is not None:
+        app_properties["sheetSet"] = context["config"]["name"]
+    return app_properties
+
+
+def find_previous_uploads(context, entry):
+    # PDFs that an earlier run uploaded for this entry, by name: from the ledger, or from Drive if the run stopped
+    # before the ledger got their IDs. Only entries that the ledger has a record of can have any.
+    if "previous_drive_file_ids" not in entry:
+        return {}
+    previous_uploads = dict(entry["previous_drive_file_ids"])
+    if any(pdf.name not in previous_uploads for pdf in entry["pdf_attachments"]):
+        drive_service, folder_id = context["services"]["drive"], context["config"]["pdfs_folder_id"]
+        found = find_uploaded_files(drive_service, folder_id, get_upload_app_properties(context, entry))
+        previous_uploads = {**found, **previous_uploads}
+
+    # A PDF that isn't attached anymore, e.g. because the action changed, would be left in Drive for nothing
+    names = {pdf.name for pdf in entry["pdf_attachments"]}
+    for name, file_id in previous_uploads.items():
+        if name not in names:
+            print(f"Deleting {name} from Google Drive, it isn't part of the new draft")
+            try:
+                context["services"]["drive"].files().delete(fileId=file_id, supportsAllDrives=True).execute()
+            except Exception as e:
+                print(f"An error occurred while deleting {name} ({file_id}): {e}")
+    return {name: file_id for name, file_id in previous_uploads.items() if name in names}
+
+
+def dispatch_down_hour_entry(context, entry):
+    with profiling.member(entry["format_data"]["<FULL NAME>"]):
+        return _dispatch_down_hour_entry(context, entry)
+
 
+def _dispatch_down_hour_entry(context, entry):
     ####################################################
     # Start doing the actual work that modifies things #
     ####################################################
-
-    # Update 15 day notice spreadsheet
-    if action == POTENTIAL_TERMINATION_ACTION or action == PENDING_TERMINATION_ACTION:
-        print(f"Updating 15 day notice spreadsheet for {member_first_name} {member_last_name}")
-        update_15_day_notice_spreadsheet(services["sheets"], format_data)
-
-    for pdf_path in pdf_attachments:
-        print(f"Uploading {pdf_path} to Google Drive")
-        drive_file_id = upload_to_drive(services["drive"], pdf_path, PDFS_FOLDER_ID)
-        print(f"Uploaded {pdf_path} to Google Drive with file ID: {drive_file_id}")
+    services = context["services"]
+    format_data = entry["format_data"]
+    action = format_data["<ACTION>"]
+    member_first_name, member_last_name = format_data["<FIRST NAME>"], format_data["<LAST NAME>"]
+    member_email, workshift_manager_email = format_data["<EMAIL>"], entry["workshift_manager_email"]
+    pdf_attachments = entry["pdf_attachments"]
+
+    if "render_error" in entry:
+        print(f"Not sending anything to {member_first_name} {member_last_name}. {entry['render_error']}")
+        entry["email_result"] = {"to": member_email, "sent": False, "status": "failed", "error": entry["render_error"]}
+        return entry
+
+    ledger = context["ledger"]
+    # Members are dispatched concurrently already, so a member's own PDFs are uploaded one after the other
+    if not is_step_done(entry, "uploaded"):
+        print(f"Uploading {', '.join(pdf.name for pdf in pdf_attachments)} to Google Drive")
+        with profiling.span("upload_to_drive"):
+            entry["drive_file_ids"] = upload_many(
+                services,
+                pdf_attachments,
+                context["config"]["pdfs_folder_id"],
+                find_previous_uploads(context, entry),
+                get_upload_app_properties(context, entry),
+                max_workers=1,
+            )
+        for pdf, drive_file_id in zip(pdf_attachments, entry["drive_file_ids"]):
+            print(f"Uploaded {pdf.name} to Google Drive with file ID: {drive_file_id}")
+        # Failed uploads are tried again by the next run
+        if None not in entry["drive_file_ids"]:
+            ledger.record_uploaded(entry)
 
     # Actually send the email
-    print(f"Sending email to {member_email} and {workshift_manager_email}")
-    send_email(member_email, [workshift_manager_email], subject, body, pdf_attachments)
-    print("Email sent.")
+    if is_step_done(entry, "emailed"):
+        print(f"Not emailing {member_email} again, that was done at {entry['completed_steps']['emailed']}")
+        entry["email_result"] = {
+            "to": member_email,
+            "cc": workshift_manager_email,
+            "subject": entry["subject"],
+            "sent": True,
+            "status": "sent",
+            "error": None,
+        }
+    else:
+        print(f"Sending email to {member_email} and {workshift_manager_email}")
+        with profiling.span("send_email"):
+            entry["email_result"] = send_email(
+                context["mailer"],
+                member_email,
+                [workshift_manager_email],
+                entry["subject"],
+                entry["body"],
+                pdf_attachments,
+            )
+        if entry["email_result"]["sent"]:
+            ledger.record_step(entry, "emailed")
+    if not entry["email_result"]["sent"]:
+        # Leave the action empty in the down hours spreadsheet, so the member is picked up again next run
+        print(f"Not updating down hours spreadsheet for {member_first_name} {member_last_name}, email failed")
+        return entry
+
+    # Update 15 day notice spreadsheet, once the email is sent and before the down hours spreadsheet
+    if (action == POTENTIAL_TERMINATION_ACTION or action == PENDING_TERMINATION_ACTION) and not is_step_done(
+        entry, "fifteen_day_written"
+    ):
+        if context["flush_writes_per_member"]:
+            print(f"Updating 15 day notice spreadsheet for {member_first_name} {member_last_name}")
+            with profiling.span("update_15_day_notice_spreadsheet"):
+                update_15_day_notice_spreadsheet(
+                    services["sheets"], [format_data], context["config"]["document_ids"]["15_day_notice_spreadsheet"]
+                )
+            ledger.record_step(entry, "fifteen_day_written")
+        else:
+            context["fifteen_day_notices"].append((entry["row"].name, entry))
+
+    if context["job_queue"] is not None:
+        schedule_follow_ups(context["job_queue"], entry, context["config"])
 
     # Update down hours spreadsheet
-    update_down_hours_spreadsheet(services["sheets"], row, format_data)
+    with profiling.span("update_down_hours_spreadsheet"):
+        update_down_hours_spreadsheet(
+            context["write_buffer"], entry["row"], format_data, flush=context["flush_writes_per_member"]
+        )
+    if context["flush_writes_per_member"]:
+        ledger.record_step(entry, "down_hours_written")
 
     print(f"Finished everything for {member_first_name} {member_last_name}")
+    return entry
+
+
+def ask_all_reinstatement_eligibility(context, entries, eligibility_answers=None):
+    # Questions to the operator are asked in sheet order before any work starts
+    with OPERATOR_LOCK:
+        return [
+            entry
+            for entry in entries
+            if ask_reinstatement_eligibility(entry, eligibility_answers, context["interactive"]) is not None
+        ]
+
 
+def process_down_hour_entries_concurrently(context, entries, eligibility_answers=None):
+    entries = ask_all_reinstatement_eligibility(context, entries, eligibility_answers)
 
-def process_new_down_hour_entries():
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        # Drafts and PDFs for all members are prepared at the same time...
+        prepared = prepare_down_hour_entries(context, entries, executor)
+
+        # ...while they are confirmed one by one in sheet order. As soon as a member is confirmed,
+        # their uploads, email and sheet updates are sent off without waiting for the others.
+        dispatched = []
+        for entry in prepared:
+            if context["interactive"]:
+                confirm_down_hour_entry(entry)
+            dispatched.append(executor.submit(dispatch_down_hour_entry, context, entry))
+
+        return [future.result() for future in dispatched]
+
+
+def review_down_hour_entries(context, entries, eligibility_answers=None):
+    # Phase one: all questions up front, then every draft and PDF is generated without stopping
+    entries = ask_all_reinstatement_eligibility(context, entries, eligibility_answers)
+
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        entries = list(prepare_down_hour_entries(context, entries, executor))
+        for entry in entries:
+            if "render_error" in entry:
+                print(f"Leaving {entry['format_data']['<FULL NAME>']} out of the review. {entry['render_error']}")
+        # Members who were already emailed by an interrupted run only have their sheet updates left to do
+        reviewable = [entry for entry in entries if "render_error" not in entry and not is_step_done(entry, "emailed")]
+
+        # Phase two: a single review of everything, after which the approved members are sent off together
+        report_path, text_report_path = write_review_report(
+            reviewable, get_named_path(REVIEW_FOLDER, context["config"]["name"])
+        )
+        with OPERATOR_LOCK:
+            print(f"Review the drafts in {report_path} (or {text_report_path})")
+            try:
+                open_file(report_path.resolve())
+            except (subprocess.CalledProcessError, OSError) as e:
+                print(f"Could not open {report_path}: {e}")
+            approved = ask_for_approval(reviewable)
+        approved_ids = {id(entry) for entry in approved}
+        for entry in reviewable:
+            if id(entry) not in approved_ids:
+                print(f"Skipping {entry['format_data']['<FULL NAME>']}, they will come up again next run")
+
+        # Members whose PDFs failed are dispatched too, which only records the failure for the end of run summary
+        to_dispatch = [
+            entry
+            for entry in entries
+            if id(entry) in approved_ids or "render_error" in entry or is_step_done(entry, "emailed")
+        ]
+        return list(executor.map(lambda entry: dispatch_down_hour_entry(context, entry), to_dispatch))
+
+
+def get_run_services(scheduler=None):
+    profiler = profiling.get_profiler()
     creds = get_credentials()
-    services = get_google_services(creds)
-    full_df = get_down_hours_df(services["sheets"], only_action_null=False)
-    df = get_down_hours_df(services["sheets"])
-    templates = extract_email_templates(services["docs"])
+    # All threads share one scheduler, so they share the quotas too
+    scheduler = scheduler or RequestScheduler()
+
+    def make_service(name):
+        services = schedule_services({name: get_google_service(name, creds)}, scheduler)
+        if profiler is not None:
+            services = profiling.instrument_services(services, profiler)
+        return services[name]
+
+    # Services are built per thread, and only once they are first used
+    return ThreadLocalGoogleServices(make_service)
+
+
+def process_new_down_hour_entries(
+    refresh_templates=False,
+    incremental=False,
+    services=None,
+    mailer=None,
+    scheduler=None,
+    review=False,
+    eligibility_answers=None,
+    ledger=None,
+    config=None,
+    template_cache=None,
+    job_queue=None,
+    interactive=True,
+):
+    # With interactive=False nothing is asked: there is no preview in SAFE_MODE, and members who need a
+    # reinstatement eligibility answer that isn't in eligibility_answers are left pending
+    assert interactive or not review, "Review mode asks for approval, so it can't be used non-interactively"
+    config = config or get_sheet_config()
+    profiler = profiling.get_profiler()
+    if services is None:
+        services = get_run_services(scheduler)
+    else:
+        if scheduler is not None:
+            services = schedule_services(services, scheduler)
+        if profiler is not None:
+            services = profiling.instrument_services(services, profiler)
+    sheet = read_down_hours_sheet(services["sheets"], incremental=incremental, config=config)
+    # Most runs find nothing new, so stop before loading pandas, the templates, or the Docs and Drive services
+    if count_pending_rows(sheet) == 0:
+        print("There are 0 rows to process")
+        return []
+
+    full_df, df = get_down_hours_dfs(sheet)
+    templates = get_compiled_email_templates(
+        services["docs"], config["document_ids"]["instruction_docs"], refresh_templates, template_cache
+    )
+    # The PDF templates may have been edited since the last run in this process, they are checked again when used
+    forget_loaded_templates()
+    if job_queue is not None or SCHEDULE_FOLLOW_UPS:
+        # Checked before any notice is sent, since their follow ups are queued right after
+        check_follow_up_templates()
+    plan = plan_down_hours(df, full_df)
+    write_buffer = get_down_hours_write_buffer(services["sheets"], config)
 
     print(f"There are {len(df)} rows to process")
 
-    # Example usage
-    for _, row in df.iterrows():
-        process_new_down_hour_entry(services, row, templates, full_df)
+    entries = get_down_hour_entries(df, plan, config)
+    mailer_context = Mailer() if mailer is None else nullcontext(mailer)
+    ledger_context = RunLedger(name=config["name"]) if ledger is None else nullcontext(ledger)
+    job_queue_context = JobQueue() if job_queue is None and SCHEDULE_FOLLOW_UPS else nullcontext(job_queue)
+    with mailer_context as mailer, ledger_context as ledger, job_queue_context as job_queue:
+        for entry in entries:
+            ledger.restore(entry)
+        context = {
+            "config": config,
+            "services": services,
+            "templates": templates,
+            "write_buffer": write_buffer,
+            "mailer": mailer,
+            "ledger": ledger,
+            # Follow up emails are queued here, or not at all if this is None
+            "job_queue": job_queue,
+            # Approved members in review mode are committed together, so their sheet updates are too
+            "flush_writes_per_member": FLUSH_WRITES_PER_MEMBER and not review,
+            # Only used if flush_writes_per_member is False, to add all rows in one request at the end
+            "fifteen_day_notices": [],
+            "interactive": interactive,
+        }
+        if review:
+            entries = review_down_hour_entries(context, entries, eligibility_answers)
+        else:
+            entries = process_down_hour_entries_concurrently(context, entries, eligibility_answers)
+
+        # The 15 day notices go first, like for a single member. If they fail, the down hours rows are left pending
+        # and the next run writes both.
+        fifteen_day_entries = [entry for _, entry in sorted(context["fifteen_day_notices"], key=lambda item: item[0])]
+        update_15_day_notice_spreadsheet(
+            services["sheets"],
+            [entry["format_data"] for entry in fifteen_day_entries],
+            config["document_ids"]["15_day_notice_spreadsheet"],
+        )
+        for entry in fifteen_day_entries:
+            ledger.record_step(entry, "fifteen_day_written")
+        write_buffer.flush()
+        for entry in entries:
+            if entry["email_result"]["sent"] and not is_step_done(entry, "down_hours_written"):
+                ledger.record_step(entry, "down_hours_written")
+
+    failed = [entry for entry in entries if not entry["email_result"]["sent"]]
+    for entry in failed:
+        if entry["email_result"]["status"] == "unknown":
+            # Left pending like a failed email, so the next run would send it again
+            print(
+                f"Not sure whether {entry['format_data']['<FULL NAME>']} was emailed, check the Sent folder before "
+                f"running again: {entry['email_result']['error']}"
+            )
+        else:
+            print(f"Failed to email {entry['format_data']['<FULL NAME>']}: {entry['email_result']['error']}")
+    return entries
 
 
 if __name__ == "__main__":
-    process_new_down_hour_entries()
+    parser = argparse.ArgumentParser(description="Process new entries in the down hours spreadsheet")
+    parser.add_argument(
+        "--refresh-templates",
+        action="store_true",
+        help="Re-download the email templates from the instruction doc even if it hasn't changed",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only read the rows added since the last run, reusing the cached history of processed rows. "
+        "The whole spreadsheet is still read once a day, to catch edits to older rows",
+    )
+    parser.add_argument(
+        "--review",
+        action="store_true",
+        help="Generate every draft first, review them all in one report, then send the approved ones together",
+    )
+    parser.add_argument(
+        "--eligibility",
+        help="CSV with the reinstatement eligibility of members (First Name, Last Name, Eligible, "
+        "Prior Termination Reason), instead of asking for each one",
+    )
+    parser.add_argument(
+        "--audit",
+        action="store_true",
+        help="Re-classify every processed row and list the ones whose action or existing CC differ, then exit",
+    )
+    parser.add_argument(
+        "--sent",
+        nargs="?",
+        const=SEMESTER_YEAR,
+        metavar="SEMESTER",
+        help=f"List the emails sent in a semester (default: {SEMESTER_YEAR}) according to the local ledger, then exit",
+    )
+    parser.add_argument(
+        "--find-missing-emails",
+        action="store_true",
+        help="Fill in the emails of pending rows that don't have one from the member database export, then exit",
+    )
+    parser.add_argument(
+        "--person-list",
+        default=PERSON_LIST_EXPORT_PATH,
+        help="PersonListExport.csv to look up missing emails in (defaults to $PERSON_LIST_EXPORT_PATH)",
+    )
+    parser.add_argument("--profile", action="store_true", help="Print where the run spent its time at the end")
+    parser.add_argument("--profile-json", help="Save every API call and step of the run to this JSON file")
+    parser.add_argument("--trace", help="Save a Chrome trace (chrome://tracing, Perfetto) of the run to this file")
+    args = parser.parse_args()
+
+    if args.audit:
+        mismatches = audit_down_hours(
+            get_down_hours_df_from_sheet(read_down_hours_sheet(get_google_service("sheets", get_credentials())))
+        )
+        print(f"{len(mismatches)} rows don't match what would be done today")
+        if len(mismatches):
+            print(mismatches.to_string())
+        raise SystemExit
+
+    if args.sent:
+        with RunLedger() as ledger:
+            sent = ledger.sent_in_semester(args.sent)
+        for record in sent:
+            print(
+                f"{record['emailed_at']}  row {record['sheet_row']:<5} {record['member_email']:<35} {record['action']}"
+            )
+        print(f"{len(sent)} emails sent in {args.sent}")
+        raise SystemExit
+
+    if args.find_missing_emails:
+        find_email_if_not_found(get_google_service("sheets", get_credentials()), args.person_list)
+        raise SystemExit
+
+    profile = args.profile or args.profile_json or args.trace
+    with profiling.profile_run() if profile else nullcontext() as profiler:
+        process_new_down_hour_entries(
+            refresh_templates=args.refresh_templates,
+            incremental=args.incremental,
+            review=args.review,
+            eligibility_answers=load_eligibility_answers(args.eligibility) if args.eligibility else None,
+        )
+
+    if profile:
+        profiler.print_summary()
+        if args.profile_json:
+            profiler.export_json(args.profile_json)
+        if args.trace:
+            profiler.export_chrome_trace(args.trace)
@@ -0,0 +1,220 @@
+"""Records every Google API request and the main steps of a run, so we can see where the time goes.
+
+Use profile_run() around a run. While it is active, span() and member() record timings and the member being
+processed. Outside of it they do nothing.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from bsc_ops_admin.utils import wrap_services
+
+_active_profiler = None
+
+
+class RunProfiler:
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.calls = []
+        self.spans = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def now(self):
+        return time.perf_counter() - self.start_time
+
+    def current_member(self):
+        return getattr(self.local, "member", None)
+
+    def record_call(self, endpoint, start, duration, bytes_sent, bytes_received, retries=0, error=None):
+        call = {
+            "endpoint": endpoint,
+            "member": self.current_member(),
+            "thread": threading.get_ident(),
+            "start": start,
+            "duration": duration,
+            "bytes_sent": bytes_sent,
+            "bytes_received": bytes_received,
+            "retries": retries,
+            "error": error,
+        }
+        with self.lock:
+            self.calls.append(call)
+
+    def record_span(self, name, start, duration):
+        span = {
+            "name": name,
+            "member": self.current_member(),
+            "thread": threading.get_ident(),
+            "start": start,
+            "duration": duration,
+        }
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self):
+        endpoints = defaultdict(lambda: {"calls": 0, "time": 0.0, "bytes": 0, "retries": 0, "errors": 0})
+        for call in self.calls:
+            stats = endpoints[call["endpoint"]]
+            stats["calls"] += 1
+            stats["time"] += call["duration"]
+            stats["bytes"] += call["bytes_sent"] + call["bytes_received"]
+            stats["retries"] += call["retries"]
+            stats["errors"] += call["error"] is not None
+
+        members = defaultdict(lambda: defaultdict(float))
+        for span in self.spans:
+            members[span["member"]][span["name"]] += span["duration"]
+        for call in self.calls:
+            members[call["member"]]["api calls"] += call["duration"]
+        return {
+            "wall_time": self.now(),
+            "endpoints": dict(endpoints),
+            "members": {k: dict(v) for k, v in members.items()},
+        }
+
+    def print_summary(self):
+        summary = self.summary()
+        print(f"\nRun took {summary['wall_time']:.2f}s")
+        print(f"{'endpoint':<45} {'calls':>6} {'total s':>8} {'mean ms':>8} {'KiB':>9} {'retries':>8} {'errors':>7}")
+        for endpoint, stats in sorted(summary["endpoints"].items(), key=lambda item: -item[1]["time"]):
+            print(
+                f"{endpoint:<45} {stats['calls']:>6} {stats['time']:>8.2f} "
+                f"{1000 * stats['time'] / stats['calls']:>8.1f} {stats['bytes'] / 1024:>9.1f} "
+                f"{stats['retries']:>8} {stats['errors']:>7}"
+            )
+
+        step_names = sorted({name for steps in summary["members"].values() for name in steps})
+        print(f"\n{'member':<30} " + " ".join(f"{name:>22}" for name in step_names))
+        for member, steps in summary["members"].items():
+            print(
+                f"{member or '(no member)':<30} " + " ".join(f"{steps.get(name, 0.0):>21.2f}s" for name in step_names)
+            )
+
+    def export_json(self, path):
+        with open(path, "w") as f:
+            json.dump({"summary": self.summary(), "calls": self.calls, "spans": self.spans}, f, indent=2)
+        print(f"Saved run profile to {path}")
+
+    def export_chrome_trace(self, path):
+        # Can be opened in chrome://tracing or https://ui.perfetto.dev
+        events = []
+        for span in self.spans:
+            events.append(
+                {
+                    "name": span["name"],
+                    "cat": "step",
+                    "ph": "X",
+                    "ts": span["start"] * 1e6,
+                    "dur": span["duration"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": span["thread"],
+                    "args": {"member": span["member"]},
+                }
+            )
+        for call in self.calls:
+            events.append(
+                {
+                    "name": call["endpoint"],
+                    "cat": "api",
+                    "ph": "X",
+                    "ts": call["start"] * 1e6,
+                    "dur": call["duration"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": call["thread"],
+                    "args": {key: call[key] for key in ["member", "bytes_sent", "bytes_received", "retries", "error"]},
+                }
+            )
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+        print(f"Saved Chrome trace to {path}")
+
+
+def get_profiler():
+    return _active_profiler
+
+
+@contextmanager
+def profile_run():
+    global _active_profiler
+    profiler = RunProfiler()
+    _active_profiler = profiler
+    try:
+        yield profiler
+    finally:
+        _active_profiler = None
+
+
+@contextmanager
+def span(name):
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    start = profiler.now()
+    try:
+        yield
+    finally:
+        profiler.record_span(name, start, profiler.now() - start)
+
+
+@contextmanager
+def member(name):
+    profiler = _active_profiler
+    if profiler is None:
+        yield
+        return
+    previous = profiler.current_member()
+    profiler.local.member = name
+    try:
+        yield
+    finally:
+        profiler.local.member = previous
+
+
+def payload_size(payload):
+    if payload is None:
+        return 0
+    if isinstance(payload, (bytes, bytearray, memoryview)):
+        return len(payload)
+    if isinstance(payload, str):
+        return len(payload.encode("utf-8"))
+    return len(json.dumps(payload, default=str))
+
+
+class InstrumentedRequest:
+    def __init__(self, request, profiler, endpoint):
+        self.request = request
+        self.profiler = profiler
+        self.endpoint = endpoint
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    def execute(self, *args, **kwargs):
+        start = self.profiler.now()
+        response, error = None, None
+        try:
+            response = self.request.execute(*args, **kwargs)
+            return response
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            self.profiler.record_call(
+                self.endpoint,
+                start,
+                self.profiler.now() - start,
+                payload_size(getattr(self.request, "body", None)),
+                payload_size(response),
+                retries=getattr(self.request, "retries", 0),
+                error=error,
+            )
+
+
+def instrument_services(services, profiler):
+    return wrap_services(services, lambda request, endpoint: InstrumentedRequest(request, profiler, endpoint))
@@ -0,0 +1,121 @@
+"""Batch review of a run: every draft and PDF is generated first, then reviewed at once in a single report.
+
+Reinstatement eligibility can be given up front in a CSV file with the columns "First Name", "Last Name",
+"Eligible" (y/n) and "Prior Termination Reason", instead of being asked for each member.
+"""
+
+import csv
+import html
+import shutil
+from pathlib import Path
+
+from bsc_ops_admin.ledger import get_entry_key
+from bsc_ops_admin.member_directory import normalize_name
+
+REVIEW_FOLDER = Path("down_hours_review")
+
+
+def get_eligibility_key(first_name, last_name):
+    return f"{normalize_name(first_name)} {normalize_name(last_name)}"
+
+
+def load_eligibility_answers(path):
+    # Returns normalized full name -> (eligibility suffix, prior termination reason or None)
+    answers = {}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for line in csv.DictReader(f):
+            eligible = (line.get("Eligible") or "").strip().lower()
+            assert eligible in ["y", "n", ""], f"Invalid eligibility {eligible} for {line['First Name']}"
+            prior_termination_reason = (line.get("Prior Termination Reason") or "").strip() or None
+            answers[get_eligibility_key(line["First Name"], line["Last Name"])] = (
+                "ineligible" if eligible == "n" else "eligible",
+                prior_termination_reason if eligible == "n" else None,
+            )
+    print(f"Loaded reinstatement eligibility for {len(answers)} members from {path}")
+    return answers
+
+
+def get_recipients(entry):
+    return f"To: {entry['format_data']['<EMAIL>']}, Cc: {entry['workshift_manager_email']}"
+
+
+def get_review_pdf_name(entry, pdf):
+    # Members can share a name, so the sheet row keeps their PDFs apart
+    return f"row{get_entry_key(entry)[0]}_{pdf.name}"
+
+
+def write_text_report(entries, path):
+    lines = []
+    for number, entry in enumerate(entries, start=1):
+        format_data = entry["format_data"]
+        lines += [
+            f"[{number}] {format_data['<FULL NAME>']} ({format_data['<HOUSE>']}): {format_data['<ACTION>']}",
+            get_recipients(entry),
+            f"Subject: {entry['subject']}",
+            f"Attachments: {', '.join(get_review_pdf_name(entry, pdf) for pdf in entry['pdf_attachments']) or 'none'}",
+            "",
+            entry["body"],
+            "",
+            "=" * 80,
+            "",
+        ]
+    path.write_text("\n".join(lines))
+
+
+def write_html_report(entries, path):
+    sections = []
+    for number, entry in enumerate(entries, start=1):
+        format_data = entry["format_data"]
+        names = [get_review_pdf_name(entry, pdf) for pdf in entry["pdf_attachments"]]
+        links = " ".join(f'<a href="{html.escape(name)}">{html.escape(name)}</a>' for name in names)
+        sections.append(
+            f"<section><h2>[{number}] {html.escape(format_data['<FULL NAME>'])} "
+            f"({html.escape(format_data['<HOUSE>'])}): {html.escape(format_data['<ACTION>'])}</h2>"
+            f"<p>{html.escape(get_recipients(entry))}<br>Subject: {html.escape(entry['subject'])}"
+            f"<br>Attachments: {links or 'none'}</p>"
+            f"<pre>{html.escape(entry['body'])}</pre></section>"
+        )
+    path.write_text(
+        "<!DOCTYPE html><html><head><meta charset='utf-8'><title>Down hours review</title>"
+        "<style>body { font-family: sans-serif; max-width: 60em; margin: auto; } "
+        "section { border-bottom: 1px solid #ccc; } pre { white-space: pre-wrap; }</style></head>"
+        f"<body><h1>Down hours review: {len(entries)} members</h1>{''.join(sections)}</body></html>"
+    )
+
+
+def write_review_report(entries, folder=REVIEW_FOLDER):
+    # Reports from an earlier run are replaced, so that nothing stale is reviewed by mistake
+    shutil.rmtree(folder, ignore_errors=True)
+    folder.mkdir(parents=True)
+    for entry in entries:
+        for pdf in entry["pdf_attachments"]:
+            pdf.save(folder / get_review_pdf_name(entry, pdf))
+    write_text_report(entries, folder / "report.txt")
+    write_html_report(entries, folder / "report.html")
+    return folder / "report.html", folder / "report.txt"
+
+
+def parse_skipped_numbers(answer, n_entries):
+    # "" approves everything, "none" approves nothing, otherwise the numbers of the members to skip
+    answer = answer.strip().lower()
+    if answer == "":
+        return set()
+    if answer == "none":
+        return set(range(1, n_entries + 1))
+    skipped = {int(number) for number in answer.replace(",", " ").split()}
+    assert skipped <= set(range(1, n_entries + 1)), f"Invalid member numbers {sorted(skipped)}"
+    return skipped
+
+
+def ask_for_approval(entries):
+    while True:
+        answer = input(
+            f"Press Enter to send all {len(entries)}, enter the numbers of the members to skip (e.g. 2 5), "
+            "or 'none' to send nothing: "
+        )
+        try:
+            skipped = parse_skipped_numbers(answer, len(entries))
+            break
+        except (AssertionError, ValueError) as e:
+            print(f"Invalid answer {answer!r}: {e}")
+    return [entry for number, entry in enumerate(entries, start=1) if number not in skipped]
@@ -0,0 +1,163 @@
+"""Central scheduler that every Sheets, Docs and Drive request goes through.
+
+Requests are rate limited with a token bucket per API quota, and retried with exponential backoff and jitter when
+Google answers with 429 (quota exceeded) or a 5xx error, so that big runs slow down instead of failing halfway
+through a member. Writes are only retried after a 429: after a 5xx the write may have been done anyway, and doing
+it again would insert a second row or create a second file.
+"""
+
+import random
+import threading
+import time
+
+from bsc_ops_admin.utils import wrap_services
+
+# Per user quotas, in requests per minute: https://developers.google.com/sheets/api/limits,
+# https://developers.google.com/docs/api/limits and https://developers.google.com/drive/api/guides/limits
+DEFAULT_QUOTAS = {
+    "sheets_read": 60,
+    "sheets_write": 60,
+    "docs_read": 300,
+    "docs_write": 60,
+    "drive": 12000,
+}
+READ_METHODS = {"get", "list", "export_media", "batchGet"}
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# A request that went over the quota was rejected before anything was done
+RETRYABLE_WRITE_STATUSES = {429}
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60
+        # By default up to 10 seconds worth of requests can go out back to back
+        self.capacity = capacity if capacity is not None else max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.clock = clock
+        self.sleep = sleep
+        self.last_refill = clock()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = self.clock()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+
+
+def get_quota_name(endpoint):
+    api, method = endpoint.split(".")[0], endpoint.split(".")[-1]
+    if api == "drive":
+        return "drive"
+    return f"{api}_{'read' if method in READ_METHODS else 'write'}"
+
+
+def is_read(endpoint):
+    return endpoint.split(".")[-1] in READ_METHODS
+
+
+def get_error_status(error):
+    resp = getattr(error, "resp", None)
+    status = getattr(resp, "status", None)
+    return int(status) if status is not None else None
+
+
+def get_retry_after(error):
+    resp = getattr(error, "resp", None)
+    try:
+        return float(resp.get("retry-after")) if resp is not None and resp.get("retry-after") else None
+    except (TypeError, ValueError):
+        return None
+
+
+class RequestScheduler:
+    def __init__(
+        self,
+        quotas=None,
+        max_requests_per_second=None,
+        max_retries=6,
+        base_delay=1.0,
+        max_delay=64.0,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.quotas = dict(DEFAULT_QUOTAS, **(quotas or {}))
+        self.buckets = {name: TokenBucket(rate, clock=clock, sleep=sleep) for name, rate in self.quotas.items()}
+        # Optional ceiling on the total number of requests, across all APIs
+        self.max_requests_per_second = max_requests_per_second
+        self.total_bucket = (
+            TokenBucket(max_requests_per_second * 60, capacity=1, clock=clock, sleep=sleep)
+            if max_requests_per_second
+            else None
+        )
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+
+    def throughput_ceiling(self, quota_name):
+        # Maximum sustainable requests per second for one of the quotas
+        rate = self.quotas[quota_name] / 60
+        if self.max_requests_per_second:
+            rate = min(rate, self.max_requests_per_second)
+        return rate
+
+    def backoff_delay(self, attempt, error):
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return retry_after
+        return min(self.max_delay, self.base_delay * 2**attempt) + random.uniform(0, 1)
+
+    def acquire(self, endpoint):
+        if self.total_bucket is not None:
+            self.total_bucket.acquire()
+        self.buckets[get_quota_name(endpoint)].acquire()
+
+    def execute(self, request, endpoint, *args, **kwargs):
+        # Returns the response and the number of retries it took
+        retryable_statuses = RETRYABLE_STATUSES if is_read(endpoint) else RETRYABLE_WRITE_STATUSES
+        for attempt in range(self.max_retries + 1):
+            self.acquire(endpoint)
+            try:
+                return request.execute(*args, **kwargs), attempt
+            except Exception as e:
+                status = get_error_status(e)
+                if status not in retryable_statuses or attempt == self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt, e)
+                print(f"{endpoint} failed with {status}, retrying in {delay:.1f}s (attempt {attempt + 1})")
+                self.sleep(delay)
+
+
+class ScheduledRequest:
+    def __init__(self, request, scheduler, endpoint):
+        self.request = request
+        self.scheduler = scheduler
+        self.endpoint = endpoint
+        self.retries = 0
+
+    def __getattr__(self, name):
+        return getattr(self.request, name)
+
+    def execute(self, *args, **kwargs):
+        response, self.retries = self.scheduler.execute(self.request, self.endpoint, *args, **kwargs)
+        return response
+
+
+def acquire_quota(request):
+    # For requests that are sent as part of a batch: each one counts against its quota like a request on its own
+    while "request" in vars(request):
+        if isinstance(request, ScheduledRequest):
+            request.scheduler.acquire(request.endpoint)
+            return
+        request = request.request
+
+
+def schedule_services(services, scheduler):
+    return wrap_services(services, lambda request, endpoint: ScheduledRequest(request, scheduler, endpoint))
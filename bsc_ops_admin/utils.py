@@ -1,18 +1,25 @@
+import io
+import json
 import os
 import pickle
+import re
+import subprocess
+import sys
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from urllib.error import HTTPError
 
 from dotenv import load_dotenv
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
 
 ENV_FOLDER = Path(__file__).parent / ".env"
 TEMPLATE_FOLDER = Path(__file__).parent / "templates"
+CACHE_FOLDER = Path(__file__).parent / ".cache"
 SCOPES = ["https://www.googleapis.com/auth/spreadsheets", "https://www.googleapis.com/auth/drive"]
+# Drive recommends resumable uploads only for files over 5MB
+MULTIPART_UPLOAD_MAX_SIZE = 5 * 1024 * 1024
+GOOGLE_API_VERSIONS = {"sheets": "v4", "docs": "v1", "drive": "v3"}
 
 # Load environment variables from .env file
 load_dotenv(ENV_FOLDER / ".env")
@@ -24,9 +31,14 @@ def get_credentials():
         with open(ENV_FOLDER / "token.pickle", "rb") as token:
             creds = pickle.load(token)
     if not creds or not creds.valid:
+        # The google auth libraries are slow to import, so they are only imported when the token needs renewing
         if creds and creds.expired and creds.refresh_token:
+            from google.auth.transport.requests import Request
+
             creds.refresh(Request())
         else:
+            from google_auth_oauthlib.flow import InstalledAppFlow
+
             flow = InstalledAppFlow.from_client_secrets_file(ENV_FOLDER / "credentials.json", SCOPES)
             creds = flow.run_local_server(port=0)
         with open(ENV_FOLDER / "token.pickle", "wb") as token:
@@ -34,31 +46,314 @@ def get_credentials():
     return creds
 
 
+def load_json_cache(path):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except json.JSONDecodeError as e:
+        print(f"Ignoring corrupt cache file {path}: {e}")
+        return None
+
+
+def save_json_cache(path, data):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write to a temporary file first so that a crash never leaves a half written cache behind
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def get_named_path(path, name=None):
+    # A separate file or folder for each named sheet set, e.g. ledger_spring_2025.sqlite3. No name keeps path as is.
+    if name is None:
+        return Path(path)
+    slug = re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+    path = Path(path)
+    return path.with_name(f"{path.stem}_{slug}{path.suffix}")
+
+
+def get_google_service(name, creds):
+    from googleapiclient.discovery import build
+
+    # Use the discovery documents that ship with googleapiclient instead of fetching them
+    return build(name, GOOGLE_API_VERSIONS[name], credentials=creds, static_discovery=True, cache_discovery=False)
+
+
 def get_google_services(creds):
-    sheet_service = build("sheets", "v4", credentials=creds)
-    docs_service = build("docs", "v1", credentials=creds)
-    drive_service = build("drive", "v3", credentials=creds)
-    return {"sheets": sheet_service, "docs": docs_service, "drive": drive_service}
+    return {name: get_google_service(name, creds) for name in GOOGLE_API_VERSIONS}
 
 
-def upload_to_drive(drive_service, file_path, folder_id):
-    file_metadata = {"name": os.path.basename(file_path), "parents": [folder_id]}
-    media = MediaFileUpload(file_path, resumable=True)
+def column_to_index(col):
+    index = 0
+    for char in col.upper():
+        index = index * 26 + ord(char) - ord("A") + 1
+    return index - 1
 
-    try:
-        # First, create the file metadata
-        file = drive_service.files().create(body=file_metadata, fields="id", supportsAllDrives=True).execute()
 
-        # Then, upload the file content
-        drive_service.files().update(fileId=file.get("id"), media_body=media, supportsAllDrives=True).execute()
+def index_to_column(index):
+    col = ""
+    index += 1
+    while index > 0:
+        index, remainder = divmod(index - 1, 26)
+        col = chr(ord("A") + remainder) + col
+    return col
+
+
+class SheetWriteBuffer:
+    """Collects cell updates for a spreadsheet and writes them with a single values().batchUpdate.
+
+    Cells that are adjacent on the same row are merged into one range write.
+    """
+
+    def __init__(self, sheets_service, spreadsheet_id, sheet_name="sheet1"):
+        self.sheets_service = sheets_service
+        self.spreadsheet_id = spreadsheet_id
+        self.sheet_name = sheet_name
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def add(self, col, idx, value):
+        # idx is the 0-indexed row, as in the DataFrame row names
+        with self.lock:
+            self.pending[(idx, column_to_index(col))] = value
+
+    def get_data(self):
+        data = []
+        for idx, col_index in sorted(self.pending):
+            value = self.pending[(idx, col_index)]
+            if data and data[-1]["row"] == idx and data[-1]["end_col_index"] == col_index - 1:
+                data[-1]["values"].append(value)
+                data[-1]["end_col_index"] = col_index
+            else:
+                data.append({"row": idx, "start_col_index": col_index, "end_col_index": col_index, "values": [value]})
+
+        return [
+            {
+                "range": f"{self.sheet_name}!{index_to_column(d['start_col_index'])}{d['row'] + 1}:"
+                f"{index_to_column(d['end_col_index'])}{d['row'] + 1}",
+                "majorDimension": "ROWS",
+                "values": [d["values"]],
+            }
+            for d in data
+        ]
+
+    def flush(self):
+        # The lock is held for the request too, so the service object is only ever used by one thread at a time
+        with self.lock:
+            data = self.get_data()
+            if not data:
+                return None
+
+            result = (
+                self.sheets_service.spreadsheets()
+                .values()
+                .batchUpdate(spreadsheetId=self.spreadsheet_id, body={"valueInputOption": "USER_ENTERED", "data": data})
+                .execute()
+            )
+            self.pending = {}
+        print(f"Wrote {len(data)} ranges to spreadsheet {self.spreadsheet_id}")
+        return result
+
+
+class ThreadLocalGoogleServices(Mapping):
+    """Services mapping like the one from get_google_services, but with separate service objects per thread.
+
+    The HTTP connections underneath googleapiclient services are not thread-safe, so each worker thread builds
+    its own services with make_service(name). Services are only built the first time they are used.
+    """
+
+    def __init__(self, make_service, names=tuple(GOOGLE_API_VERSIONS)):
+        self.make_service = make_service
+        self.names = names
+        self.local = threading.local()
+
+    def __getitem__(self, key):
+        if key not in self.names:
+            raise KeyError(key)
+        if not hasattr(self.local, "services"):
+            self.local.services = {}
+        if key not in self.local.services:
+            self.local.services[key] = self.make_service(key)
+        return self.local.services[key]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+class WrappedResource:
+    """Proxy for a googleapiclient service or resource that passes every request built from it through wrap_request.
+
+    wrap_request(request, endpoint) gets the request object and a name like "sheets.spreadsheets.values.get", and
+    returns an object with the same execute() method.
+    """
 
+    def __init__(self, resource, endpoint, wrap_request):
+        self.resource = resource
+        self.endpoint = endpoint
+        self.wrap_request = wrap_request
+
+    def __getattr__(self, name):
+        attr = getattr(self.resource, name)
+        if not callable(attr):
+            return attr
+
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            endpoint = f"{self.endpoint}.{name}"
+            if hasattr(result, "execute"):
+                return self.wrap_request(result, endpoint)
+            return WrappedResource(result, endpoint, self.wrap_request)
+
+        return wrapper
+
+
+def wrap_services(services, wrap_request):
+    return {name: WrappedResource(service, name, wrap_request) for name, service in services.items()}
+
+
+def unwrap_request(request):
+    # Batch requests need the googleapiclient request itself. Wrappers from wrap_request keep it in .request
+    while "request" in vars(request):
+        request = request.request
+    return request
+
+
+class PdfArtifact:
+    """A rendered PDF, kept in a single in-memory buffer from export through upload to email attachment.
+
+    It is only written to disk when save() is called, e.g. to preview or archive it.
+    """
+
+    mimetype = "application/pdf"
+
+    def __init__(self, name, data, path=None):
+        self.name = name
+        self.data = bytes(data)
+        self.path = path
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path, "rb") as f:
+            return cls(os.path.basename(path), f.read(), path=path)
+
+    @property
+    def view(self):
+        return memoryview(self.data)
+
+    def __len__(self):
+        return len(self.data)
+
+    def save(self, path=None):
+        path = path or self.path or self.name
+        if path != self.path or not os.path.exists(path):
+            with open(path, "wb") as f:
+                f.write(self.view)
+            self.path = path
+        return path
+
+
+def upload_to_drive(drive_service, artifact, folder_id, app_properties=None, file_id=None):
+    # Creates a new file, or replaces the content of file_id. Returns the file ID, or None if the upload failed.
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseUpload
+
+    file_metadata = {"name": artifact.name, "parents": [folder_id]}
+    if app_properties:
+        file_metadata["appProperties"] = app_properties
+    # Small files are sent with their metadata in a single multipart request, only big ones need a resumable upload.
+    # BytesIO shares the artifact's buffer instead of copying it, as long as nothing writes to it.
+    resumable = len(artifact) > MULTIPART_UPLOAD_MAX_SIZE
+    media = MediaIoBaseUpload(io.BytesIO(artifact.data), mimetype=artifact.mimetype, resumable=resumable)
+
+    try:
+        if file_id is None:
+            file = (
+                drive_service.files()
+                .create(body=file_metadata, media_body=media, fields="id", supportsAllDrives=True)
+                .execute()
+            )
+        else:
+            file = drive_service.files().update(fileId=file_id, media_body=media, supportsAllDrives=True).execute()
         print(f'File uploaded successfully. File ID: {file.get("id")}')
         return file.get("id")
-    except HTTPError as error:
+    except HttpError as error:
         print(f"An error occurred while uploading the file: {error}")
         return None
 
 
+def quote_query_value(value):
+    return "'" + str(value).replace("\\", "\\\\").replace("'", "\\'") + "'"
+
+
+def find_uploaded_files(drive_service, folder_id, app_properties):
+    # Maps the name of every file in the folder that has all of app_properties to its file ID
+    query = [f"{quote_query_value(folder_id)} in parents", "trashed=false"] + [
+        f"appProperties has {{ key={quote_query_value(key)} and value={quote_query_value(value)} }}"
+        for key, value in app_properties.items()
+    ]
+    files = {}
+    page_token = None
+    while True:
+        response = (
+            drive_service.files()
+            .list(
+                q=" and ".join(query),
+                fields="nextPageToken, files(id, name)",
+                pageSize=1000,
+                pageToken=page_token,
+                supportsAllDrives=True,
+                includeItemsFromAllDrives=True,
+            )
+            .execute()
+        )
+        for file in response.get("files", []):
+            files[file["name"]] = file["id"]
+        page_token = response.get("nextPageToken")
+        if page_token is None:
+            return files
+
+
+def upload_many(services, artifacts, folder_id, existing_files=None, app_properties=None, max_workers=4):
+    """Uploads PdfArtifacts to a Drive folder. Returns the file IDs, with None for uploads that failed.
+
+    existing_files maps names to the IDs of files that an earlier run uploaded for the same artifacts (see
+    find_uploaded_files). Those are replaced in place instead of being uploaded a second time. app_properties are set
+    on the new files. services should be a ThreadLocalGoogleServices if max_workers > 1.
+    """
+    existing_files = existing_files or {}
+
+    def upload(artifact):
+        file_id = existing_files.get(artifact.name)
+        if file_id is not None:
+            print(f"Replacing {artifact.name} in Google Drive, it was uploaded before with file ID: {file_id}")
+        return upload_to_drive(services["drive"], artifact, folder_id, app_properties, file_id)
+
+    if max_workers <= 1 or len(artifacts) <= 1:
+        return [upload(artifact) for artifact in artifacts]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(upload, artifacts))
+
+
+def open_file(path, mac_app=None):
+    # Opens the file in the default viewer, or in mac_app (e.g. "Preview") on macOS
+    path = str(path)
+    if sys.platform == "darwin":
+        command = ["open"] + (["-a", mac_app] if mac_app else []) + [path]
+    elif sys.platform == "win32":
+        os.startfile(path)
+        return
+    else:
+        command = ["xdg-open", path]
+    subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
 def get_current_semester_year():
     current_date = datetime.now()
 
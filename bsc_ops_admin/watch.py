@@ -0,0 +1,142 @@
+"""Keeps running and processes new down hours entries as soon as they show up.
+
+Instead of reading the whole down hours sheet every time, each poll only asks Drive for the sheet's version, which
+goes up with every edit. The pipeline runs when the version changed since the version seen before the last run, so
+responses that come in during a run are picked up at the next poll, or when the last run is older than
+--max-run-age. Follow up emails that have become due are sent at every poll. The credentials, services and SMTP
+connection are created once and reused for every run.
+
+Nobody is there to answer questions, so runs are non-interactive: there is no preview before sending, and
+reinstatement eligibility is read from the --eligibility CSV. Members who aren't in it are left pending.
+"""
+
+import argparse
+import time
+import traceback
+from contextlib import nullcontext
+from datetime import datetime, timezone
+
+from bsc_ops_admin.follow_ups import send_due_follow_ups
+from bsc_ops_admin.job_queue import JobQueue
+from bsc_ops_admin.mailer import Mailer
+from bsc_ops_admin.process_new_down_hours import DOCUMENT_IDS, get_run_services, process_new_down_hour_entries
+from bsc_ops_admin.review import load_eligibility_answers
+from bsc_ops_admin.utils import CACHE_FOLDER, load_json_cache, save_json_cache
+
+WATCH_STATE_PATH = CACHE_FOLDER / "watch_state.json"
+DEFAULT_POLL_INTERVAL = 5 * 60
+DEFAULT_MAX_RUN_AGE = 24 * 60 * 60
+
+
+def get_sheet_metadata(drive_service, file_id=DOCUMENT_IDS["down_hours_spreadsheet"]):
+    return drive_service.files().get(fileId=file_id, fields="version,modifiedTime", supportsAllDrives=True).execute()
+
+
+def get_run_reason(state, metadata, now, max_run_age):
+    if state is None:
+        return "first run"
+    if metadata["version"] != state["version"]:
+        return f"sheet changed (modified {metadata['modifiedTime']})"
+    if now - state["last_run"] > max_run_age:
+        return f"last run was {(now - state['last_run']) / 3600:.1f} hours ago"
+    return None
+
+
+def watch(
+    poll_interval=DEFAULT_POLL_INTERVAL,
+    max_run_age=DEFAULT_MAX_RUN_AGE,
+    incremental=False,
+    services=None,
+    mailer=None,
+    max_polls=None,
+    clock=time.time,
+    sleep=time.sleep,
+    job_queue=None,
+    eligibility_path=None,
+):
+    services = services if services is not None else get_run_services()
+    state = load_json_cache(WATCH_STATE_PATH)
+    if state is not None:
+        last_run = datetime.fromtimestamp(state["last_run"], timezone.utc).astimezone()
+        print(f"Last run was at {last_run:%Y-%m-%d %H:%M}, at sheet version {state['version']}")
+
+    mailer_context = Mailer() if mailer is None else nullcontext(mailer)
+    job_queue_context = JobQueue(clock=clock) if job_queue is None else nullcontext(job_queue)
+    with mailer_context as mailer, job_queue_context as job_queue:
+        polls = 0
+        next_poll = clock()
+        while max_polls is None or polls < max_polls:
+            now = clock()
+            # If the machine was asleep, all of the polls that were missed are caught up on with this single one
+            missed = int((now - next_poll) // poll_interval)
+            if missed > 0:
+                print(f"Missed {missed} polls, checking for changes now")
+
+            try:
+                metadata = get_sheet_metadata(services["drive"])
+                reason = get_run_reason(state, metadata, now, max_run_age)
+                if reason is not None:
+                    print(f"Processing new down hours entries: {reason}")
+                    # Read every run, so answers added while watching are used
+                    eligibility_answers = load_eligibility_answers(eligibility_path) if eligibility_path else None
+                    process_new_down_hour_entries(
+                        incremental=incremental,
+                        services=services,
+                        mailer=mailer,
+                        eligibility_answers=eligibility_answers,
+                        interactive=False,
+                    )
+                    # The version from before the run, so edits made during it trigger another run. Our own writes
+                    # do too, but that run stops as soon as it sees there is nothing pending.
+                    state = {"version": metadata["version"], "last_run": now}
+                    save_json_cache(WATCH_STATE_PATH, state)
+            except Exception:
+                # Keep watching, the run is retried at the next poll since the state wasn't updated
+                traceback.print_exc()
+
+            try:
+                sent, failed = send_due_follow_ups(job_queue, mailer)
+                if sent or failed:
+                    print(f"Sent {sent} due follow ups, {failed} failed")
+            except Exception:
+                traceback.print_exc()
+
+            polls += 1
+            next_poll = max(next_poll + poll_interval, clock())
+            if max_polls is None or polls < max_polls:
+                sleep(max(0.0, next_poll - clock()))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Keep running and process new down hours entries as they come in")
+    parser.add_argument(
+        "--interval", type=float, default=DEFAULT_POLL_INTERVAL, help="Seconds between checks for changes"
+    )
+    parser.add_argument(
+        "--max-run-age",
+        type=float,
+        default=DEFAULT_MAX_RUN_AGE,
+        help="Process the sheet at least this often (in seconds), even if it doesn't seem to have changed",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only read the rows added since the last run, reusing the cached history of processed rows. "
+        "The whole spreadsheet is still read once a day, to catch edits to older rows",
+    )
+    parser.add_argument(
+        "--eligibility",
+        help="CSV with the reinstatement eligibility of members (First Name, Last Name, Eligible, "
+        "Prior Termination Reason), read before every run. Members who aren't in it are left pending",
+    )
+    args = parser.parse_args()
+
+    try:
+        watch(
+            poll_interval=args.interval,
+            max_run_age=args.max_run_age,
+            incremental=args.incremental,
+            eligibility_path=args.eligibility,
+        )
+    except KeyboardInterrupt:
+        print("Stopped watching")
@@ -0,0 +1,32 @@
+import pytest
+
+import bsc_ops_admin.process_new_down_hours as pdh
+from bsc_ops_admin import fakes, job_queue, ledger
+
+
+@pytest.fixture
+def down_hours_header():
+    return list(fakes.DOWN_HOURS_HEADER)
+
+
+@pytest.fixture
+def fifteen_day_notice_header():
+    return [list(row) for row in fakes.FIFTEEN_DAY_NOTICE_HEADER]
+
+
+@pytest.fixture
+def make_backend():
+    return fakes.make_backend
+
+
+@pytest.fixture
+def offline_run(tmp_path, monkeypatch):
+    # Like the benchmark: non-interactive, no limit on pending rows, and caches kept in tmp_path
+    monkeypatch.setattr(pdh, "SAFE_MODE", False)
+    monkeypatch.setattr(pdh, "MAX_PENDING_ROWS", float("inf"))
+    monkeypatch.setattr(pdh, "EMAIL_TEMPLATES_CACHE_PATH", tmp_path / "templates.json")
+    monkeypatch.setattr(pdh, "DOWN_HOURS_CURSOR_PATH", tmp_path / "cursor.json")
+    monkeypatch.setattr(ledger, "LEDGER_PATH", tmp_path / "ledger.sqlite3")
+    monkeypatch.setattr(job_queue, "JOB_QUEUE_PATH", tmp_path / "jobs.sqlite3")
+    monkeypatch.setattr("builtins.input", lambda *args: "")
+    monkeypatch.chdir(tmp_path)
@@ -0,0 +1,67 @@
+from collections import Counter
+
+import pytest
+
+from bsc_ops_admin.batch_rendering import fill_pdfs_in_batches
+from bsc_ops_admin.fakes import FakeDocsService, FakeGoogleBackend
+from bsc_ops_admin.scheduler import RequestScheduler, schedule_services
+
+TEMPLATE_IDS = ["template_a", "template_b"]
+
+
+class CountingScheduler(RequestScheduler):
+    def __init__(self):
+        super().__init__(sleep=lambda seconds: None)
+        self.acquired = Counter()
+
+    def acquire(self, endpoint):
+        self.acquired[endpoint] += 1
+        super().acquire(endpoint)
+
+
+class FailingBatchDocsService(FakeDocsService):
+    def new_batch_http_request(self, callback=None):
+        batch = super().new_batch_http_request(callback)
+
+        def execute(num_retries=0):
+            raise ConnectionError("connection reset")
+
+        batch.execute = execute
+        return batch
+
+
+def make_backend():
+    backend = FakeGoogleBackend()
+    for document_id in TEMPLATE_IDS:
+        backend.add_document(document_id, text=f"{document_id} for <FIRST NAME>")
+    return backend
+
+
+def make_jobs(n):
+    return [(f"pdf{i}.pdf", {"<FIRST NAME>": f"First{i}"}, TEMPLATE_IDS[i % 2]) for i in range(n)]
+
+
+def test_every_sub_request_counts_against_the_quota():
+    backend = make_backend()
+    scheduler = CountingScheduler()
+    results = fill_pdfs_in_batches(schedule_services(backend.services(), scheduler), make_jobs(5))
+
+    assert [result.name for result in results] == [f"pdf{i}.pdf" for i in range(5)]
+    assert set(backend.files) == set(TEMPLATE_IDS)
+    for endpoint in [
+        "drive.files.copy",
+        "docs.documents.batchUpdate",
+        "drive.files.export_media",
+        "drive.files.delete",
+    ]:
+        assert scheduler.acquired[endpoint] == 5
+
+
+def test_copies_are_deleted_when_a_batch_fails():
+    backend = make_backend()
+    services = backend.services()
+    services["docs"] = FailingBatchDocsService(backend)
+    with pytest.raises(ConnectionError):
+        fill_pdfs_in_batches(services, make_jobs(5))
+    # Only the templates are left
+    assert set(backend.files) == set(TEMPLATE_IDS)
@@ -0,0 +1,36 @@
+import pandas as pd
+
+from bsc_ops_admin.compact_sheet import CompactSheet
+
+HEADER = ["Timestamp", "Name", "Hours", "Note"]
+DATE_FORMATS = {"A": "%m/%d/%Y %H:%M:%S"}
+
+
+def test_pages_with_short_rows_match_padding_the_rows():
+    pages = [
+        [HEADER, ["01/15/2024 10:00:00", "Ann", "10"], ["01/16/2024 10:00:00"]],
+        [["01/17/2024 10:00:00", "Bo", "", "late"], [], ["01/15/2024 10:00:00", "Ann"]],
+    ]
+    df = CompactSheet(pages).to_df(float32_columns=["C"], date_formats=DATE_FORMATS)
+
+    rows = [row + [None] * (len(HEADER) - len(row)) for page in pages for row in page][1:]
+    expected = pd.DataFrame(rows, columns=HEADER, index=pd.RangeIndex(1, len(rows) + 1), dtype=object)
+    expected["Timestamp"] = pd.to_datetime(expected["Timestamp"], format=DATE_FORMATS["A"])
+    expected["Hours"] = pd.to_numeric(expected["Hours"].replace("", None)).astype("float32")
+    pd.testing.assert_frame_equal(df, expected)
+
+
+def test_cells_that_are_not_dates_are_reported_with_their_rows(capsys):
+    rows = [["01/15/2024 10:00:00"], ["1/15/24"], [""], [], ["1/15/24"], ["soon"]]
+    df = CompactSheet([[HEADER] + rows]).to_df(date_formats=DATE_FORMATS)
+
+    assert df["Timestamp"].isnull().tolist() == [False, True, True, True, True, True]
+    out = capsys.readouterr().out
+    # Sheet rows, below the header, and empty or missing cells are not reported
+    assert "3 cells of column 'Timestamp'" in out
+    assert out.strip().endswith("rows 3, 6, 7")
+
+
+def test_no_warning_when_all_dates_parse(capsys):
+    CompactSheet([[HEADER, ["01/15/2024 10:00:00"], [""]]]).to_df(date_formats=DATE_FORMATS)
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,129 @@
+import pytest
+
+from bsc_ops_admin import process_new_down_hours as pdh
+from bsc_ops_admin.fakes import FakeGoogleBackend, FakeMailer
+from bsc_ops_admin.process_new_down_hours import (
+    DOCUMENT_IDS,
+    FIFTEEN_DAY_NOTICE_COLUMNS_BY_DATA,
+    PENDING_TERMINATION_ACTION,
+    POTENTIAL_TERMINATION_ACTION,
+    update_15_day_notice_spreadsheet,
+)
+
+SPREADSHEET_ID = DOCUMENT_IDS["15_day_notice_spreadsheet"]
+EARLIER_NOTICES = [
+    ["", "Old", "Notice", "old.notice@berkeley.edu", "CLO", "01/02/2024", "01/17/2024", "Workshift", "Potential"],
+    ["", "Older", "Notice", "older.notice@berkeley.edu", "KNG", "01/01/2024", "01/16/2024", "Workshift", "Pending"],
+]
+
+
+def insert_notice_row_by_row(sheets_service, format_data):
+    # How each member used to be added: a row inserted after the header, then one updateCells per non-empty cell
+    requests = [
+        {
+            "insertDimension": {
+                "range": {"sheetId": 0, "dimension": "ROWS", "startIndex": 2, "endIndex": 3},
+                "inheritFromBefore": False,
+            }
+        }
+    ]
+    sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"requests": requests}).execute()
+    requests = []
+    for data_key, column in FIFTEEN_DAY_NOTICE_COLUMNS_BY_DATA.items():
+        if data_key == "<CURRENT REASON>":
+            value = "Workshift"
+        elif data_key == "<ACTION>":
+            value = "Potential" if format_data[data_key] == POTENTIAL_TERMINATION_ACTION else "Pending"
+        else:
+            value = format_data[data_key]
+        if value:
+            requests.append(
+                {
+                    "updateCells": {
+                        "range": {
+                            "sheetId": 0,
+                            "startRowIndex": 2,
+                            "endRowIndex": 3,
+                            "startColumnIndex": ord(column) - ord("A"),
+                            "endColumnIndex": ord(column) - ord("A") + 1,
+                        },
+                        "rows": [{"values": [{"userEnteredValue": {"stringValue": str(value)}}]}],
+                        "fields": "userEnteredValue",
+                    }
+                }
+            )
+    sheets_service.spreadsheets().batchUpdate(spreadsheetId=SPREADSHEET_ID, body={"requests": requests}).execute()
+
+
+def make_format_data(i):
+    return {
+        "<FIRST NAME>": f"First{i}",
+        "<LAST NAME>": f"Last{i}",
+        "<FULL NAME>": f"First{i} Last{i}",
+        "<EMAIL>": f"member{i}@berkeley.edu",
+        # Empty cells are left empty either way
+        "<HOUSE>": "" if i == 2 else ["CLO", "STB", "DAV"][i % 3],
+        "<DATE>": "09/02/2024",
+        "<DATE (+15 days)>": "09/17/2024",
+        "<ACTION>": [POTENTIAL_TERMINATION_ACTION, PENDING_TERMINATION_ACTION][i % 2],
+    }
+
+
+def make_sheets_service(header):
+    backend = FakeGoogleBackend()
+    backend.add_spreadsheet(SPREADSHEET_ID, header + EARLIER_NOTICES)
+    return backend, backend.services()["sheets"]
+
+
+def test_bulk_insert_matches_inserting_row_by_row(fifteen_day_notice_header):
+    format_data_list = [make_format_data(i) for i in range(7)]
+
+    row_by_row_backend, sheets_service = make_sheets_service(fifteen_day_notice_header)
+    for format_data in format_data_list:
+        insert_notice_row_by_row(sheets_service, format_data)
+
+    bulk_backend, sheets_service = make_sheets_service(fifteen_day_notice_header)
+    update_15_day_notice_spreadsheet(sheets_service, format_data_list)
+
+    expected = row_by_row_backend.spreadsheets[SPREADSHEET_ID]
+    assert bulk_backend.spreadsheets[SPREADSHEET_ID] == expected
+    # The last member is on top, and the earlier notices are moved down below the new ones
+    assert [row[3] for row in expected[2:]] == [f"member{i}@berkeley.edu" for i in reversed(range(7))] + [
+        "old.notice@berkeley.edu",
+        "older.notice@berkeley.edu",
+    ]
+    assert bulk_backend.stats.calls["sheets.spreadsheets.batchUpdate"] == 1
+    assert row_by_row_backend.stats.calls["sheets.spreadsheets.batchUpdate"] == 14
+
+
+def test_nothing_to_insert(fifteen_day_notice_header):
+    backend, sheets_service = make_sheets_service(fifteen_day_notice_header)
+    update_15_day_notice_spreadsheet(sheets_service, [])
+    assert backend.spreadsheets[SPREADSHEET_ID] == fifteen_day_notice_header + EARLIER_NOTICES
+    assert backend.stats.calls["sheets.spreadsheets.batchUpdate"] == 0
+
+
+def test_down_hours_are_not_written_when_the_15_day_notices_fail(offline_run, make_backend, monkeypatch):
+    backend = make_backend(n_pending=6, n_history=30, latency=0, seed=3)
+    down_hours_id = DOCUMENT_IDS["down_hours_spreadsheet"]
+    before = [list(row) for row in backend.spreadsheets[down_hours_id]]
+
+    def fail(sheets_service, format_data_list, spreadsheet_id=SPREADSHEET_ID):
+        if format_data_list:
+            raise TimeoutError("15 day notices")
+
+    monkeypatch.setattr(pdh, "FLUSH_WRITES_PER_MEMBER", False)
+    monkeypatch.setattr(pdh, "update_15_day_notice_spreadsheet", fail)
+    with pytest.raises(TimeoutError):
+        pdh.process_new_down_hour_entries(services=backend.services(), mailer=FakeMailer(backend))
+    # The rows are left pending, so the next run writes the notices and the down hours together
+    assert backend.spreadsheets[down_hours_id] == before
+
+    monkeypatch.setattr(pdh, "update_15_day_notice_spreadsheet", update_15_day_notice_spreadsheet)
+    mailer = FakeMailer(backend)
+    entries = pdh.process_new_down_hour_entries(services=backend.services(), mailer=mailer)
+    notices = [entry for entry in entries if entry["format_data"]["<ACTION>"] != pdh.COURTESY_NOTICE_ACTION]
+    assert notices
+    assert len(backend.spreadsheets[SPREADSHEET_ID]) == 2 + len(notices)
+    # Everyone was emailed by the first run already
+    assert mailer.sent == []
@@ -0,0 +1,63 @@
+import pytest
+
+from bsc_ops_admin import process_new_down_hours as pdh
+
+SPREADSHEET_ID = pdh.DOCUMENT_IDS["down_hours_spreadsheet"]
+
+
+@pytest.fixture(autouse=True)
+def cursor_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdh, "DOWN_HOURS_CURSOR_PATH", tmp_path / "down_hours_cursor.json")
+
+
+@pytest.fixture
+def action(down_hours_header):
+    return down_hours_header.index("Action")
+
+
+def read_incrementally(backend, now):
+    return pdh.fetch_down_hours_values_incrementally(backend.services()["sheets"], clock=lambda: now)
+
+
+def read_all(backend):
+    return pdh.fetch_down_hours_values(backend.services()["sheets"])
+
+
+def test_new_rows_are_read_after_the_cached_history(make_backend, action):
+    backend = make_backend(n_pending=0, n_history=50, latency=0)
+    assert read_incrementally(backend, now=0) == read_all(backend)
+
+    grid = backend.spreadsheets[SPREADSHEET_ID]
+    grid.append(list(grid[5][:action]))
+    backend.stats.calls.clear()
+    values = read_incrementally(backend, now=60)
+    assert values == read_all(backend)
+    assert len(values) == 52
+    assert backend.stats.calls["sheets.spreadsheets.values.get"] == 2  # The incremental read and read_all
+
+
+def test_edits_to_old_rows_are_seen_after_the_max_age(make_backend, action):
+    backend = make_backend(n_pending=0, n_history=50, latency=0)
+    read_incrementally(backend, now=0)
+
+    grid = backend.spreadsheets[SPREADSHEET_ID]
+    grid[10][action] = pdh.POTENTIAL_TERMINATION_ACTION if grid[10][action] != pdh.POTENTIAL_TERMINATION_ACTION else ""
+    # Only the last cached row is checked before the max age, so the edit isn't seen yet
+    assert read_incrementally(backend, now=pdh.DOWN_HOURS_HISTORY_MAX_AGE - 1) != read_all(backend)
+    assert read_incrementally(backend, now=pdh.DOWN_HOURS_HISTORY_MAX_AGE) == read_all(backend)
+
+    # The next full read is another max age later
+    grid[20][action] = pdh.COURTESY_NOTICE_ACTION if grid[20][action] != pdh.COURTESY_NOTICE_ACTION else ""
+    assert read_incrementally(backend, now=2 * pdh.DOWN_HOURS_HISTORY_MAX_AGE - 1) != read_all(backend)
+    assert read_incrementally(backend, now=2 * pdh.DOWN_HOURS_HISTORY_MAX_AGE) == read_all(backend)
+
+
+def test_cursor_without_check_time_is_checked_again(make_backend, action):
+    backend = make_backend(n_pending=0, n_history=50, latency=0)
+    read_incrementally(backend, now=0)
+    cursor = pdh.load_json_cache(pdh.DOWN_HOURS_CURSOR_PATH)
+    del cursor["verified_at"]
+    pdh.save_json_cache(pdh.DOWN_HOURS_CURSOR_PATH, cursor)
+
+    backend.spreadsheets[SPREADSHEET_ID][10][action] = ""
+    assert read_incrementally(backend, now=60) == read_all(backend)
@@ -0,0 +1,133 @@
+import io
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.sax.saxutils import escape, unescape
+
+import pytest
+
+from bsc_ops_admin import local_rendering
+from bsc_ops_admin.fakes import FakeGoogleBackend
+from bsc_ops_admin.local_rendering import fill_docx, forget_loaded_templates, get_cached_template
+
+FORM_DATA = {
+    "<FIRST NAME>": "Ann",
+    "<LAST NAME>": "O'Neil & <Co>",
+    "<DATE>": "09/02/2024",
+    "<DATE (+1 week)>": "09/09/2024",
+    # Values are put in as they are, even if they contain another placeholder
+    "<FULL NAME>": "<FIRST NAME> O'Neil",
+}
+
+# Paragraphs of the template, each as the text of its runs
+PARAGRAPHS = {
+    "one run": ["Dear <FIRST NAME> <LAST NAME>,"],
+    "split in two": ["Dear <FIRST", " NAME>, due <DATE>"],
+    "split in three": ["Signed: <", "FULL NA", "ME>"],
+    "split at the brackets": ["<", "DATE (+1 week)", ">", " and <DATE", ">"],
+    "repeated": ["<DATE><DATE> <DA", "TE>"],
+    "case sensitive": ["<first name> stays"],
+    "no placeholders": ["Nothing to see ", "here & there"],
+    "empty runs": ["", "<LAST ", "", "NAME>", ""],
+}
+
+
+def make_docx(paragraphs):
+    body = "".join(
+        "<w:p>" + "".join(f"<w:r><w:t>{escape(text)}</w:t></w:r>" for text in runs) + "</w:p>" for runs in paragraphs
+    )
+    output = io.BytesIO()
+    with zipfile.ZipFile(output, "w") as docx:
+        docx.writestr(
+            "word/document.xml",
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>",
+        )
+    return output.getvalue()
+
+
+def read_docx_paragraphs(docx):
+    with zipfile.ZipFile(io.BytesIO(docx)) as docx_zip:
+        xml = docx_zip.read("word/document.xml").decode("utf-8")
+    return [
+        "".join(unescape(text) for text in re.findall(r"<w:t(?:\s[^>]*)?>(.*?)</w:t>", paragraph, re.DOTALL))
+        for paragraph in re.findall(r"<w:p>.*?</w:p>", xml, re.DOTALL)
+    ]
+
+
+def fill_with_docs(text, form_data):
+    # What the Docs API makes of the same text with the replaceAllText requests fill_pdf sends, one per placeholder,
+    # applied in order. Each one replaces every case sensitive occurrence in the text as it is at that point.
+    for key, value in form_data.items():
+        text = text.replace(key, str(value))
+    return text
+
+
+@pytest.mark.parametrize("name", PARAGRAPHS)
+def test_fill_docx_matches_replace_all_text(name):
+    runs = PARAGRAPHS[name]
+    filled = read_docx_paragraphs(fill_docx(make_docx([runs]), FORM_DATA))
+    assert filled == [fill_with_docs("".join(runs), FORM_DATA)]
+
+
+def test_fill_docx_whole_document():
+    paragraphs = list(PARAGRAPHS.values())
+    filled = read_docx_paragraphs(fill_docx(make_docx(paragraphs), FORM_DATA))
+    expected = fill_with_docs("\n".join("".join(runs) for runs in paragraphs), FORM_DATA)
+    assert filled == expected.split("\n")
+
+
+def test_fill_docx_keeps_spaces_at_the_edges_of_runs():
+    docx = fill_docx(make_docx([["<FIRST NAME>", " ", "<LAST NAME>"]]), {"<FIRST NAME>": "A ", "<LAST NAME>": " B"})
+    with zipfile.ZipFile(io.BytesIO(docx)) as docx_zip:
+        xml = docx_zip.read("word/document.xml").decode("utf-8")
+    # Without xml:space="preserve", Word drops leading and trailing spaces of a run
+    assert xml.count('xml:space="preserve"') == 3
+    assert read_docx_paragraphs(docx) == ["A   B"]
+
+
+def test_edited_template_is_downloaded_again_in_the_next_run(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_rendering, "TEMPLATE_FOLDER", tmp_path)
+    backend = FakeGoogleBackend()
+    backend.add_document("template", text="Old <FIRST NAME>")
+    drive_service = backend.services()["drive"]
+
+    forget_loaded_templates()
+    assert read_docx_paragraphs(get_cached_template(drive_service, "template")) == ["Old <FIRST NAME>"]
+    backend.files["template"]["text"] = "New <FIRST NAME>"
+    backend.touch("template")
+    # Within a run, the template is only checked against Drive once
+    assert read_docx_paragraphs(get_cached_template(drive_service, "template")) == ["Old <FIRST NAME>"]
+
+    forget_loaded_templates()
+    assert read_docx_paragraphs(get_cached_template(drive_service, "template")) == ["New <FIRST NAME>"]
+    assert backend.stats.calls["drive.files.export_media"] == 2
+
+
+def test_threads_that_need_the_same_template_share_one_download(tmp_path, monkeypatch):
+    monkeypatch.setattr(local_rendering, "TEMPLATE_FOLDER", tmp_path)
+    backend = FakeGoogleBackend(latency=0.01)
+    backend.add_document("template", text="Dear <FIRST NAME>")
+    backend.add_document("other", text="Hi <FIRST NAME>")
+
+    forget_loaded_templates()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        templates = list(
+            executor.map(
+                lambda document_id: get_cached_template(backend.services()["drive"], document_id),
+                ["template", "other"] * 8,
+            )
+        )
+    assert [read_docx_paragraphs(template) for template in templates[:2]] == [
+        ["Dear <FIRST NAME>"],
+        ["Hi <FIRST NAME>"],
+    ]
+    assert backend.stats.calls["drive.files.export_media"] == 2
+    # No temporary files are left next to the cached templates
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "other.docx",
+        "other.json",
+        "template.docx",
+        "template.json",
+    ]
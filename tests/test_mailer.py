@@ -0,0 +1,157 @@
+import email
+import socket
+import socketserver
+import threading
+
+import pytest
+
+from bsc_ops_admin.mailer import Mailer, build_email_message
+
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+    # Just enough SMTP for smtplib: EHLO with AUTH PLAIN, AUTH, MAIL, RCPT, DATA, RSET, NOOP and QUIT
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.open_sockets.append(self.request)
+        self.reply("220 localhost ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii").strip().split(" ")[0].upper()
+            if command == "EHLO":
+                self.reply("250-localhost")
+                self.reply("250 AUTH PLAIN")
+            elif command == "AUTH":
+                with server.lock:
+                    server.logins += 1
+                self.reply("235 2.7.0 Accepted")
+            elif command == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data = b""
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line == b".\r\n":
+                        break
+                    data += data_line[1:] if data_line.startswith(b"..") else data_line
+                with server.lock:
+                    server.messages.append(email.message_from_bytes(data))
+                    drop = server.drops_after_data > 0
+                    server.drops_after_data -= drop
+                if drop:
+                    # The message got through, but the connection is gone before the client hears about it
+                    return
+                self.reply("250 OK")
+            elif command == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("250 OK")
+
+
+class SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), SMTPHandler)
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.logins = 0
+        self.messages = []
+        self.open_sockets = []
+        self.drops_after_data = 0
+
+    def drop_connections(self):
+        # Like a server closing idle connections, without telling the client
+        with self.lock:
+            for sock in self.open_sockets:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self.open_sockets = []
+
+
+@pytest.fixture
+def smtp_server():
+    server = SMTPServer()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_mailer(server):
+    return Mailer(
+        sender_email="opsadmin@bsc.coop",
+        password="password",
+        host="127.0.0.1",
+        port=server.server_address[1],
+        use_tls=False,
+    )
+
+
+def make_message(i):
+    return build_email_message(
+        "opsadmin@bsc.coop", f"member{i}@berkeley.edu", ["cloworkshift@bsc.coop"], f"Notice {i}", "Hi", []
+    )
+
+
+def test_messages_share_one_connection_and_login(smtp_server):
+    with make_mailer(smtp_server) as mailer:
+        results = mailer.send_many([make_message(i) for i in range(25)])
+
+    assert [result["sent"] for result in results] == [True] * 25
+    assert smtp_server.connections == 1
+    assert smtp_server.logins == 1
+    assert [message["Subject"] for message in smtp_server.messages] == [f"Notice {i}" for i in range(25)]
+    assert smtp_server.messages[3]["To"] == "member3@berkeley.edu"
+
+
+def test_reconnects_after_the_connection_is_dropped(smtp_server):
+    with make_mailer(smtp_server) as mailer:
+        first = mailer.send_many([make_message(i) for i in range(3)])
+        smtp_server.drop_connections()
+        second = mailer.send_many([make_message(i) for i in range(3, 6)])
+
+    assert [result["sent"] for result in first + second] == [True] * 6
+    assert all(result["error"] is None for result in second)
+    assert smtp_server.connections == 2
+    assert smtp_server.logins == 2
+    assert [message["Subject"] for message in smtp_server.messages] == [f"Notice {i}" for i in range(6)]
+
+
+def test_send_fails_without_a_server():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    mailer = Mailer(password="password", host="127.0.0.1", port=port, use_tls=False)
+    result = mailer.send(make_message(0))
+    assert not result["sent"]
+    assert "ConnectionRefusedError" in result["error"]
+
+
+def test_message_is_not_sent_again_if_the_connection_drops_during_data(smtp_server):
+    smtp_server.drops_after_data = 1
+    with make_mailer(smtp_server) as mailer:
+        results = mailer.send_many([make_message(i) for i in range(3)])
+
+    # The server may have accepted the first message, so it is reported as unknown instead of being sent twice
+    assert [result["status"] for result in results] == ["unknown", "sent", "sent"]
+    assert not results[0]["sent"]
+    assert "SMTPServerDisconnected" in results[0]["error"]
+    assert [message["Subject"] for message in smtp_server.messages] == [f"Notice {i}" for i in range(3)]
+    assert smtp_server.connections == 2
+
+
+def test_mailer_needs_a_password(monkeypatch):
+    monkeypatch.delenv("EMAIL_PASSWORD", raising=False)
+    with pytest.raises(ValueError, match="EMAIL_PASSWORD"):
+        Mailer(host="127.0.0.1", use_tls=False)
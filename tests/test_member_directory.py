@@ -0,0 +1,36 @@
+import math
+
+from bsc_ops_admin.member_directory import MemberDirectory, build_member_index
+
+PERSON_LIST_EXPORT = """First Name,Last Name,Permanent Email
+Ann,O'Neil,ann@berkeley.edu
+,Nance,no.first.name@berkeley.edu
+Nan,Nance,nan.nance@berkeley.edu
+None,,no.last.name@berkeley.edu
+Nan
+José-Luis,Garcia,jose@berkeley.edu
+"""
+
+
+def make_directory(tmp_path):
+    path = tmp_path / "PersonListExport.csv"
+    path.write_text(PERSON_LIST_EXPORT, encoding="utf-8")
+    return MemberDirectory(build_member_index(path))
+
+
+def test_people_with_a_missing_name_are_left_out(tmp_path):
+    directory = make_directory(tmp_path)
+    assert directory.index == {
+        "o neil": {"ann": "ann@berkeley.edu"},
+        "nance": {"nan": "nan.nance@berkeley.edu"},
+        "garcia": {"jose luis": "jose@berkeley.edu"},
+    }
+
+
+def test_missing_names_in_the_sheet_are_not_matched(tmp_path):
+    directory = make_directory(tmp_path)
+    assert directory.lookup("Jose Luis", "García") == ("jose@berkeley.edu", "jose luis garcia", True)
+    # A missing first name used to be looked up as "nan" or "none", which finds Nan Nance
+    assert directory.lookup(math.nan, "Nance") == (None, None, False)
+    assert directory.lookup(None, "Nance") == (None, None, False)
+    assert directory.lookup("Ann", math.nan) == (None, None, False)
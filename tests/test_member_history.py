@@ -0,0 +1,77 @@
+import random
+
+import pandas as pd
+
+from bsc_ops_admin.process_new_down_hours import (
+    COURTESY_NOTICE_ACTION,
+    PENDING_TERMINATION_ACTION,
+    POTENTIAL_TERMINATION_ACTION,
+    plan_down_hours,
+)
+
+N_ROWS = 100_000
+N_PENDING = 300
+N_MEMBERS = N_ROWS // 3
+ACTIONS = [COURTESY_NOTICE_ACTION, POTENTIAL_TERMINATION_ACTION, PENDING_TERMINATION_ACTION]
+
+
+def make_down_hours_df(header):
+    # Like get_down_hours_df: a header row, then rows that are cut short after their last non-empty cell
+    rng = random.Random(1)
+    values = [header]
+    for _ in range(N_ROWS):
+        member = rng.randrange(N_MEMBERS)
+        values.append(
+            [
+                "01/15/2024 10:00:00",
+                "clowm@bsc.coop",
+                f"last{member}",
+                f"first{member}",
+                f"member{member}@berkeley.edu",
+                "CLO",
+                str(rng.choice([10, 12, 15, 18, 25])),
+                "No",
+                rng.choice(ACTIONS),
+                "01/16/2024",
+            ]
+        )
+    # Pending rows are spread over the whole history, so each one has a different number of rows above it
+    for i in rng.sample(range(1, len(values)), N_PENDING):
+        values[i] = values[i][: header.index("House")] + ["", values[i][6]]
+    df = pd.DataFrame(values)
+    df.columns = df.iloc[0]
+    return df.drop(0)
+
+
+def had_prior_cc_by_scanning(row, full_df):
+    # How the prior conditional contract check used to be done, by scanning all rows above the row
+    member_email = row["Member's Email"].strip()
+    to_check = full_df.iloc[0 : row.name]
+    prior_cc = to_check[
+        (to_check["Member's Email"] == member_email) & (to_check["Action"] == POTENTIAL_TERMINATION_ACTION)
+    ]
+    return len(prior_cc) > 0
+
+
+def test_prior_cc_matches_scanning_the_history(down_hours_header):
+    full_df = make_down_hours_df(down_hours_header)
+    df = full_df[full_df["Action"].isnull()]
+    assert len(df) == N_PENDING
+
+    plan = plan_down_hours(df, full_df)
+    expected = [had_prior_cc_by_scanning(row, full_df) for _, row in df.iterrows()]
+    assert plan["had_prior_cc"].tolist() == expected
+    # Both outcomes are covered
+    assert 0 < sum(expected) < N_PENDING
+    assert (plan["existing_cc"] == "Yes").tolist() == expected
+    assert (plan.loc[plan["had_prior_cc"], "action"] != POTENTIAL_TERMINATION_ACTION).all()
+
+
+def test_prior_cc_ignores_later_rows(down_hours_header):
+    full_df = make_down_hours_df(down_hours_header)
+    # A conditional contract below a row doesn't count for it, even for the same member
+    first = full_df[full_df["Action"] == POTENTIAL_TERMINATION_ACTION].iloc[0]
+    earlier = full_df.loc[[first.name - 1]].assign(**{"Member's Email": first["Member's Email"], "Action": None})
+    plan = plan_down_hours(earlier, full_df, strict=False)
+    assert not plan["had_prior_cc"].iloc[0]
+    assert not had_prior_cc_by_scanning(earlier.iloc[0], full_df)
@@ -0,0 +1,30 @@
+from types import SimpleNamespace
+
+from bsc_ops_admin.review import write_review_report
+from bsc_ops_admin.utils import PdfArtifact
+
+
+def make_entry(row_label, email):
+    return {
+        "row": SimpleNamespace(name=row_label),
+        "format_data": {
+            "<FULL NAME>": "Alex Kim",
+            "<HOUSE>": "CLO",
+            "<ACTION>": "Conditional Contract",
+            "<EMAIL>": email,
+        },
+        "workshift_manager_email": "cloworkshift@bsc.coop",
+        "subject": "Down hours",
+        "body": "Hi Alex",
+        "pdf_attachments": [PdfArtifact("cc_Alex_Kim.pdf", email.encode())],
+    }
+
+
+def test_members_with_the_same_name_keep_their_own_pdfs(tmp_path):
+    entries = [make_entry(4, "alex.kim@berkeley.edu"), make_entry(9, "akim@berkeley.edu")]
+    report_path, text_report_path = write_review_report(entries, tmp_path / "review")
+
+    assert (tmp_path / "review" / "row5_cc_Alex_Kim.pdf").read_bytes() == b"alex.kim@berkeley.edu"
+    assert (tmp_path / "review" / "row10_cc_Alex_Kim.pdf").read_bytes() == b"akim@berkeley.edu"
+    assert 'href="row10_cc_Alex_Kim.pdf"' in report_path.read_text()
+    assert "Attachments: row5_cc_Alex_Kim.pdf" in text_report_path.read_text()
@@ -0,0 +1,52 @@
+import pytest
+
+from bsc_ops_admin.scheduler import RequestScheduler
+
+
+class Response(dict):
+    def __init__(self, status):
+        super().__init__(status=str(status))
+        self.status = status
+
+
+class HttpError(Exception):
+    # Like googleapiclient.errors.HttpError, as far as the scheduler looks at it
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.resp = Response(status=status)
+
+
+class FlakyRequest:
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.executions = 0
+
+    def execute(self):
+        self.executions += 1
+        if self.statuses:
+            raise HttpError(self.statuses.pop(0))
+        return {"ok": True}
+
+
+def make_scheduler():
+    return RequestScheduler(sleep=lambda seconds: None)
+
+
+@pytest.mark.parametrize("status", [429, 500, 503])
+def test_reads_are_retried(status):
+    request = FlakyRequest(status, status)
+    assert make_scheduler().execute(request, "sheets.spreadsheets.values.get") == ({"ok": True}, 2)
+
+
+@pytest.mark.parametrize(
+    "endpoint",
+    ["sheets.spreadsheets.batchUpdate", "drive.files.create", "drive.files.copy", "docs.documents.batchUpdate"],
+)
+def test_writes_are_only_retried_when_over_the_quota(endpoint):
+    assert make_scheduler().execute(FlakyRequest(429), endpoint) == ({"ok": True}, 1)
+
+    # After a 5xx the write may have gone through, so it isn't sent again
+    request = FlakyRequest(503)
+    with pytest.raises(HttpError):
+        make_scheduler().execute(request, endpoint)
+    assert request.executions == 1
@@ -0,0 +1,51 @@
+from bsc_ops_admin import process_new_down_hours as pdh
+from bsc_ops_admin.fakes import FakeGoogleBackend, FakeMailer
+from bsc_ops_admin.utils import PdfArtifact, find_uploaded_files, upload_many
+
+FOLDER_ID = "pdfs"
+ENTRY = {"downHoursRow": "12", "memberEmail": "o'neil@berkeley.edu", "semester": "Fall 2024"}
+
+
+def make_pdfs(version):
+    return [PdfArtifact(name, f"{name} {version}".encode()) for name in ["cc_Ann_O'Neil.pdf", "notice_Ann_O'Neil.pdf"]]
+
+
+def test_files_found_by_their_entry_are_replaced_in_place():
+    backend = FakeGoogleBackend()
+    drive_service = backend.services()["drive"]
+    file_ids = upload_many({"drive": drive_service}, make_pdfs(1), FOLDER_ID, app_properties=ENTRY, max_workers=1)
+    # Another member's PDF in the same folder
+    upload_many({"drive": drive_service}, make_pdfs(1)[:1], FOLDER_ID, app_properties=dict(ENTRY, downHoursRow="13"))
+
+    existing_files = find_uploaded_files(drive_service, FOLDER_ID, ENTRY)
+    assert existing_files == dict(zip(["cc_Ann_O'Neil.pdf", "notice_Ann_O'Neil.pdf"], file_ids))
+    assert upload_many({"drive": drive_service}, make_pdfs(2), FOLDER_ID, existing_files, ENTRY) == file_ids
+    assert len(backend.files) == 3
+    assert backend.files[file_ids[1]]["content"] == b"notice_Ann_O'Neil.pdf 2"
+    assert backend.stats.calls["drive.files.create"] == 3
+    assert backend.stats.calls["drive.files.update"] == 2
+
+
+class FailingMailer(FakeMailer):
+    def send(self, message):
+        return {"to": message["To"], "sent": False, "status": "failed", "error": "SMTPRecipientsRefused"}
+
+
+def get_uploaded_pdfs(backend):
+    return {file_id: file for file_id, file in backend.files.items() if pdh.PDFS_FOLDER_ID in file["parents"]}
+
+
+def test_pdfs_of_a_notice_that_was_never_emailed_are_replaced(offline_run, make_backend):
+    backend = make_backend(n_pending=4, n_history=30, latency=0, seed=5)
+    entries = pdh.process_new_down_hour_entries(services=backend.services(), mailer=FailingMailer(backend))
+    assert not any(entry["email_result"]["sent"] for entry in entries)
+    uploaded = get_uploaded_pdfs(backend)
+    assert len(uploaded) == sum(len(entry["pdf_attachments"]) for entry in entries) > 0
+
+    mailer = FakeMailer(backend)
+    entries = pdh.process_new_down_hour_entries(services=backend.services(), mailer=mailer)
+    assert all(entry["email_result"]["sent"] for entry in entries)
+    # The drafts are made again, and their PDFs replace the ones from the first run
+    assert get_uploaded_pdfs(backend).keys() == uploaded.keys()
+    assert sorted(file_id for entry in entries for file_id in entry["drive_file_ids"]) == sorted(uploaded)
+    assert backend.stats.calls["drive.files.update"] == len(uploaded)
@@ -0,0 +1,69 @@
+import pytest
+
+from bsc_ops_admin import process_new_down_hours as pdh
+from bsc_ops_admin import watch
+from bsc_ops_admin.fakes import FakeMailer
+
+DOWN_HOURS_ID = pdh.DOCUMENT_IDS["down_hours_spreadsheet"]
+
+
+@pytest.fixture(autouse=True)
+def watch_state_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(watch, "WATCH_STATE_PATH", tmp_path / "watch_state.json")
+
+
+def run_watch(backend, polls, **kwargs):
+    watch.watch(
+        services=backend.services(),
+        mailer=FakeMailer(backend),
+        max_polls=polls,
+        clock=lambda: 0.0,
+        sleep=lambda seconds: None,
+        **kwargs,
+    )
+
+
+def test_edits_during_a_run_are_processed_at_the_next_poll(offline_run, make_backend, monkeypatch):
+    backend = make_backend(n_pending=0, n_history=20, latency=0)
+    runs = []
+
+    def process(**kwargs):
+        runs.append(kwargs)
+        if len(runs) == 1:
+            # A response comes in while the first run is going
+            backend.touch(DOWN_HOURS_ID)
+
+    monkeypatch.setattr(watch, "process_new_down_hour_entries", process)
+    run_watch(backend, polls=3)
+    assert len(runs) == 2
+    assert all(not run["interactive"] for run in runs)
+
+
+def test_runs_without_asking_anything(offline_run, make_backend, monkeypatch, tmp_path):
+    backend = make_backend(n_pending=8, n_history=30, latency=0, seed=5)
+    pending = backend.spreadsheets[DOWN_HOURS_ID][-8:]
+    # Only the first of them has an answer in the eligibility CSV
+    eligibility_path = tmp_path / "eligibility.csv"
+    eligibility_path.write_text(f"First Name,Last Name,Eligible\n{pending[0][3]},{pending[0][2]},n\n")
+
+    def no_input(*args):
+        raise EOFError("nobody is there")
+
+    terminations = [pdh.POTENTIAL_TERMINATION_ACTION, pdh.PENDING_TERMINATION_ACTION]
+    monkeypatch.setattr(pdh, "SAFE_MODE", True)
+    monkeypatch.setattr("builtins.input", no_input)
+    entries = []
+    monkeypatch.setattr(
+        watch,
+        "process_new_down_hour_entries",
+        lambda **kwargs: entries.extend(pdh.process_new_down_hour_entries(**kwargs)),
+    )
+    run_watch(backend, polls=1, eligibility_path=eligibility_path)
+
+    # Seed 5 gives the first pending row and three others a termination action, the other four a courtesy notice
+    actions = [entry["format_data"]["<ACTION>"] for entry in entries]
+    assert actions.count(pdh.COURTESY_NOTICE_ACTION) == 4
+    assert [
+        entry["format_data"]["<EMAIL>"] for entry in entries if entry["format_data"]["<ACTION>"] in terminations
+    ] == [pending[0][4]]
+    assert all(entry["email_result"]["sent"] for entry in entries)